@@ -0,0 +1,18 @@
+function y = PredictRankSoftmaxBatch(args)
+%PREDICTRANKSOFTMAXBATCH Predicts the rank to play for many feature vectors
+%   Y = PREDICTRANKSOFTMAXBATCH(ARGS) is the batch version of
+%   PREDICTRANKSOFTMAX. ARGS.x holds ARGS.n feature vectors of 42 features
+%   each, concatenated into a single 1x(42*n) array. Y is an nx11 matrix whose
+%   i-th row is the ranking of the ranks for the i-th feature vector, best
+%   guess first.
+
+    load softmax_parameters.mat;
+    
+    n_features = 42;
+    x = reshape(args.x, n_features, args.n)';
+    x(:, 1) = 1;
+
+    % Normalizing the probabilities doesn't change the ranking
+    [~, y] = sort(x*theta_rank, 2, 'descend');
+    y = y-1;
+end
@@ -0,0 +1,18 @@
+function y = PredictSuitSoftmaxBatch(args)
+%PREDICTSUITSOFTMAXBATCH Predicts the suit to play for many feature vectors
+%   Y = PREDICTSUITSOFTMAXBATCH(ARGS) is the batch version of
+%   PREDICTSUITSOFTMAX. ARGS.x holds ARGS.n feature vectors of 30 features
+%   each, concatenated into a single 1x(30*n) array. Y is an nx4 matrix whose
+%   i-th row is the ranking of the suits for the i-th feature vector, best
+%   guess first.
+
+    load softmax_parameters.mat;
+    
+    n_features = 30;
+    x = reshape(args.x, n_features, args.n)';
+    x(:, 1) = 1;
+
+    % Normalizing the probabilities doesn't change the ranking
+    [~, y] = sort(x*theta_suit, 2, 'descend');
+    y = y-1;
+end
@@ -0,0 +1,502 @@
+import sys
+import asyncio
+import traceback
+
+import instrument
+
+from card import *
+from rules import *
+from player import *
+from globals import *
+from game_log import *
+from predictor import *
+from networking import *
+from protocol import *
+from bidding import *
+from skat_server import parse_algos, count_bots, send_timeout, smart_bot, \
+    open_log_file, player_line, rules_line, round_line, result_line, \
+    declarer_text, settlement_line
+
+# Port the Skat client connects to
+DEFAULT_PORT = 50007
+
+# Bot methods that play out sample games, see bidding.estimate_games
+BIDDING_METHODS = ("get_bet", "hide_cards", "get_rules")
+
+class AsyncConnection:
+    """
+    A client connection on the event loop. Speaks the same
+    framed messages as networking.Connection, and likewise
+    queues outgoing messages until the next flush.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.pending = []
+
+    async def recv_msg(self):
+        """
+        Receives a message, letting other tables run while
+        waiting for it.
+        """
+        try:
+            await self.flush()
+            header = await self.reader.readexactly(HEADER_SIZE)
+            return await self.reader.readexactly(decode_header(header))
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            raise IOError("Network connection failure")
+
+    async def recv_text(self):
+        return decode_text(await self.recv_msg())
+
+    def send_msg(self, msg):
+        """
+        Queues a message to be sent on the next flush.
+        """
+        self.pending.append(encode_frame(msg))
+
+    def send_text(self, text):
+        self.send_msg(encode_text(text))
+
+    async def flush(self):
+        """
+        Writes all queued messages at once and waits until
+        they have been handed to the socket.
+        """
+        if self.pending:
+            self.writer.write(b"".join(self.pending))
+            self.pending = []
+        try:
+            await self.writer.drain()
+        except ConnectionError:
+            raise IOError("Network connection failure")
+
+    def close(self):
+        if self.pending:
+            self.writer.write(b"".join(self.pending))
+            self.pending = []
+        self.writer.close()
+
+    def abort(self):
+        """
+        Closes the connection, dropping any queued messages.
+        """
+        self.pending = []
+        self.writer.transport.abort()
+
+class AsyncHumanPlayer(Player):
+    """
+    A human Skat player connected to the asyncio server. Same
+    as HumanPlayer, except that waiting for input doesn't
+    block the other tables.
+    """
+
+    def __init__(self, pid, hand, conn, name):
+        """
+        Initializes a human player with an ID, hand and the
+        connection they already sent their name over.
+        """
+        super(AsyncHumanPlayer, self).__init__(pid, hand)
+        self.conn = conn
+        self.name = name
+
+        # Send hand to player client
+        self.conn.send_msg(encode_hand(self.hand))
+
+    async def get_bet(self, bid):
+        self.conn.send_text("Bid " + str(bid) + "? (y/n/sb/rb)")
+        bet = await self.conn.recv_text()
+        print("Received " + bet + " from " + self.name)
+        return bet
+
+    async def hide_cards(self, skat):
+        self.conn.send_msg(encode_hand(skat))
+
+        # Receive hidden cards from the player client
+        hidden = decode_hand(await self.conn.recv_msg())
+        self.hand.extend(skat)
+        self.hand.remove(hidden[0])
+        self.hand.remove(hidden[1])
+        self.hand.sort()
+
+        # Add the hidden cards to player's cards won
+        self.cards_won.extend(hidden)
+
+    async def get_rules(self):
+        trumps = await self.conn.recv_text()
+        return BaseRules(self.pid, trumps)
+
+    async def get_play(self, previous_plays, rules):
+        with instrument.span("network.get_play"):
+            self.conn.send_text("Your turn")
+            self.conn.send_msg(encode_plays(previous_plays))
+            card = decode_card(await self.conn.recv_msg())
+        self.hand.remove(card)
+        return card
+
+class Table:
+    """
+    One game of Skat on the asyncio server. Follows the same
+    flow as skat_server.main: decide the declarer, decide the
+    game, then play 10 rounds.
+    """
+
+    def __init__(self, table_id, clients, player_args):
+        """
+        Deals a new game to the given clients, a list of
+        (connection, name) pairs. Seats are filled up with
+        bots.
+        """
+        self.table_id = table_id
+        self.player_args = player_args
+        self.timeout = send_timeout(player_args)
+
+        # Rules and rounds played so far, for bots taking over
+        # from players who drop out
+        self.rules = None
+        self.rounds = []
+
+        # Generate hands
+        deck = Card.shuffle_deck(Card.get_deck())
+        hands = [sorted(deck[0:10]), sorted(deck[10:20]), sorted(deck[20:30])]
+        self.skat = deck[30:32]
+        self.dealt = [list(hand) for hand in hands]
+
+        self.players = {}
+        for i, (conn, name) in enumerate(clients):
+            self.players[i + 1] = AsyncHumanPlayer(i + 1, hands[i], conn, name)
+        for i in range(len(clients), 3):
+            self.players[i + 1] = smart_bot(i + 1, hands[i], "Bot",
+                                            player_args, verbose = False)
+
+    def log(self, msg):
+        print("[Table %d] %s" % (self.table_id, msg))
+
+    def conns(self):
+        """
+        Returns the connections of the human players still
+        at the table.
+        """
+        return [player.conn for player in self.players.values()
+                if isinstance(player, AsyncHumanPlayer)]
+
+    def broadcast_text(self, text, log = False):
+        for conn in self.conns():
+            conn.send_text(text)
+        if log:
+            self.log(text)
+
+    def broadcast_msg(self, msg):
+        for conn in self.conns():
+            conn.send_msg(msg)
+
+    async def flush(self):
+        """
+        Flushes all human players' connections at once. Players
+        who can't keep up within the send timeout are replaced
+        by bots.
+        """
+        humans = [player for player in self.players.values()
+                  if isinstance(player, AsyncHumanPlayer)]
+        results = await asyncio.gather(*[asyncio.wait_for(player.conn.flush(),
+                                                          self.timeout)
+                                         for player in humans],
+                                       return_exceptions = True)
+        for player, result in zip(humans, results):
+            if isinstance(result, Exception):
+                self.replace_with_bot(player)
+
+    def replace_with_bot(self, human):
+        """
+        Same as skat_server.replace_with_bot.
+        """
+        bot = smart_bot(human.pid, human.hand, human.name, self.player_args,
+                        verbose = False)
+        bot.cards_won = human.cards_won
+        for plays in self.rounds:
+            bot.see_round(plays, self.rules)
+        self.players[human.pid] = bot
+        human.conn.abort()
+        self.log(human.name + " dropped out and was replaced by a bot")
+
+    async def call(self, player, method, *args):
+        """
+        Calls a player method. Human players are awaited, bots
+        are called directly, except for bots using Matlab or
+        searching, which run in a thread so the event loop isn't
+        held up by the round trip to the Matlab server or the
+        search. Bidding and declaring play out sample games for
+        every bot, so those always run in a thread.
+        """
+        if isinstance(player, AsyncHumanPlayer):
+            return await getattr(player, method)(*args)
+        if (method in BIDDING_METHODS or isinstance(player, PIMCPlayer) or
+                uses_matlab(player.suit_algo) or uses_matlab(player.rank_algo)):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, getattr(player, method),
+                                              *args)
+        return getattr(player, method)(*args)
+
+    async def decide_declarer(self):
+        """
+        Same as skat_server.decide_declarer. Players who answer
+        "sb" or "rb" leave the table and are replaced by bots.
+        """
+        auction = Auction()
+        question = auction.question()
+        while question:
+            pid, bid = question
+            player = self.players[pid]
+            response = await self.call(player, "get_bet", bid)
+            if response == "sb": # Smart bot
+                self.players[pid] = smart_bot(pid, player.hand,
+                                              "SmartBot" + str(pid),
+                                              self.player_args,
+                                              verbose = False)
+                player.conn.close()
+                response = await self.call(self.players[pid], "get_bet", bid)
+            elif response == "rb": # Random bot
+                self.players[pid] = BotPlayer(pid, player.hand,
+                                              "DumbBot" + str(pid),
+                                              verbose = False)
+                player.conn.close()
+                response = await self.call(self.players[pid], "get_bet", bid)
+            auction.answer(response == "y")
+            question = auction.question()
+        if auction.declarer_id is None:
+            return None, 0
+        return self.players[auction.declarer_id], auction.bid
+
+    async def decide_game(self, declarer):
+        """
+        Same as skat_server.decide_game.
+        """
+        await self.call(declarer, "hide_cards", self.skat)
+        return await self.call(declarer, "get_rules")
+
+    async def play_round(self, rules, pid):
+        """
+        Same as skat_server.play_round. Returns the plays made
+        in the round and the ID of the winner.
+        """
+        plays = []
+        for i in range(0, 3):
+
+            # Make play
+            for player in self.players.values():
+                if player == self.players[pid]:
+                    continue
+                if isinstance(player, AsyncHumanPlayer):
+                    announce = "Waiting for " + self.players[pid].name + " to play..."
+                    player.conn.send_text(announce)
+            await self.flush()
+            try:
+                card = await self.call(self.players[pid], "get_play", plays, rules)
+            except IOError:
+                self.replace_with_bot(self.players[pid])
+                card = await self.call(self.players[pid], "get_play", plays, rules)
+            plays.append(Play(pid = pid, card = card))
+
+            # Broadcast state of round
+            self.broadcast_text(self.players[pid].name + " played ")
+            self.broadcast_msg(encode_card(card))
+
+            # Choose next player
+            pid = (pid + 1) if (pid + 1) < 4 else 1
+
+        # Who won the round?
+        winning_play = rules.winning_play(plays)
+        winner = self.players[winning_play.pid]
+        self.broadcast_text(winner.name + " won the round!\n")
+        winner.cards_won.extend([play.card for play in plays])
+
+        # Update cards seen
+        for player in self.players.values():
+            if isinstance(player, BotPlayer):
+                player.see_round(plays, rules)
+
+        await self.flush()
+        return plays, winner.pid
+
+    async def play(self, writer = None):
+        """
+        Plays the game. Appends it to the given binary game
+        log writer, if any. Returns whether a game was played.
+        """
+        await self.flush()
+        declarer, bid = await self.decide_declarer()
+        if not declarer:
+            self.broadcast_text("Nobody is playing")
+            self.log("Nobody is playing")
+            return False
+        lines = [player_line(player) for player in self.players.values()]
+        for player in self.players.values():
+            if isinstance(player, AsyncHumanPlayer):
+                player.conn.send_text(declarer_text(player, declarer, bid))
+        self.log(declarer.name + " is playing for " + str(bid) + "!")
+        await self.flush()
+        declarer = self.players[declarer.pid]
+
+        # What are we playing?
+        rules = await self.decide_game(declarer)
+        self.rules = rules
+        self.broadcast_text("\n" + declarer.name + " is playing " + str(rules) + "\n",
+                           log = True)
+        self.broadcast_msg(encode_rules(rules))
+        lines.append(rules_line(declarer, rules))
+
+        # Play 10 rounds
+        pid = 1
+        rounds = self.rounds
+        for r in range(0, 10):
+            plays, pid = await self.play_round(rules, pid)
+            rounds.append(plays)
+            lines.append(round_line(plays))
+
+        # Print what everyone won
+        for player in self.players.values():
+            self.broadcast_text(result_line(player, rules), log = True)
+        settlement = settle(rules, self.dealt[declarer.pid - 1] + self.skat,
+                            declarer.cards_won, bid)
+        self.broadcast_text(settlement_line(declarer, rules, settlement), log = True)
+        await self.flush()
+
+        # Each table gets its own text log file, written in one
+        # go so games finishing at the same time don't mix
+        with instrument.span("log.write"):
+            file = open_log_file(self.player_args, "-" + str(self.table_id))
+            file.write("".join(lines))
+            file.close()
+            if writer:
+                writer.write_game(self.dealt, declarer.pid, rules.game_type,
+                                  self.skat, rounds)
+                writer.flush()
+        return True
+
+    def close(self):
+        for conn in self.conns():
+            conn.close()
+
+class TableServer:
+    """
+    Accepts clients continuously and seats them at tables as
+    soon as enough of them are waiting. Every table runs as
+    its own task on the event loop.
+    """
+
+    def __init__(self, player_args):
+        self.player_args = player_args
+        self.humans_per_table = max(1, 3 - count_bots(player_args))
+        self.waiting = []
+        self.tables = set()
+        self.n_tables = 0
+        self.n_games = 0
+
+        # All tables append to the same binary game log
+        self.writer = None
+        if '-g' in player_args:
+            index = player_args.index('-g')
+            self.writer = GameLogWriter(player_args[index + 1])
+
+    async def handle_client(self, reader, writer):
+        """
+        Reads the name of a new client and puts them in the
+        waiting list.
+        """
+        conn = AsyncConnection(reader, writer)
+        try:
+            name = await conn.recv_text()
+        except IOError:
+            conn.close()
+            return
+        print(name + " connected")
+        self.waiting.append((conn, name))
+        if len(self.waiting) >= self.humans_per_table:
+            clients = self.waiting[:self.humans_per_table]
+            del self.waiting[:self.humans_per_table]
+            self.n_tables += 1
+            task = asyncio.ensure_future(self.run_table(self.n_tables, clients))
+            self.tables.add(task)
+            task.add_done_callback(self.tables.discard)
+
+    async def run_table(self, table_id, clients):
+        """
+        Plays one game at a new table. A failing table (e.g.
+        a client disconnecting) is closed without affecting
+        the others.
+        """
+        table = Table(table_id, clients, self.player_args)
+        table.log("Seated " + ", ".join(name for conn, name in clients))
+        try:
+            with instrument.span("table.game"):
+                played = await table.play(self.writer)
+            if played:
+                self.n_games += 1
+        except Exception:
+            table.log("Game aborted")
+            traceback.print_exc(file = sys.stdout)
+        finally:
+            table.close()
+
+    async def serve(self, port):
+        instrument.install_loop(asyncio.get_running_loop())
+        server = await asyncio.start_server(self.handle_client, port = port,
+                                            reuse_address = True)
+        print("Waiting for players to connect...")
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+
+def main(argv):
+    """
+    Runs a Skat server that hosts any number of games at the
+    same time. Clients are seated at a new table in the order
+    they connect. Each table plays one game, after which its
+    clients are disconnected like with skat_server.py.
+
+    Arguments are the same as for skat_server.py, plus:
+    'p [port]' - Port to listen on (default 50007)
+    'mi [number]' - Number of Matlab servers to start for bots
+                    using Matlab algorithms (default 1). Bots at
+                    different tables then use them in parallel.
+    """
+    port = DEFAULT_PORT
+    if '-p' in argv:
+        index = argv.index('-p')
+        port = int(argv[index + 1])
+
+    server = TableServer(argv)
+    try:
+        asyncio.run(server.serve(port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        print("Played %d games at %d tables" % (server.n_games, server.n_tables))
+    return 0
+
+if __name__ == "__main__":
+    # Print timings on exit or SIGUSR1
+    instrument.install()
+
+    # Only start Matlab if one of the bot algorithms needs it
+    algos = parse_algos(sys.argv)
+    matlab = any(uses_matlab(algo) for algo in algos)
+    try:
+        if matlab:
+            if '-mi' in sys.argv:
+                index = sys.argv.index('-mi')
+                mlab.set_instances(int(sys.argv[index + 1]))
+            mlab.start()
+        status = main(sys.argv)
+    except Exception:
+        traceback.print_exc(file = sys.stdout)
+        status = 1
+    finally:
+        if matlab:
+            mlab.stop()
+    sys.exit(status)
@@ -0,0 +1,308 @@
+import io
+import os
+import sys
+import copy
+import json
+import time
+import random
+import shutil
+import platform
+import tempfile
+import contextlib
+
+import numpy as np
+
+from card import *
+from rules import *
+from player import *
+from globals import *
+from predictor import *
+from solver import Solver
+from simulator import play_games
+from bidding import bid_limit
+from feature_extractor import read_game, process_log_file
+from batch_features import read_records, extract_records
+
+# Every benchmark is run at least REPEAT times and for at least
+# MIN_TIME seconds, and the fastest run counts, which filters
+# out most of the noise from other processes
+REPEAT = 5
+MIN_TIME = 1.0
+
+# A benchmark regresses if it gets slower than the baseline by
+# more than this fraction
+DEFAULT_TOLERANCE = 0.2
+
+# Prediction algorithm used by the prediction and game benchmarks
+ALGO = "numpy:softmax"
+
+# Number of deals the solver benchmark solves from the first
+# trick. Their solving times vary a lot, so it takes a few.
+SOLVER_DEALS = 5
+
+def measure(func, repeat = REPEAT):
+    """
+    Runs func at least 'repeat' times and for at least
+    MIN_TIME seconds. Returns the time of the fastest run in
+    seconds.
+    """
+    best = None
+    runs = 0
+    total = 0.0
+    while runs < repeat or total < MIN_TIME:
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+        runs += 1
+        total += elapsed
+    return best
+
+def random_tricks(n, rng):
+    """
+    Returns n random game situations as tuples of (rules,
+    hand, plays so far), with 0 to 2 cards played in the
+    current trick.
+    """
+    cases = []
+    for i in range(0, n):
+        deck = Card.shuffle_deck(Card.get_deck(), rng)
+        rules = BaseRules(1, rng.choice("cshd"))
+        plays = [Play(pid = pid, card = deck[10 + pid])
+                 for pid in range(0, rng.randint(0, 2))]
+        cases.append((rules, deck[0:10], plays))
+    return cases
+
+def corpus_decisions(log_folder):
+    """
+    Replays the games in the given log folder and returns the
+    decisions made in them that feature extraction looks at,
+    as tuples of (player before the play, plays so far, card
+    played, rules).
+    """
+    decisions = []
+    for name in sorted(os.listdir(log_folder)):
+        try:
+            with open(os.path.join(log_folder, name), "r") as log_file:
+                players, rules, rounds = read_game(log_file)
+        except Exception:
+            continue
+        for plays in rounds:
+            for i in range(0, 3):
+                player = players[plays[i].pid]
+                if plays[i].pid != rules.declarer_id:
+                    # The module-level random generator can't be
+                    # copied, so share it
+                    snapshot = copy.deepcopy(player, {id(player.rng): player.rng})
+                    decisions.append((snapshot, plays[0:i], plays[i].card, rules))
+                player.hand.remove(plays[i].card)
+            winner = players[rules.winning_play(plays).pid]
+            winner.cards_won.extend(play.card for play in plays)
+            for player in players.values():
+                player.see_round(plays, rules)
+    return decisions
+
+def bench_valid(rng):
+    cases = random_tricks(2000, rng)
+    def run():
+        for rules, hand, plays in cases:
+            for card in hand:
+                rules.valid(card, hand, plays)
+    return measure(run), 10 * len(cases), "calls"
+
+def bench_winning_play(rng):
+    cases = []
+    for rules, hand, plays in random_tricks(5000, rng):
+        cases.append((rules, [Play(pid = 1, card = hand[0]),
+                              Play(pid = 2, card = hand[1]),
+                              Play(pid = 3, card = hand[2])]))
+    def run():
+        for rules, plays in cases:
+            rules.winning_play(plays)
+    return measure(run), len(cases), "calls"
+
+def bench_examine_suit(decisions):
+    def run():
+        for player, plays, card, rules in decisions:
+            player.examine_suit(plays, card, rules)
+    return measure(run), len(decisions), "calls"
+
+def bench_examine_rank(decisions):
+    def run():
+        for player, plays, card, rules in decisions:
+            player.examine_rank(plays, card, rules)
+    return measure(run), len(decisions), "calls"
+
+def bench_process_log_file(log_folder):
+    paths = [os.path.join(log_folder, name) for name in sorted(os.listdir(log_folder))]
+    out_folder = tempfile.mkdtemp()
+    suit_path = os.path.join(out_folder, "suit.txt")
+    rank_path = os.path.join(out_folder, "rank.txt")
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            for path in paths:
+                process_log_file(path, suit_path, rank_path)
+    try:
+        return measure(run), len(paths), "files"
+    finally:
+        shutil.rmtree(out_folder)
+
+def bench_batch_features(log_folder):
+    records = read_records(log_folder)
+    def run():
+        extract_records(records)
+    return measure(run), len(records), "games"
+
+def bench_predict(target, columns, rng):
+    rows = [tuple(rng.randint(0, 3) for i in range(0, columns))
+            for j in range(0, 2000)]
+    load_model(ALGO, target)
+    def run():
+        for row in rows:
+            predict_uncached(ALGO, row, target)
+    return measure(run), len(rows), "calls"
+
+def bench_predict_batch(target, columns, rng):
+    rows = np.array([[rng.randint(0, 3) for i in range(0, columns)]
+                     for j in range(0, 20000)])
+    load_model(ALGO, target)
+    def run():
+        predict_batch(ALGO, rows, target)
+    return measure(run), len(rows), "rows"
+
+def bench_bid_limit(rng):
+    hands = []
+    for i in range(0, 100):
+        deck = list(range(0, 32))
+        rng.shuffle(deck)
+        hands.append(sum(1 << card for card in deck[0:10]))
+    def run():
+        bids = random.Random(0)
+        for i, hand in enumerate(hands):
+            bid_limit(hand, i % 3, bids)
+    return measure(run), len(hands), "hands"
+
+def bench_solver(rng):
+    deals = []
+    for i in range(0, SOLVER_DEALS):
+        deck = list(range(0, 32))
+        rng.shuffle(deck)
+        hands = [sum(1 << card for card in deck[10 * seat:10 * seat + 10])
+                 for seat in range(0, 3)]
+        deals.append((hands, rng.randrange(0, GAME_TYPES), rng.randint(1, 3)))
+    def run():
+        for hands, game_type, declarer_id in deals:
+            Solver(game_type, declarer_id).solve(hands, 1)
+    return measure(run, 1), len(deals), "deals"
+
+def bench_games(algo, n_games):
+    def run():
+        play_games((0, n_games, 1, algo, algo, False, False, None))
+    return measure(run, 3), n_games, "games"
+
+def run_benchmarks(log_folder, n_games):
+    """
+    Runs all benchmarks. Returns a dictionary mapping each
+    benchmark name to its throughput (operations per second)
+    and the unit of its operations.
+    """
+    rng = random.Random(0)
+    decisions = corpus_decisions(log_folder)
+    benchmarks = [
+        ("rules.valid", lambda: bench_valid(rng)),
+        ("rules.winning_play", lambda: bench_winning_play(rng)),
+        ("examine_suit", lambda: bench_examine_suit(decisions)),
+        ("examine_rank", lambda: bench_examine_rank(decisions)),
+        ("process_log_file", lambda: bench_process_log_file(log_folder)),
+        ("batch_features", lambda: bench_batch_features(log_folder)),
+        ("predict.suit", lambda: bench_predict("suit", 30, rng)),
+        ("predict.rank", lambda: bench_predict("rank", 42, rng)),
+        ("predict_batch.suit", lambda: bench_predict_batch("suit", 30, rng)),
+        ("predict_batch.rank", lambda: bench_predict_batch("rank", 42, rng)),
+        ("bid_limit", lambda: bench_bid_limit(rng)),
+        ("solver.full_deal", lambda: bench_solver(rng)),
+        ("games.random", lambda: bench_games(None, n_games)),
+        ("games.softmax", lambda: bench_games(ALGO, n_games)),
+    ]
+    results = {}
+    for name, bench in benchmarks:
+        seconds, n_ops, unit = bench()
+        results[name] = {"ops_per_sec": n_ops / seconds, "unit": unit}
+        print("%-20s %12.1f %s/s" % (name, n_ops / seconds, unit))
+    return results
+
+def compare(results, baseline, tolerance):
+    """
+    Prints the change of every benchmark against the baseline.
+    Returns the names of the benchmarks that regressed by more
+    than the given fraction.
+    """
+    regressions = []
+    print("\n%-20s %12s %12s %8s" % ("benchmark", "baseline", "now", "change"))
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        old = baseline[name]["ops_per_sec"]
+        new = result["ops_per_sec"]
+        change = new / old - 1
+        flag = ""
+        if change < -tolerance:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print("%-20s %12.1f %12.1f %+7.1f%%%s" % (name, old, new, 100 * change, flag))
+    return regressions
+
+def main(argv):
+    """
+    Benchmarks the rules, feature extraction, prediction, bot
+    bidding, solving deals and whole all-bot games. Prints the
+    throughput of each benchmark in operations per second.
+
+    Arguments are:
+    'o [file]' - Write the results as JSON, e.g. to save a
+                 baseline
+    'c [file]' - Compare against saved results, and exit with
+                 status 1 if anything got slower by more than
+                 the tolerance
+    't [percent]' - Tolerance for the comparison (default 20)
+    'l [folder]' - Log folder for the feature benchmarks
+                   (default log)
+    'n [number]' - Number of games per run for the game
+                   benchmarks (default 100)
+    """
+    log_folder = "log"
+    if '-l' in argv:
+        index = argv.index('-l')
+        log_folder = argv[index + 1]
+    n_games = 100
+    if '-n' in argv:
+        index = argv.index('-n')
+        n_games = int(argv[index + 1])
+    tolerance = DEFAULT_TOLERANCE
+    if '-t' in argv:
+        index = argv.index('-t')
+        tolerance = float(argv[index + 1]) / 100
+
+    results = run_benchmarks(log_folder, n_games)
+
+    if '-o' in argv:
+        index = argv.index('-o')
+        with open(argv[index + 1], "w") as file:
+            json.dump({"python": platform.python_version(),
+                       "machine": platform.machine(),
+                       "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                       "results": results}, file, indent = 2, sort_keys = True)
+
+    if '-c' in argv:
+        index = argv.index('-c')
+        with open(argv[index + 1], "r") as file:
+            baseline = json.load(file)["results"]
+        regressions = compare(results, baseline, tolerance)
+        if regressions:
+            print("\nRegressions: " + ", ".join(regressions))
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
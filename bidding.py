@@ -0,0 +1,584 @@
+import sys
+import time
+import random
+import collections
+
+from card import *
+from rules import *
+from bitcards import *
+
+# Bidding and game values.
+#
+# Before the game, the players bid for the right to declare.
+# Middlehand (player 2) bids to forehand (player 1), who says
+# "yes" as long as they would play for the same value, until
+# one of them passes. Then rearhand (player 3) bids to whoever
+# is left. If both pass without bidding, forehand may still
+# play for 18. The winner declares, and loses the game if it
+# turns out to be worth less than their bid.
+#
+# A game is worth its base value (see BASE_VALUES) times its
+# multiplier: the number of matadors "with" or "without" (the
+# top trumps the declarer holds, or lacks, in an unbroken run
+# from the club jack down), plus one for the game, plus one for
+# each of playing from the hand (without the skat), Schneider
+# (one side taking 90 points or more) and Schwarz (one side
+# taking every trick). A Null is worth a fixed value.
+#
+# Bots decide how high to bid by playing out random deals of
+# their hand with simple greedy rules for all players (see
+# playout), and bidding up to the value of the best game they
+# won often enough.
+
+# Seats of the players in the auction, by player ID
+FOREHAND = 1
+MIDDLEHAND = 2
+REARHAND = 3
+
+# Base values by game type (see bitcards.GAME_TYPES). A Null is
+# worth one of NULL_VALUES instead: plain, from the hand, open
+# (ouvert) and open from the hand.
+BASE_VALUES = (9, 10, 11, 12, 24, 23)
+NULL_VALUES = (23, 35, 46, 59)
+
+# Trumps that count as matadors by game type, from the highest
+# down: the jacks from clubs to diamonds, then the trump suit
+# from the ace to the 7
+_JACKS = tuple(8 * suit + Rank.jack for suit in (3, 2, 1, 0))
+_SUIT_RANKS = (6, 5, 4, 3, 2, 1, 0)
+MATADOR_ORDER = (tuple(_JACKS + tuple(8 * suit + rank for rank in _SUIT_RANKS)
+                       for suit in range(0, 4)) +
+                 (_JACKS, ()))
+
+def _bids():
+    """
+    Returns every value a game can be worth, from 18 up, in
+    increasing order.
+    """
+    values = set(NULL_VALUES)
+    for game_type in range(0, NULL):
+        # Matadors, game, hand, Schneider and Schwarz (each
+        # also announced) and open. Only the hand, Schneider
+        # and Schwarz come up in the games played here, but the
+        # bids are the same.
+        most = len(MATADOR_ORDER[game_type]) + 7
+        for multiplier in range(1, most + 1):
+            values.add(BASE_VALUES[game_type] * multiplier)
+    return tuple(sorted(value for value in values if value >= 18))
+
+# The bids that can be made, in increasing order
+BIDS = _bids()
+
+# Fraction of random deals a bot has to win with a game before
+# it bids for it
+BID_THRESHOLD = 0.6
+
+# Number of random deals a bot plays out to value its hand
+BID_SAMPLES = 16
+
+def matadors(game_type, mask):
+    """
+    Returns the number of matadors "with" or "without" in the
+    given cards (the declarer's hand and the skat), which is 0
+    in a Null.
+    """
+    order = MATADOR_ORDER[game_type]
+    if not order:
+        return 0
+    top = (mask >> order[0]) & 1
+    count = 0
+    for card in order:
+        if (mask >> card) & 1 != top:
+            break
+        count += 1
+    return count
+
+def game_value(game_type, mask, hand = False, schneider = False,
+               schwarz = False):
+    """
+    Returns the value of a game of the given type, where 'mask'
+    holds the declarer's hand and the skat. Schwarz counts on
+    top of Schneider, so a Schwarz game has both set.
+    """
+    if game_type == NULL:
+        return NULL_VALUES[1] if hand else NULL_VALUES[0]
+    multiplier = matadors(game_type, mask) + 1 + hand + schneider + schwarz
+    return BASE_VALUES[game_type] * multiplier
+
+# Outcome of a game: whether the declarer won, what the game
+# was worth, and the score the declarer gets for it (the value
+# if they won, minus twice the value if they lost)
+Settlement = collections.namedtuple('Settlement', ['won', 'value', 'score'])
+
+def settle(rules, cards, cards_won, bid):
+    """
+    Scores a finished game. 'cards' are the declarer's hand as
+    dealt plus the skat, which decide the matadors, 'cards_won'
+    the cards they won including the skat, and 'bid' the
+    highest bid of the auction (0 if there was none).
+
+    A declarer who overbid loses the game, at the lowest
+    multiple of the base value (or Null value) that reaches
+    the bid.
+    """
+    won = rules.declarer_won(cards_won)
+    if rules.game_type == NULL:
+        value = game_value(NULL, 0)
+    else:
+        points = rules.count_points(cards_won)
+        tricks = len(cards_won) // 3
+        value = game_value(rules.game_type, hand_mask(cards),
+                           schneider = points >= 90 or points <= 30,
+                           schwarz = tricks == 0 or tricks == 10)
+    if value < bid:
+        won = False
+        base = BASE_VALUES[rules.game_type]
+        value = base * -(-bid // base)
+        if rules.game_type == NULL:
+            value = min([null for null in NULL_VALUES if null >= bid] or [value])
+    return Settlement(won, value, value if won else -2 * value)
+
+class Auction:
+    """
+    The bidding before a game. Asks one player at a time
+    whether they bid (or hold) a value, see question and
+    answer, until the declarer is known.
+    """
+
+    def __init__(self):
+        # Highest bid so far, 0 if there was none
+        self.bid = 0
+
+        # ID of the declarer once the auction is over, None if
+        # everyone passed
+        self.declarer_id = None
+        self.done = False
+
+        # The player who holds (says "yes") and the one who
+        # bids to them, and whose answer we're waiting for
+        self.listener = FOREHAND
+        self.bidder = MIDDLEHAND
+        self.asking = MIDDLEHAND
+
+    def question(self):
+        """
+        Returns the next question as a tuple of (player ID,
+        value), asking whether the player would play for that
+        value, or None once the auction is over.
+        """
+        if self.done:
+            return None
+        if self.listener == self.bidder:
+            # Everyone else passed without bidding
+            return self.listener, BIDS[0]
+        if self.asking == self.listener:
+            return self.listener, self.bid
+        higher = [bid for bid in BIDS if bid > self.bid]
+        if not higher:
+            # Nobody can bid more, so the bidder has to pass
+            self.answer(False)
+            return self.question()
+        return self.bidder, higher[0]
+
+    def answer(self, yes):
+        """
+        Records the answer of the player the last question went
+        to.
+        """
+        if self.listener == self.bidder:
+            self.done = True
+            if yes:
+                self.declarer_id = self.listener
+                self.bid = BIDS[0]
+        elif self.asking == self.bidder:
+            if yes:
+                self.bid = [bid for bid in BIDS if bid > self.bid][0]
+                self.asking = self.listener
+            else:
+                self.next_bidder(self.listener)
+        elif yes:
+            self.asking = self.bidder
+        else:
+            self.next_bidder(self.bidder)
+
+    def next_bidder(self, winner):
+        """
+        Ends the current round of bidding, which 'winner' won.
+        Rearhand bids to them next, unless this was rearhand's
+        round.
+        """
+        if self.bidder != REARHAND:
+            self.listener = winner
+            self.bidder = REARHAND
+            self.asking = REARHAND
+        elif self.bid:
+            self.declarer_id = winner
+            self.done = True
+        else:
+            # Nobody bid, forehand gets the last word
+            self.listener = self.bidder = self.asking = FOREHAND
+
+# HIGHER[game_type][card] is the mask of the cards of the same
+# group (see bitcards.GROUPS) that beat the given card
+HIGHER = tuple(tuple(sum(1 << other for other in range(0, 32)
+                         if (1 << other) & FOLLOW_MASKS[game_type][card] and
+                         TRICK_KEYS[game_type][card][other] >
+                         TRICK_KEYS[game_type][card][card])
+                     for card in range(0, 32))
+               for game_type in range(0, GAME_TYPES))
+
+def _card_order(game_type, key):
+    """
+    Returns all cards sorted by the given function of the game
+    type and card.
+    """
+    return tuple(sorted(range(0, 32), key = lambda card: key(game_type, card)))
+
+def _strength(game_type, card):
+    return TRICK_KEYS[game_type][card][card]
+
+def _is_trump(game_type, card):
+    return bool((1 << card) & TRUMP_MASKS[game_type])
+
+# Cards by game type in the order greedy players prefer them:
+# to throw away (plain suits before trumps, low points first),
+# to give their partner or win a trick with (plain suits before
+# trumps, high points first), and from weakest to strongest
+CHEAP_ORDER = tuple(_card_order(game_type, lambda g, card:
+                                (_is_trump(g, card), POINTS[card], _strength(g, card)))
+                    for game_type in range(0, GAME_TYPES))
+RICH_ORDER = tuple(_card_order(game_type, lambda g, card:
+                               (_is_trump(g, card), -POINTS[card], _strength(g, card)))
+                   for game_type in range(0, GAME_TYPES))
+STRENGTH_ORDER = tuple(_card_order(game_type, _strength)
+                       for game_type in range(0, GAME_TYPES))
+
+def _first(order, mask):
+    """
+    Returns the first card of the given order in the mask.
+    """
+    for card in order:
+        if (mask >> card) & 1:
+            return card
+
+def _last(order, mask):
+    """
+    Returns the last card of the given order in the mask.
+    """
+    for card in reversed(order):
+        if (mask >> card) & 1:
+            return card
+
+# Highest trick key (see bitcards.TRICK_KEYS)
+_TOP_KEY = 24
+
+# BEATS[game_type][lead][key] is the mask of the cards with a
+# trick key above the given one in a trick started with the
+# given lead card
+BEATS = tuple(tuple(tuple(sum(1 << card for card in range(0, 32)
+                              if TRICK_KEYS[game_type][lead][card] > key)
+                          for key in range(0, _TOP_KEY))
+                    for lead in range(0, 32))
+              for game_type in range(0, GAME_TYPES))
+
+def _lead(hands, seat, declarer, game_type):
+    """
+    Returns the card a greedy player leads: in a Null their
+    lowest card. Otherwise a card nobody can beat in its group,
+    if they have one (trumps first for the declarer while the
+    defenders have trumps left, to draw them), or else their
+    cheapest card.
+    """
+    hand = hands[seat]
+    if game_type == NULL:
+        return _first(STRENGTH_ORDER[NULL], hand)
+    others = (hands[0] | hands[1] | hands[2]) & ~hand
+    higher = HIGHER[game_type]
+    winners = 0
+    cards = hand
+    while cards:
+        low = cards & -cards
+        if not others & higher[low.bit_length() - 1]:
+            winners |= low
+        cards ^= low
+    if winners:
+        trumps = TRUMP_MASKS[game_type]
+        if seat == declarer and winners & trumps and others & trumps:
+            return _last(STRENGTH_ORDER[game_type], winners & trumps)
+        return _first(RICH_ORDER[game_type], winners)
+    return _first(CHEAP_ORDER[game_type], hand)
+
+def _follow(hands, seat, lead, best_key, best_seat, last, declarer, game_type):
+    """
+    Returns the card a greedy player plays to the trick started
+    with the given lead card, in which the player in seat
+    'best_seat' is winning so far with a card of trick key
+    'best_key'. 'last' is whether the player is the last to
+    play to the trick.
+
+    In a Null the declarer plays their highest card that stays
+    below the best card (or their highest card if they can't),
+    and the defenders play low. Otherwise, a defender whose
+    partner surely wins the trick gives them as many points as
+    they can, and everyone else wins the trick as cheaply as
+    possible, or throws their cheapest card.
+    """
+    legal = valid_mask(hands[seat], lead, game_type)
+    if not legal & (legal - 1):
+        return legal.bit_length() - 1
+    higher = BEATS[game_type][lead][best_key]
+
+    if game_type == NULL:
+        order = STRENGTH_ORDER[NULL]
+        if seat != declarer:
+            return _first(order, legal)
+        below = legal & ~higher
+        return _last(order, below if below else legal)
+
+    if seat != declarer and best_seat != declarer:
+        next_hand = hands[(seat + 1) % 3]
+        if last or not valid_mask(next_hand, lead, game_type) & higher:
+            return _first(RICH_ORDER[game_type], legal)
+    beats = legal & higher
+    if beats:
+        if last:
+            return _first(RICH_ORDER[game_type], beats)
+        return _last(STRENGTH_ORDER[game_type], beats)
+    return _first(CHEAP_ORDER[game_type], legal)
+
+def playout(hands, declarer, game_type):
+    """
+    Plays out a deal with every player following the greedy
+    rules of _lead and _follow, knowing all hands. 'hands' are
+    the masks of the hands in seats 0-2 (players 1-3), and seat
+    0 leads. Returns the mask of the cards the declarer (in
+    seat 'declarer') won, and their number of tricks. A Null
+    is played only until the declarer takes a trick.
+    """
+    hands = list(hands)
+    won = 0
+    tricks = 0
+    leader = 0
+    for r in range(0, 10):
+        lead = _lead(hands, leader, declarer, game_type)
+        hands[leader] &= ~(1 << lead)
+        keys = TRICK_KEYS[game_type][lead]
+        trick = 1 << lead
+        best_key = keys[lead]
+        best_seat = leader
+        for i in range(1, 3):
+            seat = (leader + i) % 3
+            card = _follow(hands, seat, lead, best_key, best_seat, i == 2,
+                           declarer, game_type)
+            hands[seat] &= ~(1 << card)
+            trick |= 1 << card
+            if keys[card] > best_key:
+                best_key = keys[card]
+                best_seat = seat
+        leader = best_seat
+        if leader == declarer:
+            won |= trick
+            tricks += 1
+            if game_type == NULL:
+                break
+    return won, tricks
+
+def discard(mask, game_type):
+    """
+    Returns the mask of the two cards a bot hides in the skat
+    from its twelve cards. In a Null these are its highest
+    cards. Otherwise they are plain cards other than aces,
+    preferring high points, short suits and 10s without their
+    ace, so that the points are safe and the suits run out.
+    """
+    cards = mask_indices(mask)
+    if game_type == NULL:
+        order = STRENGTH_ORDER[NULL]
+        cards.sort(key = lambda card: -order.index(card))
+        return (1 << cards[0]) | (1 << cards[1])
+
+    def keep(card):
+        if (1 << card) & TRUMP_MASKS[game_type]:
+            return (2, _strength(game_type, card))
+        suit = PLAIN_MASKS[game_type][card // 8]
+        ace = 1 << (8 * (card // 8) + Rank.ace)
+        if card % 8 == Rank.ace:
+            return (1, 0)
+        guarded = card % 8 == Rank.ten and mask & ace
+        return (0, popcount(mask & suit) * 3 - POINTS[card] + 20 * bool(guarded))
+    cards.sort(key = keep)
+    return (1 << cards[0]) | (1 << cards[1])
+
+# Estimate of how a bot would do declaring a game: the fraction
+# of random deals it won, and the value the game is worth in
+# nine out of ten of them (without Schneider)
+Estimate = collections.namedtuple('Estimate', ['game_type', 'win_rate', 'value'])
+
+# Masks of the aces, and of the cards a Null hand doesn't want
+# many of
+_ACES = sum(1 << (8 * suit + Rank.ace) for suit in range(0, 4))
+_NULL_HIGH = sum(1 << (8 * suit + rank) for suit in range(0, 4)
+                 for rank in (Rank.queen, Rank.king, Rank.ace))
+
+def promising(hand, game_type):
+    """
+    Returns whether a 10-card hand is worth playing out as the
+    given game type at all: suit games need three trumps,
+    Grands three jacks and aces together, and Nulls at most
+    three queens, kings and aces. Hands that fall short almost
+    never win in the playouts.
+    """
+    if game_type == NULL:
+        return popcount(hand & _NULL_HIGH) <= 3
+    if game_type == GRAND:
+        return popcount(hand & (JACKS | _ACES)) >= 3
+    return count_trumps(game_type, hand) >= 3
+
+def estimate_games(hand, skat, seat, rng, samples = BID_SAMPLES, games = None,
+                   floor = 0.0, race = False):
+    """
+    Plays out random deals of the cards not in the given hand
+    (or skat, if 'skat' isn't 0) with the player in the given
+    seat (0-2, seat 0 leads) declaring every game type (or the
+    game types in 'games'), and returns an Estimate for each
+    game type. The declarer picks up the skat and hides two
+    cards (see discard). 'rng' is a random.Random or the random
+    module. Game types that aren't played get an Estimate
+    with a win rate and value of 0.
+
+    A game type stops being played once it can't be won in at
+    least 'floor' of the deals any more, or if 'race' is set,
+    once it can't be won as often as the game type won most
+    so far. Its Estimate then only counts the deals played.
+    """
+    rest = mask_indices(FULL_DECK & ~hand & ~skat)
+    wins = [0] * GAME_TYPES
+    values = [[] for game_type in range(0, GAME_TYPES)]
+    games = list(range(0, GAME_TYPES) if games is None else games)
+
+    # With a known skat, the declarer always hides the same cards
+    if skat:
+        hiddens = [discard(hand | skat, game_type)
+                   for game_type in range(0, GAME_TYPES)]
+
+    for i in range(0, samples):
+        needed = floor * samples
+        if race and games:
+            needed = max(needed, max(wins[game_type] for game_type in games))
+        games = [game_type for game_type in games
+                 if wins[game_type] + samples - i >= needed]
+        if not games:
+            break
+        rng.shuffle(rest)
+        first = sum(1 << card for card in rest[0:10])
+        second = sum(1 << card for card in rest[10:20])
+        dealt = skat | sum(1 << card for card in rest[20:])
+        cards = hand | dealt
+        for game_type in games:
+            hidden = hiddens[game_type] if skat else discard(cards, game_type)
+            hands = [first, second]
+            hands.insert(seat, cards & ~hidden)
+            won, tricks = playout(hands, seat, game_type)
+            if game_type == NULL:
+                wins[game_type] += not tricks
+            else:
+                wins[game_type] += game_points(game_type, won | hidden) > 60
+            values[game_type].append(game_value(game_type, cards))
+    estimates = []
+    for game_type in range(0, GAME_TYPES):
+        played = values[game_type]
+        played.sort()
+        estimates.append(Estimate(game_type, wins[game_type] / samples,
+                                  played[len(played) // 10] if played else 0))
+    return estimates
+
+def bid_limit(hand, seat, rng, samples = BID_SAMPLES):
+    """
+    Returns the highest bid of a bot with the given hand (a
+    mask) in the given seat (0-2): the value of the most
+    valuable game it won in at least BID_THRESHOLD of the
+    random deals, or 0 if there is none.
+    """
+    games = [game_type for game_type in range(0, GAME_TYPES)
+             if promising(hand, game_type)]
+    estimates = estimate_games(hand, 0, seat, rng, samples, games,
+                               floor = BID_THRESHOLD)
+    return max([estimate.value for estimate in estimates
+                if estimate.win_rate >= BID_THRESHOLD] or [0])
+
+def choose_game(hand, skat, seat, bid, rng, samples = BID_SAMPLES):
+    """
+    Returns the game type a bot declares after picking up the
+    skat, and the mask of the cards it hides: the game it won
+    most often among the games worth at least its bid (any
+    game, if none is).
+    """
+    cards = hand | skat
+    games = ([game_type for game_type in range(0, GAME_TYPES)
+              if game_value(game_type, cards) >= bid] or
+             list(range(0, GAME_TYPES)))
+    estimates = estimate_games(hand, skat, seat, rng, samples, games,
+                               race = True)
+    best = max([estimates[game_type] for game_type in games],
+               key = lambda estimate: (estimate.win_rate, estimate.value))
+    return best.game_type, discard(cards, best.game_type)
+
+def main(argv):
+    """
+    Deals random hands and lets three bots bid for them,
+    printing how often each game is declared and won, and how
+    long the bots take to value a hand.
+
+    Usage: python(3) bidding.py [number of deals] [seed]
+    """
+    n = int(argv[1]) if len(argv) > 1 else 100
+    rng = random.Random(int(argv[2]) if len(argv) > 2 else 0)
+    declared = [0] * GAME_TYPES
+    won = [0] * GAME_TYPES
+    passed = 0
+    bids = 0
+    elapsed = 0.0
+    for i in range(0, n):
+        deck = list(range(0, 32))
+        rng.shuffle(deck)
+        hands = [sum(1 << card for card in deck[10 * seat:10 * seat + 10])
+                 for seat in range(0, 3)]
+        skat = (1 << deck[30]) | (1 << deck[31])
+        start = time.time()
+        limits = [bid_limit(hands[seat], seat, rng) for seat in range(0, 3)]
+        elapsed += time.time() - start
+
+        auction = Auction()
+        question = auction.question()
+        while question:
+            pid, bid = question
+            auction.answer(bid <= limits[pid - 1])
+            question = auction.question()
+        if auction.declarer_id is None:
+            passed += 1
+            continue
+        seat = auction.declarer_id - 1
+        game_type, hidden = choose_game(hands[seat], skat, seat, auction.bid, rng)
+        declared[game_type] += 1
+        bids += auction.bid
+
+        # Play the game out with the same greedy rules
+        rules = BaseRules(auction.declarer_id, GAME_CODES[game_type])
+        dealt = list(hands)
+        dealt[seat] = (hands[seat] | skat) & ~hidden
+        cards_won, tricks = playout(dealt, seat, game_type)
+        settlement = settle(rules, mask_hand(hands[seat] | skat),
+                            mask_hand(cards_won | hidden), auction.bid)
+        won[game_type] += settlement.won
+
+    print("%d deals, %d passed in, average bid %.1f" %
+          (n, passed, bids / max(n - passed, 1)))
+    for game_type in range(0, GAME_TYPES):
+        print("%s: declared %d, won %d" %
+              (GAME_CODES[game_type], declared[game_type], won[game_type]))
+    print("Valued %d hands in %.2f s (%.1f ms per hand)" %
+          (3 * n, elapsed, 1000 * elapsed / (3 * n)))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,238 @@
+# Compact integer representation of Skat cards and hands.
+#
+# A card is an int in 0..31, equal to 8 * suit + rank (which is
+# also hash(card) for the corresponding Card). A hand, or any
+# other set of cards, is a 32-bit mask with bit i set if card i
+# is in the set.
+#
+# All tables are computed once at import time, so the functions
+# below only do table lookups and bit twiddling. They are meant
+# for inner loops like simulation and feature extraction. Use
+# card_index/index_card and hand_mask/mask_hand to convert to
+# and from Card objects.
+from card import *
+
+# Card objects by index
+CARDS = tuple(Card.get_deck())
+
+# Points value of each card, by index
+POINTS = tuple(int(card) for card in CARDS)
+
+# Mask of the whole deck
+FULL_DECK = (1 << 32) - 1
+
+# Mask of the four jacks
+JACKS = sum(1 << (8 * suit + Rank.jack) for suit in range(0, 4))
+
+# Masks of the cards of each suit, excluding jacks
+SUIT_MASKS = tuple(sum(1 << (8 * suit + rank) for rank in range(0, 7))
+                   for suit in range(0, 4))
+
+# Game types. A suit game is numbered by its trump suit (see
+# Suit), so a trump suit can be used wherever a game type is
+# expected. In a Grand only the jacks are trumps, and in a Null
+# there are no trumps at all.
+GRAND = 4
+NULL = 5
+GAME_TYPES = 6
+
+# Codes of the game types in logs and on the network, by game
+# type (the codes of suit games are those of their suits)
+GAME_CODES = "dhscgn"
+
+# Masks of the trumps for each game type
+TRUMP_MASKS = (tuple(SUIT_MASKS[suit] | JACKS for suit in range(0, 4)) +
+               (JACKS, 0))
+
+# PLAIN_MASKS[game_type][suit] is the mask of the cards of a suit
+# that aren't jacks, or all cards of the suit in a Null, where
+# jacks are ordinary cards
+PLAIN_MASKS = tuple(SUIT_MASKS if game_type != NULL else
+                    tuple(0xFF << (8 * suit) for suit in range(0, 4))
+                    for game_type in range(0, GAME_TYPES))
+
+# Cards are grouped by the card that has to be followed: the
+# trumps, and the plain cards of each suit. The trump group is
+# numbered like the game type, so in a suit game it's the trump
+# suit, and in a Grand it's group 4 (GRAND).
+GROUPS = 5
+
+def _group_mask(group, game_type):
+    """
+    Returns the mask of the cards in the given group.
+    """
+    if group == game_type:
+        return TRUMP_MASKS[game_type]
+    if group < 4:
+        return PLAIN_MASKS[game_type][group]
+    return 0
+
+# GROUP_MASKS[game_type][group] is the mask of the cards in a
+# group, and CARD_GROUPS[game_type][card] the group of a card
+GROUP_MASKS = tuple(tuple(_group_mask(group, game_type)
+                          for group in range(0, GROUPS))
+                    for game_type in range(0, GAME_TYPES))
+CARD_GROUPS = tuple(tuple(game_type if (1 << card) & TRUMP_MASKS[game_type]
+                          else card // 8
+                          for card in range(0, 32))
+                    for game_type in range(0, GAME_TYPES))
+
+# Points in each possible byte of a mask. Every suit occupies
+# one byte and ranks are in the same order in every suit, so
+# this table works for all four bytes.
+BYTE_POINTS = tuple(sum(RANK_POINTS[rank] for rank in range(0, 8)
+                        if byte & (1 << rank))
+                    for byte in range(0, 256))
+
+# Number of set bits in each possible 16-bit value
+_POPCOUNT_16 = tuple(bin(value).count("1") for value in range(0, 1 << 16))
+
+# FOLLOW_MASKS[game_type][lead] is the mask of cards that
+# follow the lead card in a game of the given type
+FOLLOW_MASKS = tuple(tuple(GROUP_MASKS[game_type][CARD_GROUPS[game_type][lead]]
+                           for lead in range(0, 32))
+                     for game_type in range(0, GAME_TYPES))
+
+# Strength of the ranks within a suit, by Rank. In a Null, 10s
+# rank between 9s and jacks, and jacks between 10s and queens.
+RANK_ORDER = tuple(range(0, 8))
+NULL_RANK_ORDER = (0, 1, 2, 5, 6, 3, 7, 4)
+
+def _trick_key(card, lead, game_type):
+    """
+    Returns the strength of a card in a trick started with
+    the given lead card. Trumps beat everything else, and
+    cards that don't follow the lead card never win.
+    """
+    if (1 << card) & TRUMP_MASKS[game_type]:
+        if card % 8 == Rank.jack:
+            return 20 + card // 8
+        return 10 + card % 8
+    if (1 << card) & FOLLOW_MASKS[game_type][lead]:
+        if game_type == NULL:
+            return 1 + NULL_RANK_ORDER[card % 8]
+        return 1 + RANK_ORDER[card % 8]
+    return 0
+
+# TRICK_KEYS[game_type][lead][card] is the strength of a card
+# in a trick started with the given lead card. The card with
+# the highest strength wins the trick.
+TRICK_KEYS = tuple(tuple(tuple(_trick_key(card, lead, game_type)
+                               for card in range(0, 32))
+                         for lead in range(0, 32))
+                   for game_type in range(0, GAME_TYPES))
+
+# GAME_BYTE_POINTS[game_type] is BYTE_POINTS for the points that
+# count in a game of the given type. A Null is won by not taking
+# a trick, so no card counts there.
+GAME_BYTE_POINTS = tuple(BYTE_POINTS if game_type != NULL else (0,) * 256
+                         for game_type in range(0, GAME_TYPES))
+
+def trick_winner(cards, game_type):
+    """
+    Returns the position of the winning card in a trick given
+    as a list of card indices, starting with the lead card.
+    """
+    keys = TRICK_KEYS[game_type][cards[0]]
+    best = 0
+    for i in range(1, len(cards)):
+        if keys[cards[i]] > keys[cards[best]]:
+            best = i
+    return best
+
+def card_index(card):
+    """
+    Returns the index of the given Card.
+    """
+    return 8 * card.suit + card.rank
+
+def index_card(index):
+    """
+    Returns the Card with the given index.
+    """
+    return CARDS[index]
+
+def hand_mask(hand):
+    """
+    Returns the mask of a hand given as a list of Cards.
+    """
+    mask = 0
+    for card in hand:
+        mask |= 1 << (8 * card.suit + card.rank)
+    return mask
+
+def mask_hand(mask):
+    """
+    Returns the sorted list of Cards in the given mask.
+    """
+    return sorted(CARDS[index] for index in mask_indices(mask))
+
+def mask_indices(mask):
+    """
+    Returns the list of card indices in the given mask, in
+    increasing order.
+    """
+    indices = []
+    while mask:
+        low = mask & -mask
+        indices.append(low.bit_length() - 1)
+        mask ^= low
+    return indices
+
+def popcount(mask):
+    """
+    Returns the number of cards in the given mask.
+    """
+    return _POPCOUNT_16[mask & 0xFFFF] + _POPCOUNT_16[mask >> 16]
+
+def count_points(mask):
+    """
+    Returns the number of points in the given mask.
+    """
+    return (BYTE_POINTS[mask & 0xFF] +
+            BYTE_POINTS[(mask >> 8) & 0xFF] +
+            BYTE_POINTS[(mask >> 16) & 0xFF] +
+            BYTE_POINTS[mask >> 24])
+
+def game_points(game_type, mask):
+    """
+    Returns the number of points in the given mask that count
+    in a game of the given type.
+    """
+    points = GAME_BYTE_POINTS[game_type]
+    return (points[mask & 0xFF] +
+            points[(mask >> 8) & 0xFF] +
+            points[(mask >> 16) & 0xFF] +
+            points[mask >> 24])
+
+def count_suit(suit, mask):
+    """
+    Counts the number of cards with the given suit in the
+    given mask, excluding Jacks.
+    """
+    return popcount(mask & SUIT_MASKS[suit])
+
+def count_trumps(game_type, mask):
+    """
+    Counts the number of trumps in the given mask.
+    """
+    return popcount(mask & TRUMP_MASKS[game_type])
+
+def valid_mask(hand, lead, game_type):
+    """
+    Returns the mask of cards in the given hand that may be
+    played after the given lead card. 'lead' is None if no
+    one has played yet.
+    """
+    if lead is None:
+        return hand
+    follow = hand & FOLLOW_MASKS[game_type][lead]
+    return follow if follow else hand
+
+def valid(card, hand, lead, game_type):
+    """
+    Returns whether the given card may be played from the
+    given hand after the given lead card. Mirrors
+    BaseRules.valid.
+    """
+    return bool(valid_mask(hand, lead, game_type) & (1 << card))
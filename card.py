@@ -45,6 +45,9 @@ class Suit(IntEnum):
             "c": cls.clubs
         }[str]
 
+# Points value of each rank, indexed by Rank
+RANK_POINTS = (0, 0, 0, 3, 4, 10, 11, 2)
+
 class Rank(IntEnum):
     """ Defines card ranks """
     seven = 0
@@ -72,16 +75,10 @@ class Rank(IntEnum):
         return self.__str__()
         
     def __int__(self):
-        return {
-            "seven": 0,
-            "eight": 0,
-            "nine" : 0,
-            "queen": 3,
-            "king" : 4,
-            "ten"  : 10,
-            "ace"  : 11,
-            "jack" : 2,
-        }[self.name]
+        """
+        Returns the points value of this rank.
+        """
+        return RANK_POINTS[self]
         
     @classmethod
     def from_str(cls, str):
@@ -233,12 +230,17 @@ class Card:
         return deck
 
     @staticmethod
-    def shuffle_deck(deck):
+    def shuffle_deck(deck, rng = None):
         """
-        Shuffles a Skat deck.
+        Shuffles a Skat deck. If a random.Random instance is
+        given, it is used instead of the global random state,
+        which makes the shuffle reproducible.
         """
         assert len(deck) == 32
         for card in deck:
             assert isinstance(card, Card)
-        shuffle(deck)
+        if rng:
+            rng.shuffle(deck)
+        else:
+            shuffle(deck)
         return deck
@@ -1,17 +1,26 @@
 import os
 import re
 import sys
-import collections
+import hashlib
+import functools
+import multiprocessing
 
 from card import *
 from player import *
 from rules import *
+from game_log import *
+from feature_store import *
+
+# Record which log files have been extracted into the
+# combined text and binary feature files (see stream_features)
+MANIFEST_PATH = "feature/manifest.txt"
+BINARY_MANIFEST_PATH = "feature/manifest_bin.txt"
 
 def extract_skat(rule_info, players):
     """
     Extracts the skat from the rule information.
     """
-    pattern = re.compile(r"\((\d), ([cshd]+), ([a-zA-Z0-9 ]+)\)")
+    pattern = re.compile(r"\((\d), ([cshdgn]+), ([a-zA-Z0-9 ]+)\)")
     results = pattern.match(rule_info).groups()
     
     # Find declarer
@@ -34,27 +43,11 @@ def extract_skat(rule_info, players):
     # Fix declarer's hand
     declarer.hand = hand
 
-def extract_round(round_info):
-    """
-    This method extracts a round of gameplay from a string
-    description and returns a list of tuples like so:
-    [(pid, card), (pid, card), (pid, card)]
-    """
-    pattern = re.compile(r"\(([0-9]+), ([cshd07891QKBA]+)\)")
-    results = re.findall(pattern, round_info)
-    
-    Play = collections.namedtuple('Play', ['pid', 'card'])
-    plays = []
-    for result in results:
-        play = Play(pid = int(result[0]), card = Card.from_abbrev(result[1]))
-        plays.append(play)
-    return plays
-
-def process_round(plays, suit_file, rank_file, players, rules):
+def process_round(plays, suit_rows, rank_rows, players, rules):
     """
     This method should process a round of gameplay and
-    generate features where possible. It should write to
-    the given file 'feature-file'
+    generate features where possible. The feature tuples
+    are appended to the lists 'suit_rows' and 'rank_rows'.
     """
     # Loop over all plays
     for i in range(0, 3):
@@ -75,77 +68,281 @@ def process_round(plays, suit_file, rank_file, players, rules):
             
             # Log the features, if it exists
             if s_features:
-                suit_file.write(str(s_features)[1:-1] + "\n")
+                suit_rows.append(s_features)
             if r_features:
-                rank_file.write(str(r_features)[1:-1] + "\n")
+                rank_rows.append(r_features)
             
         # Remove played card from player's hand
         player.hand.remove(play.card)
-        
+
+def read_game(log_file):
+    """
+    Reads one game from an open log file. Returns a dictionary
+    mapping player IDs to players, the rules and the list of
+    rounds, each of which is a list of plays.
+    """
+    # Read player info (Lines 1-3)
+    players = {}
+    for i in range(0, 3):
+        player_info = log_file.readline()
+        player = BotPlayer.from_str(player_info)
+        players[player.pid] = player
+    
+    # Read game rules (Line 4)
+    rule_info = log_file.readline()
+    rules = BaseRules.from_str(rule_info)
+
+    # Extract skat and fix the hand of
+    # whoever's playing
+    extract_skat(rule_info, players)
+
+    # Read gameplay (Lines 5-14)
+    rounds = []
+    for i in range(0, 10):
+        round_info = log_file.readline()
+        rounds.append(extract_round(round_info))
+    return players, rules, rounds
+
+def read_record(record):
+    """
+    Unpacks a game from a binary game log record (see
+    game_log.py). Returns the same as read_game.
+    """
+    hands, declarer_id, game_type, skat, rounds = decode_game(record)
+    players = {}
+    for pid in range(1, 4):
+        players[pid] = BotPlayer(pid, hands[pid - 1], "P" + str(pid))
+    rules = BaseRules(declarer_id, GAME_CODES[game_type])
+
+    # Give the skat to whoever's playing and fix their hand
+    # (the cards they played)
+    declarer = players[declarer_id]
+    declarer.cards_won.extend(skat)
+    declarer.hand = sorted(play.card for plays in rounds for play in plays
+                           if play.pid == declarer_id)
+    return players, rules, rounds
+
+def extract_game(players, rules, rounds):
+    """
+    Replays a game and returns the lists of suit and rank
+    feature tuples for the decisions made in it.
+    """
+    suit_rows = []
+    rank_rows = []
+    for plays in rounds:
+        process_round(plays, suit_rows, rank_rows, players, rules)
+    
+        # Update game state
+        winning_play = rules.winning_play(plays)
+        winning_player = players[winning_play.pid]
+        winning_player.cards_won.extend([play.card for play in plays])
+        for player in players.values():
+            player.see_round(plays, rules)
+    return suit_rows, rank_rows
+
+def format_rows(rows):
+    """
+    Formats feature tuples as lines of comma-separated values.
+    """
+    return "".join(str(row)[1:-1] + "\n" for row in rows)
+
 def process_log_file(log_file_path, suit_file_path, rank_file_path):
     """
     Processes the given log file and writes feature vectors
     from that game out to the given feature file.
     """
-    # Open log file
-    log_file = open(log_file_path, "r")
-        
     # Open suit feature set file
     if not suit_file_path:
         suit_file_path = "feature/suit/" + os.path.basename(log_file_path)
-    suit_file = open(suit_file_path, "w")
     
     # Open rank feature set file
     if not rank_file_path:
         rank_file_path = "feature/rank/" + os.path.basename(log_file_path)
-    rank_file = open(rank_file_path, "w")
     
     try:
-        # Read player info (Lines 1-3)
-        players = {}
-        for i in range(0, 3):
-            player_info = log_file.readline()
-            player = BotPlayer.from_str(player_info)
-            players[player.pid] = player
+        with open(log_file_path, "r") as log_file:
+            suit_rows, rank_rows = extract_game(*read_game(log_file))
         
-        # Read game rules (Line 4)
-        rule_info = log_file.readline()
-        rules = BaseRules.from_str(rule_info)
-    
-        # Extract skat and fix the hand of
-        # whoever's playing
-        extract_skat(rule_info, players)
-    
-        # Read gameplay (Lines 5-14)
-        for i in range(0, 10):
-            round_info = log_file.readline()
-            plays = extract_round(round_info)
-            process_round(plays, suit_file, rank_file, players, rules)
-        
-            # Update game state
-            winning_play = rules.winning_play(plays)
-            winning_player = players[winning_play.pid]
-            winning_player.cards_won.extend([play.card for play in plays])
-            for player in players.values():
-                player.cards_seen.extend([play.card for play in plays])
-        
-        # Close feature files
-        print("Processed file: " + log_file_path)
-        suit_file.close()
-        rank_file.close()
-        
-    # Error? Delete feature file
+    # Error? Don't write any feature files
     except Exception as e:
         print("Error processing file: " + os.path.basename(log_file_path))
         print(e)
-        try:
-            os.remove(suit_file_path)
-            os.remove(rank_file_path)
-        except:
-            pass
-    
-    # Close log file
-    log_file.close()
+        return
+
+    with open(suit_file_path, "w") as suit_file:
+        suit_file.write(format_rows(suit_rows))
+    with open(rank_file_path, "w") as rank_file:
+        rank_file.write(format_rows(rank_rows))
+    print("Processed file: " + log_file_path)
+
+def extract_log_file(log_file_path, binary = False):
+    """
+    Worker for stream_features. Returns the content hash of the
+    given log file and the formatted suit and rank feature rows
+    of the game in it, or None for the rows if the file could
+    not be processed. If 'binary' is set, the rows are packed
+    for a binary feature file (see feature_store.py) instead.
+    """
+    digest = file_digest(log_file_path)
+    try:
+        with open(log_file_path, "r") as log_file:
+            suit_rows, rank_rows = extract_game(*read_game(log_file))
+    except Exception as e:
+        print("Error processing file: " + os.path.basename(log_file_path))
+        print(e)
+        return digest, None, None
+    if binary:
+        return (digest, encode_rows(suit_rows, SUIT_COLUMNS),
+                encode_rows(rank_rows, RANK_COLUMNS))
+    return digest, format_rows(suit_rows), format_rows(rank_rows)
+
+def extract_record(record, binary = False):
+    """
+    Worker for extract_game_log. Returns the formatted suit and
+    rank feature rows of the given game log record (packed if
+    'binary' is set), or None for both if it could not be
+    processed.
+    """
+    try:
+        suit_rows, rank_rows = extract_game(*read_record(record))
+    except Exception as e:
+        print("Error processing game record")
+        print(e)
+        return None, None
+    if binary:
+        return (encode_rows(suit_rows, SUIT_COLUMNS),
+                encode_rows(rank_rows, RANK_COLUMNS))
+    return format_rows(suit_rows), format_rows(rank_rows)
+
+def extract_game_log(path, processes, binary = False):
+    """
+    Extracts the features of every game in a binary game log
+    (see game_log.py) in a pool of worker processes, and writes
+    them to the combined feature files (combined.bin if 'binary'
+    is set, combined.txt otherwise) in game order.
+    """
+    extension = ".bin" if binary else ".txt"
+    suit_path = "feature/suit/combined" + extension
+    rank_path = "feature/rank/combined" + extension
+    mode = "wb" if binary else "w"
+
+    reader = GameLogReader(path)
+    worker = functools.partial(extract_record, binary = binary)
+    n_games = 0
+    # Leaving the block terminates the workers, also when a
+    # worker or a write fails
+    with multiprocessing.Pool(processes) as pool, \
+         open(suit_path, mode) as suit_file, \
+         open(rank_path, mode) as rank_file:
+        if binary:
+            write_header(suit_file, SUIT_COLUMNS)
+            write_header(rank_file, RANK_COLUMNS)
+        for suit_rows, rank_rows in pool.imap(worker, reader, chunksize = 64):
+            if suit_rows is None:
+                continue
+            suit_file.write(suit_rows)
+            rank_file.write(rank_rows)
+            n_games += 1
+    reader.close()
+    print("Processed %d of %d games in %s" % (n_games, len(reader), path))
+
+def file_digest(path):
+    """
+    Returns the content hash of the given file.
+    """
+    with open(path, "rb") as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+def read_manifest(manifest_path, suit_path, rank_path):
+    """
+    Reads the manifest of the log files already extracted into
+    the combined feature files. Returns a dictionary mapping log
+    file names to content hashes, which is empty if the combined
+    files don't match the manifest (e.g. after a crash).
+    """
+    try:
+        with open(manifest_path, "r") as manifest:
+            sizes = manifest.readline().split()
+            if (int(sizes[0]) != os.path.getsize(suit_path) or
+                int(sizes[1]) != os.path.getsize(rank_path)):
+                return {}
+            digests = {}
+            for line in manifest:
+                digest, name = line.rstrip("\n").split(" ", 1)
+                digests[name] = digest
+            return digests
+    except (IOError, OSError, ValueError, IndexError):
+        return {}
+
+def write_manifest(manifest_path, digests, suit_path, rank_path):
+    """
+    Writes the manifest for the combined feature files.
+    """
+    with open(manifest_path, "w") as manifest:
+        manifest.write("%d %d\n" % (os.path.getsize(suit_path),
+                                    os.path.getsize(rank_path)))
+        for name in sorted(digests):
+            manifest.write("%s %s\n" % (digests[name], name))
+
+def stream_features(log_folder, processes, binary = False):
+    """
+    Parses every log file in the given folder in a pool of
+    worker processes and streams the feature rows straight into
+    the combined feature files, in log file name order, without
+    writing per-game feature files.
+
+    Log files that were extracted by a previous run and haven't
+    changed since (judged by content hash, see MANIFEST_PATH)
+    are skipped and the new rows are appended. If any extracted
+    log file has changed or disappeared, everything is extracted
+    again from scratch.
+
+    If 'binary' is set, the rows go to combined.bin files in
+    the binary format of feature_store.py instead.
+    """
+    if binary:
+        suit_path = "feature/suit/combined.bin"
+        rank_path = "feature/rank/combined.bin"
+        manifest_path = BINARY_MANIFEST_PATH
+    else:
+        suit_path = "feature/suit/combined.txt"
+        rank_path = "feature/rank/combined.txt"
+        manifest_path = MANIFEST_PATH
+    names = sorted(os.listdir(log_folder))
+
+    # Figure out which log files we still need to extract.
+    # If any extracted log file has changed or disappeared,
+    # we have to start over.
+    digests = read_manifest(manifest_path, suit_path, rank_path)
+    for name in list(digests):
+        if (name not in names or
+            file_digest(log_folder + "/" + name) != digests[name]):
+            digests = {}
+            break
+    mode = "a" if digests else "w"
+    if binary:
+        mode += "b"
+    todo = [name for name in names if name not in digests]
+    print("Extracting %d of %d log files" % (len(todo), len(names)))
+
+    paths = [log_folder + "/" + name for name in todo]
+    worker = functools.partial(extract_log_file, binary = binary)
+    # Leaving the block terminates the workers, also when a
+    # worker or a write fails
+    with multiprocessing.Pool(processes) as pool, \
+         open(suit_path, mode) as suit_file, \
+         open(rank_path, mode) as rank_file:
+        if binary and not digests:
+            write_header(suit_file, SUIT_COLUMNS)
+            write_header(rank_file, RANK_COLUMNS)
+        results = pool.imap(worker, paths, chunksize = 4)
+        for name, (digest, suit_text, rank_text) in zip(todo, results):
+            if suit_text is None:
+                continue
+            suit_file.write(suit_text)
+            rank_file.write(rank_text)
+            digests[name] = digest
+    write_manifest(manifest_path, digests, suit_path, rank_path)
 
 def main(argv):
     """
@@ -189,6 +386,30 @@ def main(argv):
                 with open("feature/rank/" + file_name) as infile:
                     outfile.write(infile.read())
                 
+    # '-g [binary log]' - read all games in a binary game log
+    # (see game_log.py) and write feature vectors to the
+    # combined files. Accepts '-p [processes]' and '-b' like
+    # below.
+    elif '-g' in argv:
+        index = argv.index('-g')
+        processes = multiprocessing.cpu_count()
+        if '-p' in argv:
+            p_index = argv.index('-p')
+            if len(argv) > p_index + 1 and argv[p_index + 1].isdigit():
+                processes = max(1, int(argv[p_index + 1]))
+        extract_game_log(argv[index + 1], processes, binary = '-b' in argv)
+
+    # '-p [processes]' - read all files under log/ in parallel
+    # and stream feature vectors straight into the combined
+    # files, skipping log files that were already extracted.
+    # Add '-b' to write binary combined.bin files instead.
+    elif '-p' in argv:
+        index = argv.index('-p')
+        processes = multiprocessing.cpu_count()
+        if len(argv) > index + 1 and argv[index + 1].isdigit():
+            processes = max(1, int(argv[index + 1]))
+        stream_features("log", processes, binary = '-b' in argv)
+
     # Two arguments - interpret as command to read a
     # specific log file and write feature vectors
     # to a specific feature file
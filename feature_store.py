@@ -0,0 +1,107 @@
+import os
+import sys
+import struct
+
+import numpy as np
+
+# Binary feature files start with a small header:
+#
+#   4 bytes - magic string "SKFT"
+#   1 byte  - format version
+#   1 byte  - NumPy type character of the values ('b' for int8,
+#             'h' for int16)
+#   2 bytes - number of columns (little endian)
+#   8 bytes - reserved
+#
+# followed by the feature rows, one fixed-width row after the
+# other with little endian values. Rows can be appended to the
+# end of the file at any time, and the whole file can be
+# memory-mapped as a (rows x columns) array (see open_store).
+MAGIC = b"SKFT"
+VERSION = 1
+HEADER = struct.Struct("<4sBcH8x")
+
+# Number of columns of suit and rank feature rows
+SUIT_COLUMNS = 30
+RANK_COLUMNS = 42
+
+# Every feature fits into a byte
+FEATURE_DTYPE = np.int8
+
+def write_header(file, columns, dtype = FEATURE_DTYPE):
+    """
+    Writes the header of a binary feature file.
+    """
+    dtype = np.dtype(dtype)
+    file.write(HEADER.pack(MAGIC, VERSION, dtype.char.encode("ascii"),
+                           columns))
+
+def read_header(file):
+    """
+    Reads the header of a binary feature file. Returns the
+    number of columns and the type of the values.
+    """
+    magic, version, char, columns = HEADER.unpack(file.read(HEADER.size))
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a feature file")
+    return columns, np.dtype(char.decode("ascii")).newbyteorder("<")
+
+def encode_rows(rows, columns, dtype = FEATURE_DTYPE):
+    """
+    Packs a list of feature tuples into bytes, ready to be
+    appended to a binary feature file.
+    """
+    values = np.array(rows, dtype = np.int64).reshape(-1, columns)
+    info = np.iinfo(dtype)
+    if values.size and (values.min() < info.min or values.max() > info.max):
+        raise ValueError("Feature value out of range for " +
+                         np.dtype(dtype).name)
+    return values.astype(np.dtype(dtype).newbyteorder("<")).tobytes()
+
+def append_rows(path, rows, columns, dtype = FEATURE_DTYPE):
+    """
+    Appends feature tuples to the given binary feature file,
+    creating it if it doesn't exist yet.
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        with open(path, "wb") as file:
+            write_header(file, columns, dtype)
+    else:
+        with open(path, "rb") as file:
+            if read_header(file) != (columns, np.dtype(dtype)):
+                raise ValueError("Feature file has a different layout")
+    with open(path, "ab") as file:
+        file.write(encode_rows(rows, columns, dtype))
+
+def open_store(path, mode = "r"):
+    """
+    Memory-maps a binary feature file as a (rows x columns)
+    array without parsing it.
+    """
+    with open(path, "rb") as file:
+        columns, dtype = read_header(file)
+    n_rows = (os.path.getsize(path) - HEADER.size) // (columns * dtype.itemsize)
+    if n_rows == 0:
+        return np.zeros((0, columns), dtype = dtype)
+    return np.memmap(path, dtype = dtype, mode = mode, offset = HEADER.size,
+                     shape = (n_rows, columns))
+
+def main(argv):
+    """
+    Converts a comma-separated feature file (e.g. a combined.txt
+    written by feature_extractor.py) into a binary feature file.
+
+    Usage: python(3) feature_store.py [text file] [binary file]
+    """
+    if len(argv) != 3:
+        print("Usage: python(3) feature_store.py [text file] [binary file]")
+        return 1
+    rows = np.loadtxt(argv[1], dtype = np.int64, delimiter = ",", ndmin = 2)
+    with open(argv[2], "wb") as file:
+        write_header(file, rows.shape[1])
+        file.write(encode_rows(rows, rows.shape[1]))
+    print("Wrote %d rows to %s" % (rows.shape[0], argv[2]))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,263 @@
+import io
+import os
+import re
+import sys
+import struct
+
+import numpy as np
+
+from card import *
+from rules import *
+from player import *
+from globals import *
+from bitcards import *
+
+# Binary game logs start with a small header:
+#
+#   4 bytes - magic string "SKLG"
+#   1 byte  - format version
+#   1 byte  - reserved
+#   2 bytes - record size in bytes (little endian)
+#   8 bytes - reserved
+#
+# followed by one fixed-size record per game. Since every
+# record has the same size, game i starts at byte
+# HEADER.size + i * RECORD.size, so the file doubles as its own
+# offset index. A record holds (all little endian):
+#
+#   3 x 4 bytes - hand masks of players 1-3 as dealt
+#                 (see bitcards.py)
+#   1 byte      - ID of the declarer
+#   1 byte      - game type (see bitcards.py), which is the
+#                 trump suit in a suit game
+#   4 bytes     - mask of the skat as dealt
+#   30 x 1 byte - plays in order, each packed as
+#                 (player ID << 5) | card index
+#
+# Player names are not stored. Games are only ever appended.
+MAGIC = b"SKLG"
+VERSION = 1
+HEADER = struct.Struct("<4sBxH8x")
+RECORD = struct.Struct("<IIIBBI30s")
+
+# Layout of a record as a NumPy structured type, for scanning
+# whole files at once (see GameLogReader.records)
+RECORD_DTYPE = np.dtype([("hands", "<u4", (3,)),
+                         ("declarer", "u1"),
+                         ("trumps", "u1"),
+                         ("skat", "<u4"),
+                         ("plays", "u1", (30,))])
+
+def extract_round(round_info):
+    """
+    This method extracts a round of gameplay from a string
+    description in a text log and returns a list of tuples
+    like so:
+    [(pid, card), (pid, card), (pid, card)]
+    """
+    pattern = re.compile(r"\(([0-9]+), ([cshd07891QKBA]+)\)")
+    results = re.findall(pattern, round_info)
+    
+    plays = []
+    for result in results:
+        play = Play(pid = int(result[0]), card = Card.from_abbrev(result[1]))
+        plays.append(play)
+    return plays
+
+def encode_game(hands, declarer_id, game_type, skat, rounds):
+    """
+    Packs a game into a record. 'hands' is the list of the
+    three hands as dealt, 'game_type' the game type (see
+    bitcards.py), 'skat' the list of the two skat cards and
+    'rounds' the list of rounds, each of which is a list of
+    plays.
+    """
+    plays = bytes((play.pid << 5) | card_index(play.card)
+                  for plays in rounds for play in plays)
+    return RECORD.pack(hand_mask(hands[0]), hand_mask(hands[1]),
+                       hand_mask(hands[2]), declarer_id, game_type,
+                       hand_mask(skat), plays)
+
+def decode_game(record):
+    """
+    Unpacks a record. Returns the list of the three hands as
+    dealt, the ID of the declarer, the game type (see
+    bitcards.py), the skat and the list of rounds.
+    """
+    fields = RECORD.unpack(record)
+    hands = [mask_hand(mask) for mask in fields[0:3]]
+    plays = [Play(pid = byte >> 5, card = CARDS[byte & 31])
+             for byte in fields[6]]
+    rounds = [plays[i:i + 3] for i in range(0, 30, 3)]
+    if fields[4] >= GAME_TYPES:
+        raise ValueError("Invalid game type: %d" % fields[4])
+    return hands, fields[3], fields[4], mask_hand(fields[5]), rounds
+
+def game_to_text(record):
+    """
+    Returns a record in the text log format (see
+    skat_server.open_log_file). Players are named after their
+    IDs. The declarer's hand post-skat is made up of the cards
+    they played.
+    """
+    hands, declarer_id, game_type, skat, rounds = decode_game(record)
+    lines = ["(%d, P%d, %s)\n" % (pid, pid, Card.hand_to_repr(hands[pid - 1]))
+             for pid in range(1, 4)]
+    declarer_hand = sorted(play.card for plays in rounds for play in plays
+                           if play.pid == declarer_id)
+    lines.append("(%d, %s, %s)\n" % (declarer_id, GAME_CODES[game_type],
+                                     Card.hand_to_repr(declarer_hand)))
+    for plays in rounds:
+        lines.append("[" + ", ".join("(%d, %s)" % (play.pid, repr(play.card))
+                                     for play in plays) + "]\n")
+    return "".join(lines)
+
+def game_from_text(log_file):
+    """
+    Reads one game from an open text log file and packs it
+    into a record.
+    """
+    hands = []
+    for i in range(0, 3):
+        player = BotPlayer.from_str(log_file.readline())
+        hands.append(player.hand)
+    rules = BaseRules.from_str(log_file.readline())
+    rounds = [extract_round(log_file.readline()) for i in range(0, 10)]
+    skat = mask_hand(FULL_DECK & ~(hand_mask(hands[0]) |
+                                   hand_mask(hands[1]) |
+                                   hand_mask(hands[2])))
+    return encode_game(hands, rules.declarer_id, rules.game_type, skat, rounds)
+
+class GameLogWriter:
+    """
+    Appends games to a binary game log.
+    """
+
+    def __init__(self, path):
+        """
+        Opens the given game log for appending, creating it if
+        it doesn't exist yet.
+        """
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, "ab")
+        if new:
+            self.file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+
+    def write(self, record):
+        """
+        Appends a record (see encode_game).
+        """
+        self.file.write(record)
+
+    def write_game(self, hands, declarer_id, game_type, skat, rounds):
+        """
+        Appends a game. See encode_game for the arguments.
+        """
+        self.write(encode_game(hands, declarer_id, game_type, skat, rounds))
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class GameLogReader:
+    """
+    Random access to the games in a binary game log.
+    """
+
+    def __init__(self, path):
+        """
+        Opens the given game log.
+        """
+        self.path = path
+        self.file = open(path, "rb")
+        magic, version, size = HEADER.unpack(self.file.read(HEADER.size))
+        if magic != MAGIC or version != VERSION or size != RECORD.size:
+            raise ValueError("Not a game log: " + path)
+
+    def __len__(self):
+        """
+        Returns the number of games in the log.
+        """
+        return (os.path.getsize(self.path) - HEADER.size) // RECORD.size
+
+    def __getitem__(self, i):
+        """
+        Returns the record of the i-th game.
+        """
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("Game index out of range")
+        self.file.seek(HEADER.size + i * RECORD.size)
+        return self.file.read(RECORD.size)
+
+    def __iter__(self):
+        """
+        Iterates over the records of all games in order.
+        """
+        self.file.seek(HEADER.size)
+        record = self.file.read(RECORD.size)
+        while len(record) == RECORD.size:
+            yield record
+            record = self.file.read(RECORD.size)
+
+    def records(self):
+        """
+        Memory-maps all records as a NumPy structured array
+        (see RECORD_DTYPE).
+        """
+        if len(self) == 0:
+            return np.zeros(0, dtype = RECORD_DTYPE)
+        return np.memmap(self.path, dtype = RECORD_DTYPE, mode = "r",
+                         offset = HEADER.size, shape = (len(self),))
+
+    def close(self):
+        self.file.close()
+
+def main(argv):
+    """
+    Converts text game logs to and from binary game logs.
+
+    Usage:
+    python(3) game_log.py -c [log folder or file] [binary log]
+        Appends every game of the given text logs to the binary
+        game log. A text log file may hold several games back
+        to back (e.g. the output of simulator.py).
+    python(3) game_log.py -t [binary log]
+        Prints the games in a binary game log in the text
+        log format.
+    """
+    if len(argv) == 4 and argv[1] == '-c':
+        if os.path.isdir(argv[2]):
+            paths = [argv[2] + "/" + name for name in sorted(os.listdir(argv[2]))]
+        else:
+            paths = [argv[2]]
+        writer = GameLogWriter(argv[3])
+        n_games = 0
+        for path in paths:
+            with open(path, "r") as log_file:
+                lines = log_file.readlines()
+            for start in range(0, len(lines) - 13, 14):
+                try:
+                    game = io.StringIO("".join(lines[start:start + 14]))
+                    writer.write(game_from_text(game))
+                    n_games += 1
+                except Exception as e:
+                    print("Error converting game in file: " + path)
+                    print(e)
+        writer.close()
+        print("Converted %d games" % n_games)
+    elif len(argv) == 3 and argv[1] == '-t':
+        reader = GameLogReader(argv[2])
+        for record in reader:
+            sys.stdout.write(game_to_text(record))
+        reader.close()
+    else:
+        print(main.__doc__)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
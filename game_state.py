@@ -0,0 +1,84 @@
+from card import *
+from bitcards import *
+
+class GameState:
+    """
+    Keeps track of what a player knows about the game so far.
+    The state is updated once per round with the cards played
+    (see observe), so that questions like "how many trumps
+    are left?" can be answered in constant time instead of
+    rescanning the cards seen.
+
+    Cards are grouped by the card that has to be followed.
+    In a suit game, the trump group (the trump suit plus the
+    Jacks) is identified by the trump suit, and every other
+    group by its suit, excluding Jacks. In a Grand, the trump
+    group (the Jacks) is identified by GRAND, and in a Null,
+    every suit is a group of its own, including its Jack (see
+    bitcards.GROUP_MASKS).
+    """
+
+    def __init__(self):
+        """
+        Creates the state at the start of a game.
+        """
+        # Mask of the cards that haven't been played in a
+        # finished round yet (see bitcards.py)
+        self.unseen = FULL_DECK
+
+        # Maps player IDs to their voids. voids[pid][group] is
+        # 1 if the player has failed to follow that group.
+        self.voids = {}
+
+    def group_mask(self, rules, suit):
+        """
+        Returns the mask of the cards in the group of the
+        given suit (or group).
+        """
+        return GROUP_MASKS[rules.game_type][suit]
+
+    def observe(self, plays, rules):
+        """
+        Updates the state with the plays of a finished round.
+        """
+        lead = card_index(plays[0].card)
+        follow = FOLLOW_MASKS[rules.game_type][lead]
+        lead_group = CARD_GROUPS[rules.game_type][lead]
+        for play in plays:
+            index = card_index(play.card)
+            self.unseen &= ~(1 << index)
+            if not follow & (1 << index):
+                if play.pid not in self.voids:
+                    self.voids[play.pid] = [0] * GROUPS
+                self.voids[play.pid][lead_group] = 1
+
+    def remaining(self, rules, suit):
+        """
+        Returns the number of unseen cards in the group of
+        the given suit (including the player's own hand).
+        """
+        return popcount(self.unseen & self.group_mask(rules, suit))
+
+    def highest(self, rules, suit):
+        """
+        Returns the index of the highest unseen card in the
+        group of the given suit, or None if there are none
+        left. Jacks beat everything else, and apart from that
+        a higher index means a higher card of the same suit
+        (except in a Null, see bitcards.NULL_RANK_ORDER).
+        """
+        cards = self.unseen & self.group_mask(rules, suit)
+        if not cards:
+            return None
+        if rules.game_type == NULL:
+            keys = TRICK_KEYS[NULL][cards.bit_length() - 1]
+            return max(mask_indices(cards), key = lambda card: keys[card])
+        jacks = cards & JACKS
+        return (jacks if jacks else cards).bit_length() - 1
+
+    def is_void(self, pid, suit):
+        """
+        Returns whether the given player is known to be void
+        in the group of the given suit.
+        """
+        return bool(self.voids.get(pid, [0] * GROUPS)[suit])
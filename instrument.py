@@ -0,0 +1,204 @@
+import sys
+import math
+import time
+import atexit
+import signal
+import threading
+
+# Durations are counted in logarithmic buckets. Bucket i holds
+# durations up to MIN_DURATION * GROWTH ** i seconds, so
+# percentiles are accurate to within about 10%, and recording a
+# duration costs the same no matter how many were recorded.
+MIN_DURATION = 1e-6
+GROWTH = 2 ** 0.25
+N_BUCKETS = 128
+
+_LOG_GROWTH = math.log(GROWTH)
+
+class Histogram:
+    """
+    Durations recorded for one phase of the game loop.
+    """
+
+    def __init__(self):
+        self.counts = [0] * N_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        """
+        Records a duration in seconds.
+        """
+        if seconds <= MIN_DURATION:
+            bucket = 0
+        else:
+            bucket = min(N_BUCKETS - 1,
+                         int(math.ceil(math.log(seconds / MIN_DURATION) /
+                                       _LOG_GROWTH)))
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        """
+        Returns an upper bound of the p-th percentile (0-100)
+        of the recorded durations.
+        """
+        if not self.count:
+            return 0.0
+        rank = p / 100.0 * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(self.max, MIN_DURATION * GROWTH ** bucket)
+        return self.max
+
+# Histograms by phase name. The lock is reentrant, so a thread
+# that is interrupted while holding it can still take it again.
+_histograms = {}
+_lock = threading.RLock()
+
+# Set by the SIGUSR1 handler. The handler itself doesn't print
+# anything (the signal may arrive while the lock is held, or in
+# the middle of a write), the table is printed by the next
+# record() instead.
+_dump_requested = False
+
+def record(phase, seconds):
+    """
+    Records the duration of one run of the given phase.
+    """
+    with _lock:
+        histogram = _histograms.get(phase)
+        if histogram is None:
+            histogram = _histograms[phase] = Histogram()
+        histogram.add(seconds)
+    if _dump_requested:
+        dump_if_requested()
+
+class span:
+    """
+    Times the enclosed block as one run of the given phase:
+
+        with span("log.write"):
+            file.write(line)
+    """
+
+    def __init__(self, phase):
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        record(self.phase, time.perf_counter() - self.start)
+        return False
+
+def timed(phase):
+    """
+    Decorator that times every call of a function as one run
+    of the given phase.
+    """
+    def decorate(func):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(phase, time.perf_counter() - start)
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+    return decorate
+
+def summary():
+    """
+    Returns a dictionary mapping each phase to its number of
+    runs and total, mean, p50, p95, p99 and max durations in
+    seconds.
+    """
+    with _lock:
+        stats = {}
+        for phase, histogram in _histograms.items():
+            stats[phase] = {
+                "count": histogram.count,
+                "total": histogram.total,
+                "mean": histogram.total / histogram.count,
+                "p50": histogram.percentile(50),
+                "p95": histogram.percentile(95),
+                "p99": histogram.percentile(99),
+                "max": histogram.max
+            }
+        return stats
+
+def report():
+    """
+    Returns a table of the timings of all phases, in
+    milliseconds.
+    """
+    lines = ["%-20s %8s %10s %9s %9s %9s %9s %9s" %
+             ("phase", "count", "total", "mean", "p50", "p95", "p99", "max")]
+    for phase, stats in sorted(summary().items()):
+        lines.append("%-20s %8d %10.1f %9.3f %9.3f %9.3f %9.3f %9.3f" %
+                     (phase, stats["count"], stats["total"] * 1000,
+                      stats["mean"] * 1000, stats["p50"] * 1000,
+                      stats["p95"] * 1000, stats["p99"] * 1000,
+                      stats["max"] * 1000))
+    return "\n".join(lines)
+
+def dump(file = None):
+    """
+    Prints the timing table, if anything was recorded.
+    """
+    if _histograms:
+        file = file or sys.stdout
+        file.write("\nTimings (ms):\n" + report() + "\n")
+        file.flush()
+
+def reset():
+    """
+    Forgets everything recorded so far.
+    """
+    with _lock:
+        _histograms.clear()
+
+def _request_dump(signum, frame):
+    """
+    SIGUSR1 handler. Only sets a flag, see _dump_requested.
+    """
+    global _dump_requested
+    _dump_requested = True
+
+def dump_if_requested():
+    """
+    Prints the timing table if SIGUSR1 asked for it since the
+    last time.
+    """
+    global _dump_requested
+    if _dump_requested:
+        _dump_requested = False
+        dump()
+
+def install():
+    """
+    Dumps the timings when the program exits, and after it
+    receives SIGUSR1 (where that signal exists), as soon as the
+    next phase is recorded.
+    """
+    atexit.register(dump)
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, _request_dump)
+
+def install_loop(loop):
+    """
+    Makes SIGUSR1 dump the timings from the given asyncio event
+    loop, right away and outside the signal handler, instead
+    of waiting for the next phase to be recorded.
+    """
+    if hasattr(signal, "SIGUSR1"):
+        loop.add_signal_handler(signal.SIGUSR1, dump)
@@ -1,4 +1,27 @@
+import time
 import socket
+import select
+import struct
+
+# Every message is prefixed with its length as a 4-byte
+# unsigned integer in network byte order
+HEADER = struct.Struct("!I")
+HEADER_SIZE = HEADER.size
+
+# Maximum number of bytes read from a socket at once
+RECV_SIZE = 65536
+
+def encode_frame(msg):
+    """
+    Prepends the length header to the given message bytes.
+    """
+    return HEADER.pack(len(msg)) + msg
+
+def decode_header(header):
+    """
+    Returns the message length given in a length header.
+    """
+    return HEADER.unpack(header)[0]
 
 def open_socket(port):
     """
@@ -10,58 +33,207 @@ def open_socket(port):
     sk.listen(1)
     return sk
 
-def recv_msg(conn):
+def recv_exactly(sock, n):
     """
-    Receives a message from the socket.
+    Reads exactly n bytes from a socket, however many
+    recv calls it takes.
+    """
+    data = bytearray()
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise IOError("Network connection closed")
+        data.extend(chunk)
+    return bytes(data)
+
+class Connection:
     """
-    try:
-        # Unwrap message length header
-        header = conn.recv(8).decode("UTF-8")
-        length = int(header)
-        body = conn.recv(length)
+    A framed message connection over a socket.
+
+    Incoming bytes are read in large chunks into a buffer, so
+    one recv call can deliver several queued messages (or only
+    part of one). Outgoing messages are queued and written all
+    at once on flush, which happens automatically before every
+    receive. flush_nowait writes only as much as the socket
+    takes right away, so a slow client can't hold up the
+    sender (see flush_all).
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray()
+        self.outgoing = bytearray()
+
+        # Writes are coalesced by hand, so don't let Nagle's
+        # algorithm hold back the small ones
+        try:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (OSError, AttributeError):
+            pass
+
+    def fill(self, n):
+        """
+        Reads from the socket until at least n bytes are
+        buffered.
+        """
+        while len(self.buffer) < n:
+            chunk = self.sock.recv(RECV_SIZE)
+            if not chunk:
+                raise IOError("Network connection closed")
+            self.buffer.extend(chunk)
+
+    def recv_msg(self):
+        """
+        Receives the next message.
+        """
+        self.flush()
+        try:
+            self.fill(HEADER_SIZE)
+            length = decode_header(self.buffer[:HEADER_SIZE])
+            self.fill(HEADER_SIZE + length)
+        except OSError:
+            raise IOError("Network connection failure")
+        body = bytes(self.buffer[HEADER_SIZE:HEADER_SIZE + length])
+        del self.buffer[:HEADER_SIZE + length]
         return body
-    except:
-        raise IOError("Network connection failure")
-        return None
-    
+
+    def send_msg(self, msg):
+        """
+        Queues a message to be sent on the next flush.
+        """
+        self.outgoing += encode_frame(msg)
+
+    def flush(self):
+        """
+        Sends all queued messages, blocking until done.
+        """
+        if not self.outgoing:
+            return
+        data = bytes(self.outgoing)
+        self.outgoing.clear()
+        try:
+            self.sock.sendall(data)
+        except OSError:
+            raise IOError("Network connection failure")
+
+    def flush_nowait(self):
+        """
+        Sends as much of the queued data as the socket accepts
+        without blocking. Returns whether everything was sent.
+        """
+        if not self.outgoing:
+            return True
+        self.sock.setblocking(False)
+        try:
+            sent = self.sock.send(self.outgoing)
+            del self.outgoing[:sent]
+        except BlockingIOError:
+            pass
+        except OSError:
+            raise IOError("Network connection failure")
+        finally:
+            self.sock.setblocking(True)
+        return not self.outgoing
+
+    def close(self):
+        """
+        Sends any queued messages and closes the socket.
+        """
+        try:
+            self.flush()
+        finally:
+            self.sock.close()
+
+    def abort(self):
+        """
+        Closes the socket, dropping any queued messages.
+        """
+        self.outgoing.clear()
+        self.sock.close()
+
+def connect(host, port):
+    """
+    Opens a connection to the given host and port.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.connect((host, port))
+    return Connection(sock)
+
+def accept(server_socket):
+    """
+    Accepts a connection on the given server socket.
+    """
+    sock, addr = server_socket.accept()
+    return Connection(sock)
+
+def recv_msg(conn):
+    """
+    Receives a message from the connection.
+    """
+    return conn.recv_msg()
+
 def recv_str(conn):
     """
     Convenience method for reading a string
-    from the socket.
+    from the connection.
     """
     return recv_msg(conn).decode("UTF-8")
 
 def send_msg(conn, msg):
     """
-    Sends a message out the socket.
-    """
-    try:
-        # Prepend message length header
-        length = len(msg)
-        msg = bytes(str(length).ljust(8), "UTF-8") + msg
-        conn.send(msg)
-    except:
-        raise IOError("Network connection failure")
-        return None
-    
+    Queues a message on the connection. Queued messages
+    go out on the next flush or receive.
+    """
+    conn.send_msg(msg)
+
 def send_str(conn, msg, log = False):
     """
     Convenience method for sending a string
-    out the socket.
+    out the connection.
     """
-    length = len(msg)
-    msg = bytes(str(length).ljust(8), "UTF-8") + bytes(msg, "UTF-8")
-    conn.send(msg)
+    conn.send_msg(bytes(msg, "UTF-8"))
     if log:
         print(msg)
-    
+
+def flush_all(conns, timeout = None):
+    """
+    Sends the queued messages of all given connections.
+
+    Without a timeout, this blocks until every connection
+    is flushed. With a timeout, the connections are written
+    to whenever they are ready, so a slow one doesn't delay
+    the others. Returns the list of connections that
+    couldn't be flushed within the timeout or failed.
+    """
+    if timeout is None:
+        for conn in conns:
+            conn.flush()
+        return []
+
+    deadline = time.time() + timeout
+    failed = []
+    waiting = list(conns)
+    while True:
+        pending = []
+        for conn in waiting:
+            try:
+                if not conn.flush_nowait():
+                    pending.append(conn)
+            except IOError:
+                failed.append(conn)
+        remaining = deadline - time.time()
+        if not pending or remaining <= 0:
+            return failed + pending
+        waiting = pending
+        select.select([], [conn.sock for conn in pending], [], remaining)
+
 def broadcast_msg(conns, msg):
     """
     Sends a message out to all given connections
     """
     for conn in conns:
         send_msg(conn, msg)
-        
+
 def broadcast_str(conns, msg, log = False):
     """
     Convenience method for broadcasting a string
@@ -71,4 +243,3 @@ def broadcast_str(conns, msg, log = False):
         send_str(conn, msg)
     if log:
         print(msg)
-    
\ No newline at end of file
@@ -1,12 +1,24 @@
 import re
 import abc
-import pickle
+import time
 import random
+import multiprocessing
+
+import numpy as np
+
+import instrument
 
 from card import *
 from rules import *
 from globals import *
+from bitcards import *
+from predictor import *
+from game_state import *
 from networking import *
+from protocol import *
+from solver import Solver, SearchTimeout
+from bidding import bid_limit, choose_game, discard
+from sampler import DealSampler, SKAT
 
 class Player:
     """
@@ -36,10 +48,12 @@ class Player:
         self.cards_won = []
 
     @abc.abstractmethod
-    def get_bet(self):
+    def get_bet(self, bid):
         """
-        Retrieves a player's pre-game bet over the network.
-        Used to decide if the player gets to declare the game.
+        Asks the player during the auction (see bidding.Auction)
+        whether they would play for the given bid. Returns "y"
+        or "n", or for human players "sb" or "rb" to hand their
+        seat over to a bot.
         """
         pass
     
@@ -105,20 +119,22 @@ class HumanPlayer(Player):
         self.conn = conn
         
         # This player's name
-        self.name = recv_str(self.conn)
+        self.name = recv_text(self.conn)
         
         # Send hand to player client
-        send_msg(self.conn, pickle.dumps(self.hand))
+        send_hand(self.conn, self.hand)
+        self.conn.flush()
     
-    def get_bet(self):
+    def get_bet(self, bid):
         """
-        Retrieves a player's pre-game bet over the network.
-        Used to decide if the player gets to play.
+        Asks the player over the network whether they would
+        play for the given bid.
         """
         if not self.conn:
             print("No op!")
             return None
-        bet = recv_str(self.conn)
+        send_text(self.conn, "Bid " + str(bid) + "? (y/n/sb/rb)")
+        bet = recv_text(self.conn)
         print("Received " + bet + " from " + self.name)
         return bet
     
@@ -132,10 +148,10 @@ class HumanPlayer(Player):
             return None
             
         print("\nSending skat to " + self.name + "...")
-        send_msg(self.conn, pickle.dumps(skat))
+        send_hand(self.conn, skat)
     
         # Receive hidden cards from the player client
-        hidden = pickle.loads(recv_msg(self.conn))
+        hidden = recv_hand(self.conn)
         self.hand.extend(skat)
         self.hand.remove(hidden[0])
         self.hand.remove(hidden[1])
@@ -153,7 +169,7 @@ class HumanPlayer(Player):
         if not self.conn:
             print("No op!")
             return None
-        trumps = recv_str(self.conn)
+        trumps = recv_text(self.conn)
         rules = BaseRules(self.pid, trumps)
         return rules
     
@@ -164,9 +180,10 @@ class HumanPlayer(Player):
         if not self.conn:
             print("No op!")
             return None
-        send_str(self.conn, "Your turn")
-        send_msg(self.conn, pickle.dumps(previous_plays))
-        card = pickle.loads(recv_msg(self.conn))
+        with instrument.span("network.get_play"):
+            send_text(self.conn, "Your turn")
+            send_plays(self.conn, previous_plays)
+            card = recv_card(self.conn)
         self.hand.remove(card)
         return card
         
@@ -176,14 +193,24 @@ class BotPlayer(Player):
     input and returns computer-predicted values instead.
     """
     
-    def __init__(self, pid, hand, name, suit_algo = None, rank_algo = None):
+    def __init__(self, pid, hand, name, suit_algo = None, rank_algo = None,
+                 verbose = True, rng = None):
         """
         Initializes a computer player with an ID and hand.
+        If a random.Random instance 'rng' is given, the bot
+        uses it for its random choices instead of the global
+        random state.
         """
         super(BotPlayer, self).__init__(pid, hand)
         
         self.name = name
 
+        # Should we print our reasoning while playing?
+        self.verbose = verbose
+
+        # Source of randomness for our choices
+        self.rng = rng if rng else random
+
         # What algorithms are we going to use to make plays?
         self.suit_algo = suit_algo
         self.rank_algo = rank_algo
@@ -192,6 +219,10 @@ class BotPlayer(Player):
         # (Excludes cards on player's hand and
         # cards in current round)
         self.cards_seen = []
+
+        # What we know about the game so far, updated
+        # along with cards_seen (see see_round)
+        self.state = GameState()
         
         # A reference deck of all Skat cards
         self.reference_deck = Card.get_deck()
@@ -201,6 +232,13 @@ class BotPlayer(Player):
 
         # Has my friend run out of a suit?
         self.diff_frd = [0, 0, 0, 0]
+
+        # Highest bid we would play for (None until we're first
+        # asked), the highest bid we made, and the game we
+        # chose after picking up the skat
+        self.max_bid = None
+        self.bid = 0
+        self.game_type = None
     
     @staticmethod
     def from_str(player_info):
@@ -220,54 +258,97 @@ class BotPlayer(Player):
         # Return player
         return BotPlayer(int(results[0]), hand, results[1])
     
-    def get_bet(self):
+    def see_round(self, plays, rules):
+        """
+        Updates the cards seen by this player with the plays
+        of a finished round.
+        """
+        self.cards_seen.extend([play.card for play in plays])
+        self.state.observe(plays, rules)
+
+    def log(self, msg):
+        """
+        Prints a message about what this bot is doing, unless
+        the bot was created with verbose = False.
         """
-        A computer never plays.
+        if self.verbose:
+            print(msg)
+
+    def get_bet(self, bid):
+        """
+        Bids up to the value of the best game the bot won often
+        enough when playing out random deals of its hand (see
+        bidding.bid_limit).
         """
-        return 'n'
+        if self.max_bid is None:
+            self.max_bid = bid_limit(hand_mask(self.hand), self.pid - 1, self.rng)
+            self.log(self.name + " bids up to " + str(self.max_bid))
+        if bid > self.max_bid:
+            return 'n'
+        self.bid = max(self.bid, bid)
+        return 'y'
         
-    def hide_cards(self, skat):
+    def hide_cards(self, skat, game_type = None):
         """
-        A computer should never play, so it will never need to
-        hide cards.
+        Picks up the skat, chooses the game that did best on
+        random deals of the other cards among the games worth
+        the bid, and hides the two cards that suit it best (see
+        bidding.choose_game). If 'game_type' is set, the bot
+        plays that game instead and only picks the cards to
+        hide for it.
         """
-        pass
+        hand = hand_mask(self.hand)
+        skat_mask = hand_mask(skat)
+        if game_type is None:
+            game_type, hidden = choose_game(hand, skat_mask, self.pid - 1,
+                                            self.bid, self.rng)
+        else:
+            hidden = discard(hand | skat_mask, game_type)
+        self.game_type = game_type
+        self.hand = mask_hand((hand | skat_mask) & ~hidden)
+        self.cards_won.extend(mask_hand(hidden))
 
     def get_rules(self):
         """
-        A computer should never play. Returns a dummy value.
+        Declares the game chosen when picking up the skat.
         """
-        return BaseRules(self.pid, "s")
+        return BaseRules(self.pid, GAME_CODES[self.game_type])
     
+    @instrument.timed("bot.get_play")
     def get_play(self, previous_plays, rules):
         """
         Generates suit and rank feature vectors and passes
-        it on to Matlab to generate a prediction for the best move.
-        This is what happens when you have a multi-person project
-        and are too lazy to rewrite Matlab stuff with numpy...
+        them on to the prediction algorithm (either Matlab or
+        an in-process NumPy model, see predictor.py) to generate
+        a prediction for the best move.
         """
         # Choose a random legal card to play. We will
         # fall back to this if the computer algorithm
         # suggests an illegal card to play.
         valid_cards = [card for card in self.hand 
                        if rules.valid(card, self.hand, previous_plays)]
-        random_card = random.choice(valid_cards)
+        random_card = self.rng.choice(valid_cards)
         if not self.suit_algo or not self.rank_algo:
-            print(self.name + " has no prediction algorithm. Playing randomly.")
+            self.log(self.name + " has no prediction algorithm. Playing randomly.")
+            self.hand.remove(random_card)
+            return random_card
+
+        # The features (and the models trained on them) only
+        # describe suit games
+        if rules.trump_suit is None:
+            self.log(self.name + " can't predict plays in this game. Playing randomly.")
             self.hand.remove(random_card)
             return random_card
 
         # Log hand
-        print("\n"+ self.name + " has hand: ")
-        for card in self.hand:
-            print(card, end = " ")
-        print()
+        self.log("\n"+ self.name + " has hand: ")
+        self.log(Card.hand_to_str(self.hand))
 
         # First predict the best suit
         chosen_suit = self.choose_suit(previous_plays, rules)
         if chosen_suit == None:
             chosen_suit = rules.trump_suit if random_card in rules.trumps else random_card.suit
-        print("Chose to play suit " + str(chosen_suit))
+        self.log("Chose to play suit " + str(chosen_suit))
         
         # Get rank features (dependent on suit)
         chosen_rank = self.choose_rank(previous_plays, rules, chosen_suit)
@@ -278,7 +359,7 @@ class BotPlayer(Player):
                 chosen_rank = valid_cards_of_chosen_suit[0].rank
             else:
                 chosen_rank = random_card.rank
-        print("Chose to play rank " + str(chosen_rank))
+        self.log("Chose to play rank " + str(chosen_rank))
 
         # Inflate card
         if chosen_rank >= 7:
@@ -286,15 +367,15 @@ class BotPlayer(Player):
         else:
             abbrev = repr(chosen_suit) + self.decode_card_rank(chosen_rank)
         chosen_card = Card.from_abbrev(abbrev)
-        print("Selected card " + str(chosen_card))
+        self.log("Selected card " + str(chosen_card))
 
         # Play, with error checking
         if rules.valid(chosen_card, self.hand, previous_plays):
             self.hand.remove(chosen_card)
             return chosen_card
         else:
-            print("ILLEGAL MOVE: " + str(chosen_card))
-            print("Falling back on random card: " + str(random_card))
+            self.log("ILLEGAL MOVE: " + str(chosen_card))
+            self.log("Falling back on random card: " + str(random_card))
             self.hand.remove(random_card)
             return random_card
     
@@ -359,14 +440,9 @@ class BotPlayer(Player):
 
         # If we have a suit feature, make a suit prediction
         if s_features:
-            print("Talking to Matlab for suit")
-
-            # Talk to Matlab
-            args = {}
-            for i in range(0, len(s_features)):
-                args['arg' + str(i + 1)] = s_features[i]
-            s_result = mlab.run(self.suit_algo, args)['result']
-            print("Matlab results were " + str(s_result))
+            self.log("Predicting suit")
+            s_result = predict(self.suit_algo, s_features, "suit")
+            self.log("Prediction results were " + str(s_result))
 
             # Figure out chosen suit (handle case where illegal suit was chosen)
             if s_result:
@@ -397,25 +473,38 @@ class BotPlayer(Player):
         # If we have a rank feature, make a rank prediction
         r_result = None
         if r_features:
-            print("Talking to Matlab for rank")
-
-            # Talk to Matlab
-            args = {}
-            for i in range(0, len(r_features)):
-                args['arg' + str(i + 1)] = r_features[i]
-            r_result = mlab.run(self.rank_algo, args)['result']
-            print("Matlab results were " + str(r_result))
+            self.log("Predicting rank")
+            r_result = predict(self.rank_algo, r_features, "rank")
+            self.log("Prediction results were " + str(r_result))
 
             # Figure out chosen rank (handle case where illegal rank was chosen)
             if r_result:
-                print("Possible ranks: " + str(possible_ranks))
+                self.log("Possible ranks: " + str(possible_ranks))
                 for i in range(0, len(r_result)):
                     chosen_rank = r_result[i]
-                    print("Chosen rank: " + str(chosen_rank))
+                    self.log("Chosen rank: " + str(chosen_rank))
                     if chosen_rank in possible_ranks:
                         return chosen_rank
-        return random.choice(possible_ranks)
+        return self.rng.choice(possible_ranks)
        
+    def update_diffs(self, previous_plays, rules, suits):
+        """
+        Updates diff_opp and diff_frd with the plays made so
+        far in this round. 'suits' is the list of suits rotated
+        so that the trump suit is at the beginning.
+        """
+        id_opp = rules.declarer_id
+        id_frd = 6 - self.pid - rules.declarer_id
+        if len(previous_plays) > 0:
+            start_suit = previous_plays[0].card.suit
+            for play in previous_plays:
+                if play.card.suit != start_suit:
+                    if play.pid == id_opp:
+                        self.diff_opp[suits.index(start_suit)] = 1
+                    elif play.pid == id_frd:
+                        self.diff_frd[suits.index(start_suit)] = 1
+
+    @instrument.timed("examine_suit")
     def examine_suit(self, previous_plays, played_card, rules):
         """
         This method gets called right before this player plays
@@ -446,6 +535,10 @@ class BotPlayer(Player):
           rules - for instance, counting the number of
           trumps on a hand.
         """
+        # The features only describe suit games
+        if rules.trump_suit is None:
+            return None
+
         # Skip plays where no suit decision was necessary
         if len(previous_plays) > 0:
             
@@ -472,45 +565,25 @@ class BotPlayer(Player):
         i = suits.index(rules.trump_suit)        
         suits = suits[i:] + suits[:i]
         
-        # Count number of plays made so far in this round
-        n_plays = len(previous_plays)
-        
         # Count number of cards of each suit, on hand
-        n_s1 = rules.count_trumps(self.hand)
-        n_s2 = rules.count_suit(suits[1], self.hand)
-        n_s3 = rules.count_suit(suits[2], self.hand)
-        n_s4 = rules.count_suit(suits[3], self.hand)
-                       
-        # Find remaining cards in the game
-        cur_deck = list(set(self.reference_deck) - set(self.cards_seen))
-        #for play in previous_plays:
-        #    cur_deck.remove(play.card);
-
-        # Separate remaining cards by suit
-        cur_trumps = [card for card in cur_deck if card in rules.trumps] 
-        cur_suit1 = cur_trumps
-        cur_suit2 = [cd for cd in cur_deck
-                     if cd.suit == suits[1] 
-                     and cd not in cur_trumps]
-        cur_suit3 = [cd for cd in cur_deck 
-                     if cd.suit == suits[2] 
-                     and cd not in cur_trumps]
-        cur_suit4 = [cd for cd in cur_deck 
-                     if cd.suit == suits[3] 
-                     and cd not in cur_trumps]
+        hand = hand_mask(self.hand)
+        n_s1 = count_trumps(rules.trump_suit, hand)
+        n_s2 = count_suit(suits[1], hand)
+        n_s3 = count_suit(suits[2], hand)
+        n_s4 = count_suit(suits[3], hand)
                      
-        # Count remaining cards (and not in hand) by suit
-        n_remain = [len(cur_suit1) - n_s1, 
-                    len(cur_suit2) - n_s2, 
-                    len(cur_suit3) - n_s3, 
-                    len(cur_suit4) - n_s4]
+        # Count remaining cards (and not in hand) by suit.
+        # The remaining cards are the ones that haven't been
+        # played in a previous round.
+        n_remain = [self.state.remaining(rules, suits[0]) - n_s1, 
+                    self.state.remaining(rules, suits[1]) - n_s2, 
+                    self.state.remaining(rules, suits[2]) - n_s3, 
+                    self.state.remaining(rules, suits[3]) - n_s4]
               
         # Determine if player has winning card in each suit
-        winning_cards = [rules.winning_card(cur_suit1),
-                         rules.winning_card(cur_suit2),
-                         rules.winning_card(cur_suit3),
-                         rules.winning_card(cur_suit4)]
-        has_winning = [int(cd in self.hand) for cd in winning_cards];
+        winning_cards = [self.state.highest(rules, suit) for suit in suits]
+        has_winning = [int(cd is not None and bool(hand & (1 << cd)))
+                       for cd in winning_cards]
         
         # Find opponent id
         id_opp = rules.declarer_id
@@ -519,14 +592,7 @@ class BotPlayer(Player):
         id_frd = 6 - self.pid - rules.declarer_id
         
         # Has my opponent or friend run out of a suit?
-        if n_plays > 0:
-            start_suit = previous_plays[0].card.suit
-            for play in previous_plays:
-                if play.card.suit != start_suit:
-                    if play.pid == id_opp:
-                        self.diff_opp[suits.index(start_suit)] = 1
-                    elif play.pid == id_frd:
-                        self.diff_frd[suits.index(start_suit)] = 1
+        self.update_diffs(previous_plays, rules, suits)
 
         # Am I playing first?
         first = int(len(previous_plays) == 0)
@@ -588,6 +654,7 @@ class BotPlayer(Player):
                 big_pts[2],
                 big_pts[3])
                 
+    @instrument.timed("examine_rank")
     def examine_rank(self, previous_plays, played_card, rules, chosen_suit = Suit.clubs):
         """
         This method gets called right after examine_suit. 'suit'
@@ -604,6 +671,10 @@ class BotPlayer(Player):
         code will handle writing the tuple to the feature file.
         """
 
+        # The features only describe suit games
+        if rules.trump_suit is None:
+            return None
+
         # Determine chosen suit
         # In feature extraction, we simply choose the suit
         # of the played card
@@ -628,9 +699,6 @@ class BotPlayer(Player):
             if rules.count_suit(suit, self.hand) == 1:
                 return None
  
-        # Count number of plays made so far in this round
-        n_plays = len(previous_plays)
-       
         # Rotate suits so that the trump suit is at
         # the beginning of the list
         suits = [Suit.clubs, Suit.spades, Suit.hearts, Suit.diamonds];
@@ -644,14 +712,7 @@ class BotPlayer(Player):
         id_frd = 6 - self.pid - rules.declarer_id
         
         # Has my opponent or friend run out of a suit?
-        if n_plays > 0:
-            start_suit = previous_plays[0].card.suit
-            for play in previous_plays:
-                if play.card.suit != start_suit:
-                    if play.pid == id_opp:
-                        self.diff_opp[suits.index(start_suit)] = 1
-                    elif play.pid == id_frd:
-                        self.diff_frd[suits.index(start_suit)] = 1
+        self.update_diffs(previous_plays, rules, suits)
 
         # Am I playing first?
         first = int(len(previous_plays) == 0)
@@ -674,43 +735,17 @@ class BotPlayer(Player):
         winner = rules.winning_play(previous_plays);
         is_winning = int(winner.pid == id_frd) if winner else 0
                         
-        # Find remaining cards in the game (including hand)
-        cur_deck_hand = [card for card in self.reference_deck
-                         if (card not in self.cards_seen)]
-        #for play in previous_plays:
-        #    cur_deck_hand.remove(play.card)
-        
-        # What's the highest card of the given suit?
-        if played_card:
-            if played_card in rules.trumps:
-                suit_len = 11
-                full_cards = rules.trumps
-                cur_cards = [cd for cd in cur_deck_hand if cd in rules.trumps]
-            else:
-                suit_len = 7
-                full_cards = [cd for cd in self.reference_deck 
-                              if cd.suit == suits[suits.index(suit)] 
-                              and cd not in rules.trumps]
-                cur_cards = [cd for cd in cur_deck_hand
-                             if cd.suit == suits[suits.index(suit)]
-                             and cd not in rules.trumps]
-                full_cards.extend([0] * 4)
+        # What's the highest remaining card of the given suit?
+        # (Remaining cards include the ones on our hand)
+        full_cards = [8 * suit + rank for rank in range(0, 7)]
+        if suit == rules.trump_suit:
+            suit_len = 11
+            full_cards.extend([8 * jack_suit + Rank.jack
+                               for jack_suit in range(0, 4)])
         else:
-            if chosen_suit == rules.trump_suit:
-                suit_len = 11
-                full_cards = rules.trumps
-                cur_cards = [cd for cd in cur_deck_hand if cd in rules.trumps]
-            else:
-                suit_len = 7
-                full_cards = [cd for cd in self.reference_deck 
-                              if cd.suit == suits[suits.index(chosen_suit)] 
-                              and cd not in rules.trumps]
-                cur_cards = [cd for cd in cur_deck_hand
-                             if cd.suit == suits[suits.index(chosen_suit)]
-                             and cd not in rules.trumps]
-                full_cards.extend([0] * 4)
-
-        highest_card = rules.winning_card(cur_cards)
+            suit_len = 7
+        highest_card = self.state.highest(rules, suit)
+        hand = hand_mask(self.hand)
         
         # Describes the remaining cards of the suit to play.
         # The indices correspond to the cards in the following way:
@@ -729,14 +764,13 @@ class BotPlayer(Player):
         for i in range(0,suit_len):
             if full_cards[i] == highest_card:
                 win_card[i] = 1
-            if full_cards[i] in self.hand:
+            if hand & (1 << full_cards[i]):
                 has_card[i] = 1
-                if opp_card and full_cards[i] > opp_card:
+                if opp_card and CARDS[full_cards[i]] > opp_card:
                     beat_opp[i] = 1 
 
         # How many cards are left in the game?
-        num_cards_left = len([card for card in cur_deck_hand 
-                              if card not in self.hand])
+        num_cards_left = popcount(self.state.unseen & ~hand)
 
         # Encode played card
         if not played_card:
@@ -770,3 +804,203 @@ class BotPlayer(Player):
             self.diff_frd[suits.index(suit)],
             num_cards_left,
         ] + has_card + win_card + beat_opp)
+
+# Default time budget of a PIMCPlayer move in seconds, and the
+# most deals it looks at for one move
+PIMC_BUDGET = 1.0
+PIMC_SAMPLES = 20
+
+# PIMCPlayers only search once they have at most this many cards
+# left. With more, a deal takes seconds to solve (see
+# solver.py), so they play like a BotPlayer instead.
+PIMC_MAX_CARDS = 8
+
+# Worker pools shared by the PIMCPlayers in this process, by
+# number of processes
+_pimc_pools = {}
+
+def pimc_pool(processes):
+    """
+    Returns the worker pool with the given number of
+    processes for PIMCPlayers, starting it if there is none
+    yet.
+    """
+    pool = _pimc_pools.get(processes)
+    if pool is None:
+        pool = _pimc_pools[processes] = multiprocessing.Pool(processes)
+    return pool
+
+def pimc_search(job):
+    """
+    Evaluates the legal cards of a PIMCPlayer on random deals
+    of the cards it hasn't seen (see sampler.py), until it has
+    looked at 'n_samples' deals or runs out of time. 'job' is a tuple of
+    (seed, deadline, n_samples, knowledge), with the deadline
+    on the time.monotonic() clock, see PIMCPlayer.knowledge.
+
+    Returns a dictionary mapping each card index to the sum of
+    its values (the solver's score for the player's side, see
+    solver.py) over the deals, and the number of deals.
+    """
+    seed, deadline, n_samples, knowledge = job
+    (pid, declarer_id, game_type, hand, unknown, sizes, allowed,
+     leader_id, trick) = knowledge
+
+    # Whatever isn't in the other players' hands is in the skat
+    sizes = dict(sizes)
+    sizes[SKAT] = popcount(unknown) - sum(sizes.values())
+    sampler = DealSampler(unknown, sizes, allowed)
+    totals = {}
+    n_done = 0
+    if not sampler.count:
+        return totals, n_done
+
+    places = sampler.places
+    for deal in sampler.sample_batch(n_samples, np.random.default_rng(seed)):
+        dealt = dict(zip(places, (int(mask) for mask in deal)))
+        hands = [dealt.get(other, hand) for other in range(1, 4)]
+        solver = Solver(game_type, declarer_id, deadline)
+        try:
+            values = solver.card_values(hands, leader_id, trick)
+        except SearchTimeout:
+            break
+        for card, value in values.items():
+            if pid != declarer_id:
+                value = -value
+            totals[card] = totals.get(card, 0) + value
+        n_done += 1
+        if time.monotonic() >= deadline:
+            break
+    return totals, n_done
+
+class PIMCPlayer(BotPlayer):
+    """
+    A computer Skat player that searches instead of guessing
+    (perfect information Monte Carlo). For every move, it
+    deals the cards it hasn't seen at random, in a way that is
+    consistent with what it knows, solves every deal with all
+    hands known (see solver.py), and plays the card that does
+    best on average.
+
+    Every move is limited to a time budget. Early in the game,
+    while the bot has more than 'max_cards' cards, deals take
+    too long to solve, so it plays like a BotPlayer with the
+    given algorithms instead. It also does so when not a
+    single deal could be solved in time. Both show up in the
+    timings (see instrument.py): searched moves as
+    "pimc.search", and the others as "pimc.early" and
+    "pimc.timeout".
+    """
+
+    def __init__(self, pid, hand, name, suit_algo = None, rank_algo = None,
+                 verbose = True, rng = None, budget = PIMC_BUDGET,
+                 samples = PIMC_SAMPLES, processes = None,
+                 max_cards = PIMC_MAX_CARDS):
+        """
+        Initializes a searching player. 'budget' is the time
+        limit of every move in seconds, 'samples' the most
+        deals looked at for one move, 'processes' the number of
+        worker processes to spread them over (default: one per
+        core), and 'max_cards' the most cards in hand to search
+        with. The worker processes are started here, so that
+        starting them doesn't count against the first move.
+        """
+        super(PIMCPlayer, self).__init__(pid, hand, name,
+                                         suit_algo = suit_algo,
+                                         rank_algo = rank_algo,
+                                         verbose = verbose, rng = rng)
+        self.budget = budget
+        self.samples = samples
+        self.processes = processes or multiprocessing.cpu_count()
+        self.max_cards = max_cards
+        self.pool = None
+        if min(self.processes, self.samples) > 1:
+            self.pool = pimc_pool(self.processes)
+
+    def knowledge(self, previous_plays, rules):
+        """
+        Returns what this player knows about the hidden cards,
+        as a tuple of (player ID, declarer ID, game type, hand
+        mask, mask of the unknown cards, dictionary mapping the
+        other players to their number of cards, dictionary
+        mapping them to the mask of cards they may still hold,
+        ID of the player who led this round, card indices
+        played in this round).
+        """
+        hand = hand_mask(self.hand)
+        trick = tuple(card_index(play.card) for play in previous_plays)
+        unknown = self.state.unseen & ~hand & ~hand_mask(self.cards_won)
+        for card in trick:
+            unknown &= ~(1 << card)
+
+        played = set(play.pid for play in previous_plays)
+        sizes = {}
+        allowed = {}
+        for pid in range(1, 4):
+            if pid == self.pid:
+                continue
+            sizes[pid] = len(self.hand) - (1 if pid in played else 0)
+            allowed[pid] = FULL_DECK
+            voids = self.state.voids.get(pid, [0] * GROUPS)
+            for group in range(0, GROUPS):
+                if voids[group]:
+                    allowed[pid] &= ~self.state.group_mask(rules, group)
+
+        # Players who didn't follow in this round are void too
+        if trick:
+            follow = FOLLOW_MASKS[rules.game_type][trick[0]]
+            for play, card in zip(previous_plays, trick):
+                if not follow & (1 << card):
+                    allowed[play.pid] &= ~follow
+
+        leader_id = previous_plays[0].pid if previous_plays else self.pid
+        return (self.pid, rules.declarer_id, rules.game_type, hand, unknown,
+                sizes, allowed, leader_id, trick)
+
+    def get_play(self, previous_plays, rules):
+        """
+        Picks the legal card with the best average outcome over
+        random deals of the hidden cards.
+        """
+        valid_cards = [card for card in self.hand
+                       if rules.valid(card, self.hand, previous_plays)]
+        if len(valid_cards) == 1:
+            self.hand.remove(valid_cards[0])
+            return valid_cards[0]
+        if len(self.hand) > self.max_cards:
+            with instrument.span("pimc.early"):
+                return super(PIMCPlayer, self).get_play(previous_plays, rules)
+
+        start = time.monotonic()
+        knowledge = self.knowledge(previous_plays, rules)
+        deadline = start + self.budget
+        n_jobs = min(self.processes, self.samples)
+        jobs = [(self.rng.randrange(2 ** 32), deadline,
+                 (self.samples + i) // n_jobs, knowledge)
+                for i in range(0, n_jobs)]
+        if self.pool:
+            results = self.pool.map(pimc_search, jobs)
+        else:
+            results = [pimc_search(job) for job in jobs]
+
+        totals = {}
+        n_done = 0
+        for job_totals, job_done in results:
+            for card, value in job_totals.items():
+                totals[card] = totals.get(card, 0) + value
+            n_done += job_done
+        if not n_done:
+            self.log(self.name + " ran out of time. Falling back on prediction.")
+            card = super(PIMCPlayer, self).get_play(previous_plays, rules)
+            instrument.record("pimc.timeout", time.monotonic() - start)
+            return card
+
+        # Prefer keeping high cards when cards do equally well
+        best_card = max(valid_cards,
+                        key = lambda card: (totals[card_index(card)], -int(card),
+                                            -card_index(card)))
+        self.log(self.name + " looked at " + str(n_done) + " deals and chose " +
+                 str(best_card))
+        instrument.record("pimc.search", time.monotonic() - start)
+        self.hand.remove(best_card)
+        return best_card
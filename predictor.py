@@ -0,0 +1,297 @@
+import os
+import sys
+import threading
+
+from collections import OrderedDict
+
+import numpy as np
+
+from scipy.io import loadmat
+
+import instrument
+
+from globals import *
+
+# Algorithm specs starting with this prefix are evaluated
+# in-process with NumPy instead of going through Matlab
+NUMPY_PREFIX = "numpy:"
+
+# Default location of the trained softmax parameters
+SOFTMAX_PARAMETERS = "Matlab/PythonInterface/softmax_parameters.mat"
+
+# Maximum number of feature vectors sent to Matlab in one call
+BATCH_SIZE = 500
+
+# Maximum number of predictions kept in the decision cache
+CACHE_SIZE = 65536
+
+class SoftmaxModel:
+    """
+    A trained softmax regression model. This is the NumPy
+    equivalent of PredictSuitSoftmax.m and PredictRankSoftmax.m.
+    """
+
+    def __init__(self, theta):
+        """
+        Creates a model from a parameter matrix 'theta' with
+        one row per feature and one column per class.
+        """
+        self.theta = np.asarray(theta, dtype = float)
+
+    @staticmethod
+    def from_file(path, target):
+        """
+        Loads the parameters for the given target ("suit" or
+        "rank") from a .mat file written by the Matlab trainers.
+        """
+        params = loadmat(path)
+        return SoftmaxModel(params["theta_" + target])
+
+    def predict(self, features):
+        """
+        Returns the list of classes ordered from most to least
+        likely, given a single feature vector. The first feature
+        is the label column, which gets replaced by the intercept.
+        """
+        x = np.array(features, dtype = float)
+        x[0] = 1
+
+        # Normalizing the softmax doesn't change the ordering,
+        # so we can rank the classes by their raw scores. The
+        # stable sort breaks ties the same way Matlab does.
+        scores = x.dot(self.theta)
+        return [int(i) for i in np.argsort(-scores, kind = "stable")]
+
+    def predict_batch(self, rows):
+        """
+        Same as predict, for every row of a 2-D array of
+        feature vectors at once. Returns one list of classes
+        per row.
+        """
+        X = np.array(rows, dtype = float, ndmin = 2)
+        X[:, 0] = 1
+        scores = X.dot(self.theta)
+        return np.argsort(-scores, axis = 1, kind = "stable").tolist()
+
+class DecisionCache:
+    """
+    Bounded cache of recent predictions, keyed by algorithm,
+    target and feature vector. Bots see the same situations
+    over and over again (especially early in the game), so
+    most predictions can skip the model, or the round trip to
+    Matlab. When full, the least recently used entry is
+    dropped.
+
+    The cache is shared by bots running on other threads (see
+    async_server.py), so every method holds a lock.
+    """
+
+    def __init__(self, size = CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the cached prediction for the given key, or
+        None if there is none.
+        """
+        with self.lock:
+            result = self.entries.get(key)
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            return result
+
+    def put(self, key, result):
+        """
+        Caches a prediction, dropping the least recently used
+        one if the cache is full.
+        """
+        if self.size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = result
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.size:
+                self.entries.popitem(last = False)
+
+    def clear(self, algo = None):
+        """
+        Drops the cached predictions of the given algorithm, or
+        all of them. The hit and miss counts are kept.
+        """
+        with self.lock:
+            if algo is None:
+                self.entries.clear()
+            else:
+                for key in [key for key in self.entries if key[0] == algo]:
+                    del self.entries[key]
+
+    def stats(self):
+        """
+        Returns a dictionary with the number of hits, misses
+        and cached predictions.
+        """
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "size": len(self.entries)}
+
+# Models are loaded once per (algorithm, target) pair
+_models = {}
+
+# Predictions made so far (see predict)
+cache = DecisionCache()
+
+def parse_algo(algo):
+    """
+    Splits a NumPy algorithm spec like "numpy:softmax" or
+    "numpy:softmax:path/to/parameters.mat" into the model
+    name and the parameter file path.
+    """
+    parts = algo[len(NUMPY_PREFIX):].split(":", 1)
+    name = parts[0]
+    path = parts[1] if len(parts) > 1 else SOFTMAX_PARAMETERS
+    return name, path
+
+def uses_matlab(algo):
+    """
+    Returns whether the given algorithm spec needs the
+    Matlab server.
+    """
+    return bool(algo) and not algo.startswith(NUMPY_PREFIX)
+
+def load_model(algo, target):
+    """
+    Returns the in-process model for the given algorithm spec
+    and target ("suit" or "rank"), loading it on first use.
+    """
+    key = (algo, target)
+    if key not in _models:
+        name, path = parse_algo(algo)
+        if name != "softmax":
+            raise ValueError("Unknown NumPy algorithm: " + name)
+        _models[key] = SoftmaxModel.from_file(path, target)
+    return _models[key]
+
+def reload_model(algo):
+    """
+    Makes the next prediction with the given algorithm spec
+    load its parameters again (e.g. after retraining), and
+    drops its cached predictions. For Matlab scripts, which
+    load their parameters on every call, only the cache is
+    cleared.
+    """
+    for key in [key for key in _models if key[0] == algo]:
+        del _models[key]
+    cache.clear(algo)
+
+def predict(algo, features, target):
+    """
+    Returns the list of classes ordered from most to least
+    likely for the given feature vector. 'algo' is either a
+    NumPy spec (see parse_algo) or the path of a Matlab script.
+    Results are cached (see DecisionCache). Anything else a
+    Matlab script returns (e.g. None or a single number) is
+    passed on as is and not cached, so callers can fall back
+    to a random card.
+    """
+    key = (algo, target, tuple(features))
+    result = cache.get(key)
+    if result is not None:
+        return list(result)
+    result = predict_uncached(algo, features, target)
+    if isinstance(result, (list, tuple, np.ndarray)) and len(result) > 0:
+        cache.put(key, tuple(result))
+        return list(result)
+    return result
+
+def predict_uncached(algo, features, target):
+    """
+    Same as predict, without going through the cache.
+    """
+    if algo.startswith(NUMPY_PREFIX):
+        with instrument.span("predict.numpy"):
+            return load_model(algo, target).predict(features)
+
+    # Talk to Matlab
+    args = {}
+    for i in range(0, len(features)):
+        args['arg' + str(i + 1)] = features[i]
+    with instrument.span("predict.matlab"):
+        return mlab.run(algo, args)['result']
+
+def batch_script(algo):
+    """
+    Returns the path of the batch version of a Matlab script,
+    e.g. PredictSuitSoftmaxBatch.m for PredictSuitSoftmax.m,
+    or None if there is none.
+    """
+    root, ext = os.path.splitext(algo)
+    path = root + "Batch" + ext
+    return path if os.path.exists(path) else None
+
+def predict_batch(algo, rows, target):
+    """
+    Same as predict, for a whole 2-D array (or list) of
+    feature vectors. Returns one list of classes per row.
+    Matlab scripts with a batch version (see batch_script)
+    get up to BATCH_SIZE rows per call, others one call per
+    row.
+    """
+    if len(rows) == 0:
+        return []
+    if algo.startswith(NUMPY_PREFIX):
+        return load_model(algo, target).predict_batch(rows)
+
+    script = batch_script(algo)
+    if not script:
+        return [predict_uncached(algo, row, target) for row in rows]
+    X = np.array(rows, ndmin = 2)
+    results = []
+    for start in range(0, X.shape[0], BATCH_SIZE):
+        chunk = X[start:start + BATCH_SIZE]
+        args = {"x": chunk.ravel().tolist(), "n": chunk.shape[0]}
+        # Matlab returns a flat list for a single row
+        with instrument.span("predict.matlab_batch"):
+            result = np.array(mlab.run(script, args)['result'], dtype = int)
+        results.extend(result.reshape(chunk.shape[0], -1).tolist())
+    return results
+
+def main(argv):
+    """
+    Evaluates a prediction algorithm on a feature file.
+    Prints the fraction of feature vectors whose label is
+    the algorithm's first choice.
+
+    Usage: python(3) predictor.py [algorithm] [suit|rank] [feature file]
+    """
+    if len(argv) != 4 or argv[2] not in ("suit", "rank"):
+        print("Usage: python(3) predictor.py [algorithm] [suit|rank] "
+              "[feature file]")
+        return 1
+    algo, target, path = argv[1:4]
+    if path.endswith(".bin"):
+        from feature_store import open_store
+        rows = np.array(open_store(path))
+    else:
+        rows = np.loadtxt(path, dtype = int, delimiter = ",", ndmin = 2)
+    if uses_matlab(algo):
+        mlab.start()
+    try:
+        rankings = predict_batch(algo, rows, target)
+    finally:
+        if uses_matlab(algo):
+            mlab.stop()
+    correct = sum(1 for row, ranking in zip(rows, rankings)
+                  if ranking[0] == row[0])
+    print("Top choice matches the label for %d of %d feature vectors (%.3f)" %
+          (correct, len(rows), correct / max(1, len(rows))))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
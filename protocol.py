@@ -0,0 +1,147 @@
+import struct
+
+from card import *
+from rules import *
+from globals import *
+from bitcards import *
+from networking import *
+
+# Every message sent between the Skat server and client is one
+# frame (see networking.py) laid out as:
+#
+#   1 byte  - protocol version
+#   1 byte  - message type
+#   n bytes - body
+#
+# with the following bodies:
+#
+#   TEXT  - UTF-8 string (names, bets, announcements, trumps)
+#   CARD  - 1 byte card index (see bitcards.py)
+#   HAND  - 4 byte mask of a list of cards, little endian.
+#           Decoded hands are sorted.
+#   PLAYS - 2 bytes per play: player ID, card index
+#   RULES - 1 byte declarer ID, 1 byte game type (see
+#           bitcards.py)
+#
+# Version 2 added Grand and Null games, and version 3 the
+# auction (see bidding.py), which asks for bets and announces
+# the declarer's score in TEXT messages.
+VERSION = 3
+
+TEXT = 0
+CARD = 1
+HAND = 2
+PLAYS = 3
+RULES = 4
+
+MASK = struct.Struct("<I")
+
+class ProtocolError(IOError):
+    """
+    Raised for messages that don't follow the protocol.
+    """
+    pass
+
+def encode(msg_type, body):
+    """
+    Prepends the protocol version and message type to the
+    given body.
+    """
+    return bytes((VERSION, msg_type)) + body
+
+def decode(msg, msg_type):
+    """
+    Checks the version and type of a message and returns its
+    body.
+    """
+    if len(msg) < 2:
+        raise ProtocolError("Truncated message")
+    if msg[0] != VERSION:
+        raise ProtocolError("Unsupported protocol version %d" % msg[0])
+    if msg[1] != msg_type:
+        raise ProtocolError("Expected message type %d, got %d" %
+                            (msg_type, msg[1]))
+    return msg[2:]
+
+def encode_text(text):
+    return encode(TEXT, bytes(text, "UTF-8"))
+
+def decode_text(msg):
+    return decode(msg, TEXT).decode("UTF-8")
+
+def encode_card(card):
+    return encode(CARD, bytes((card_index(card),)))
+
+def decode_card(msg):
+    body = decode(msg, CARD)
+    if len(body) != 1 or body[0] > 31:
+        raise ProtocolError("Invalid card")
+    return CARDS[body[0]]
+
+def encode_hand(hand):
+    return encode(HAND, MASK.pack(hand_mask(hand)))
+
+def decode_hand(msg):
+    body = decode(msg, HAND)
+    if len(body) != MASK.size:
+        raise ProtocolError("Invalid hand")
+    return mask_hand(MASK.unpack(body)[0])
+
+def encode_plays(plays):
+    return encode(PLAYS, bytes(value for play in plays
+                               for value in (play.pid, card_index(play.card))))
+
+def decode_plays(msg):
+    body = decode(msg, PLAYS)
+    if len(body) % 2 or any(index > 31 for index in body[1::2]):
+        raise ProtocolError("Invalid plays")
+    return [Play(pid = body[i], card = CARDS[body[i + 1]])
+            for i in range(0, len(body), 2)]
+
+def encode_rules(rules):
+    return encode(RULES, bytes((rules.declarer_id, rules.game_type)))
+
+def decode_rules(msg):
+    body = decode(msg, RULES)
+    if len(body) != 2 or body[1] >= GAME_TYPES:
+        raise ProtocolError("Invalid rules")
+    return BaseRules(body[0], GAME_CODES[body[1]])
+
+# Sending and receiving typed messages over a connection
+
+def send_text(conn, text, log = False):
+    send_msg(conn, encode_text(text))
+    if log:
+        print(text)
+
+def recv_text(conn):
+    return decode_text(recv_msg(conn))
+
+def send_card(conn, card):
+    send_msg(conn, encode_card(card))
+
+def recv_card(conn):
+    return decode_card(recv_msg(conn))
+
+def send_hand(conn, hand):
+    send_msg(conn, encode_hand(hand))
+
+def recv_hand(conn):
+    return decode_hand(recv_msg(conn))
+
+def send_plays(conn, plays):
+    send_msg(conn, encode_plays(plays))
+
+def recv_plays(conn):
+    return decode_plays(recv_msg(conn))
+
+def send_rules(conn, rules):
+    send_msg(conn, encode_rules(rules))
+
+def recv_rules(conn):
+    return decode_rules(recv_msg(conn))
+
+def broadcast_text(conns, text, log = False):
+    broadcast_msg(conns, encode_text(text))
+    if log:
+        print(text)
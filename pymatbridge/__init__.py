@@ -3,47 +3,71 @@
 # Part of Python-MATLAB-bridge
 # Max Jaderberg 2012
 ###############################################
-from http.client import BadStatusLine
+from http.client import BadStatusLine, HTTPConnection, HTTPException
 from multiprocessing import Process
 
 import urllib
-import urllib.request
 import urllib.parse
 
 import os
 import json
 import time
+import queue
+import select
 import subprocess
 
 MATLAB_FOLDER = '%s/matlab' % os.path.realpath(os.path.dirname(__file__))
 
 class Matlab(object):
     eval_func = 'web_feval.m'
-    running = False
     matlab = None
     host = None
     port = None
     server = None
     id = None
-    server_process = Process()
+    instances = 1
+    server_processes = []
 
-    def __init__(self, matlab='/Applications/MATLAB_R2011a.app/bin/matlab', host='localhost', port=4000, id='python-matlab-bridge'):
+    def __init__(self, matlab='/Applications/MATLAB_R2011a.app/bin/matlab', host='localhost', port=4000, id='python-matlab-bridge', instances=1):
         self.matlab = matlab
         self.host = host
         self.port = port
         self.server = 'http://%s:%s' % (self.host, str(self.port))
         self.id = id
+        self.set_instances(instances)
 
-    def _run_matlab_server(self):
-        subprocess.call('%s -nodesktop -nosplash -nodisplay -r "cd pymatbridge/matlab,webserver(%s),exit" -logfile ./pymatbridge/logs/matlablog_%s.txt > ./pymatbridge/logs/bashlog_%s.txt' % (self.matlab, self.port, self.id, self.id))
+    def set_instances(self, instances):
+        # Use several MATLAB servers on consecutive ports, starting
+        # with self.port. Each one has a persistent connection, and
+        # idle connections wait in a queue, so concurrent calls to
+        # run are spread over the servers and block only while all
+        # of them are busy.
+        self.instances = instances
+        self.ports = [self.port + i for i in range(instances)]
+        self.connections = [HTTPConnection(self.host, port) for port in self.ports]
+        self.idle = queue.Queue()
+        for conn in self.connections:
+            self.idle.put(conn)
+
+    def _instance_id(self, port):
+        if self.instances == 1:
+            return self.id
+        return '%s_%d' % (self.id, port)
+
+    def _run_matlab_server(self, port):
+        id = self._instance_id(port)
+        subprocess.call('%s -nodesktop -nosplash -nodisplay -r "cd pymatbridge/matlab,webserver(%s),exit" -logfile ./pymatbridge/logs/matlablog_%s.txt > ./pymatbridge/logs/bashlog_%s.txt' % (self.matlab, port, id, id))
         return True
 
     def start(self):
-        # Start the MATLAB server
+        # Start the MATLAB servers
         print("Starting MATLAB")
-        self.server_process = Process(target=self._run_matlab_server)
-        self.server_process.daemon = True
-        self.server_process.start()
+        self.server_processes = []
+        for port in self.ports:
+            process = Process(target=self._run_matlab_server, args=(port,))
+            process.daemon = True
+            process.start()
+            self.server_processes.append(process)
         while not self.is_connected():
             print("...still starting up...")
             time.sleep(1)
@@ -51,26 +75,46 @@ class Matlab(object):
         return True
 
     def stop(self):
-        # Stop the MATLAB server
+        # Stop the MATLAB servers
+        conns = self._take_all()
         try:
-            try:
-                resp = self._open_page('exit_server.m', {'id': self.id})
-            except BadStatusLine:
-                pass
-        except:
-            pass
+            for conn in conns:
+                try:
+                    try:
+                        resp = self._request(conn, 'exit_server.m', {'id': self.id})
+                    except BadStatusLine:
+                        pass
+                except:
+                    pass
+                conn.close()
+        finally:
+            self._put_all(conns)
         print("MATLAB closed")
         return True
 
     def is_connected(self):
+        conns = self._take_all()
         try:
-            resp = self._open_page('test_connect.m', {'id': self.id})
-            if resp['message']:
-                return True
+            for conn in conns:
+                resp = self._request(conn, 'test_connect.m', {'id': self.id})
+                if not resp['message']:
+                    return False
+            return True
         except:
             pass
+        finally:
+            self._put_all(conns)
         return False
 
+    def _take_all(self):
+        # Wait until every MATLAB server is idle, so no call to run is
+        # using a connection while it is tested or closed
+        return [self.idle.get() for conn in self.connections]
+
+    def _put_all(self, conns):
+        for conn in conns:
+            self.idle.put(conn)
+
     def is_function_processor_working(self):
         try:
             result = self.run('%s/test_functions/test_sum.m' % MATLAB_FOLDER, {'echo': 'Matlab: Function processor is working!'})
@@ -81,8 +125,6 @@ class Matlab(object):
         return False
 
     def run(self, func_path, func_args=None, maxtime=None):
-        if self.running:
-            time.sleep(0.5)
         page_args = {
             'func_path': os.path.abspath(func_path),
         }
@@ -95,12 +137,49 @@ class Matlab(object):
         return result
 
     def _open_page(self, page_name, arguments={}, timeout=10):
-        self.running = True
+        # Wait for an idle MATLAB server
+        conn = self.idle.get()
+        try:
+            return self._request(conn, page_name, arguments, timeout)
+        finally:
+            self.idle.put(conn)
+
+    def _request(self, conn, page_name, arguments={}, timeout=10):
         data = urllib.parse.urlencode(arguments)
         binary_data = data.encode('utf-8')
-        page = urllib.request.urlopen('%s/%s' % (self.server, page_name), binary_data, timeout)
-        self.running = False
-        result = str(page.read(), encoding='utf-8')
+        headers = {'Content-Type': 'application/x-www-form-urlencoded',
+                   'Connection': 'keep-alive'}
+
+        # The connection is kept open between requests if the server
+        # allows it. If it was closed in the meantime, sending on the
+        # stale socket fails, so reconnect and send the request again.
+        # Failures after the request went out are not retried, since
+        # MATLAB may already have run it.
+        for attempt in range(2):
+            if conn.sock and select.select([conn.sock], [], [], 0)[0]:
+                # An idle socket is only readable once the server
+                # has closed it
+                conn.close()
+            reused = conn.sock is not None
+            try:
+                conn.timeout = timeout
+                if conn.sock:
+                    conn.sock.settimeout(timeout)
+                conn.request('POST', '/' + page_name, binary_data, headers)
+            except (HTTPException, ConnectionError):
+                conn.close()
+                if attempt or not reused:
+                    raise
+                continue
+            try:
+                page = conn.getresponse()
+                result = str(page.read(), encoding='utf-8')
+            except:
+                conn.close()
+                raise
+            if page.will_close:
+                conn.close()
+            break
         
         # Hacky fix for backslashes in Windows paths messing up JSON decoding (read as invalid escape)
         result = result.replace('\\', '\\\\')
@@ -108,5 +187,3 @@ class Matlab(object):
         if result != None:
             return json.loads(result)
         return ''
-
-
@@ -1,6 +1,7 @@
 import re
 
 from card import *
+from bitcards import *
 
 class BaseRules:
     """
@@ -13,25 +14,33 @@ class BaseRules:
     
     This class keeps track of trumps and exports the methods
     valid(...) and winner(...) to determine (2) and (3).
+
+    Games are suit games, Grands or Nulls. All three parts
+    are looked up in the tables of bitcards.py for the game
+    type, rather than by comparing Cards.
     """
     
     def __init__(self, declarer_id, trumps):
-        deck = Card.get_deck()
+        """
+        Creates the rules of a game declared by the given
+        player. 'trumps' is the code of the game (see
+        bitcards.GAME_CODES): "c", "s", "h" or "d" for a suit
+        game, "g" for a Grand or "n" for a Null.
+        """
         self.declarer_id = declarer_id
-        self.trump_suit = Suit.from_str(trumps)
-        
-        # Get trumps from the given suit
-        trump_suit = {
-            "c": Suit.clubs,
-            "s": Suit.spades,
-            "h": Suit.hearts,
-            "d": Suit.diamonds
-        }[trumps]
-        self.trumps = [card for card in deck if card.suit == trump_suit]
-
-        # Add jacks, which are always trumps
-        self.trumps.extend([card for card in deck if card.rank == Rank.jack])
-        self.trumps = sorted(list(set(self.trumps)))
+
+        # Game type (see bitcards.py), and the trump suit, which
+        # is None in a Grand or Null
+        self.game_type = GAME_CODES.index(trumps)
+        if self.game_type < GRAND:
+            self.trump_suit = Suit(self.game_type)
+        else:
+            self.trump_suit = None
+
+        # Mask of the trumps (see bitcards.py), and the trumps
+        # as a sorted list of cards
+        self.trump_mask = TRUMP_MASKS[self.game_type]
+        self.trumps = mask_hand(self.trump_mask)
 
     @staticmethod
     def from_str(rules_info):
@@ -39,7 +48,7 @@ class BaseRules:
         Creates a BaseRules object from a string description
         from a log file.
         """
-        pattern = re.compile(r"\((\d), ([cshd]+), ([a-zA-Z0-9 ]+)\)")
+        pattern = re.compile(r"\((\d), ([cshdgn]+), ([a-zA-Z0-9 ]+)\)")
         results = pattern.match(rules_info).groups()
         
         # Return rules
@@ -49,34 +58,60 @@ class BaseRules:
         """
         Returns a string description of this game.
         """
-        # Using __repr__ here instead of __str__ because
-        # str returns a Unicode character that causes
+        # Using the game code here instead of the suit symbol
+        # because str returns a Unicode character that causes
         # encoding issues over the network
-        return repr(self.trump_suit)
-        
+        return GAME_CODES[self.game_type]
+
     def count_points(self, hand):
         """
-        Returns the number of points in the given hand
+        Returns the number of points in the given hand that
+        count in this game (none in a Null).
         """
         if not hand:
             return 0
-        if len(hand) == 0:
-            return 0
-        return reduce(lambda card_1, card_2: int(card_1) + int(card_2), hand)
+        return game_points(self.game_type, hand_mask(hand))
+
+    def declarer_won(self, cards_won):
+        """
+        Returns whether the declarer won the game, given the
+        cards they won (including the skat). A Null is won by
+        not taking a single trick, and other games by taking
+        more than 60 points.
+        """
+        if self.game_type == NULL:
+            return len(cards_won) <= 2
+        return self.count_points(cards_won) > 60
 
     def count_suit(self, suit, hand):
         """
         Counts the number of cards with the given suit
-        on the given hand, excluding Jacks.
+        on the given hand, excluding Jacks (unless this is a
+        Null, where Jacks belong to their suit).
         """
-        return len([card for card in hand if (card.suit == suit and
-                                              card.rank != Rank.jack)])
+        return popcount(hand_mask(hand) & PLAIN_MASKS[self.game_type][suit])
 
     def count_trumps(self, hand):
         """
         Counts the number of trumps on a given hand.
         """
-        return len(set(hand).intersection(set(self.trumps)))
+        return popcount(hand_mask(hand) & self.trump_mask)
+
+    def is_trump(self, card):
+        """
+        Returns whether the given card is a trump.
+        """
+        return bool(self.trump_mask & (1 << (8 * card.suit + card.rank)))
+
+    def winning_index(self, cards):
+        """
+        Returns the position of the winning card in a trick
+        given as a list of card indices (see bitcards.py),
+        starting with the lead card.
+        """
+        if len(cards) == 0:
+            return None
+        return trick_winner(cards, self.game_type)
 
     def winning_card(self, cards):
         """
@@ -84,25 +119,7 @@ class BaseRules:
         """
         if len(cards) == 0:
             return None
-        
-        trumps = [card for card in cards if card in self.trumps]
-        
-        # If trumps were played, the winner will be one of them
-        if len(trumps) > 0:
-            winner = trumps[0]
-            for i in range(1, len(trumps)):
-                trump = trumps[i]
-                winner = trump if trump > winner else winner
-        
-        # If trumps were not played...
-        else:
-            winner = cards[0]
-            for i in range(1, len(cards)):
-                card = cards[i]
-                if card > winner and card.suit == winner.suit:
-                    winner = card
-                
-        return winner
+        return cards[self.winning_index([card_index(card) for card in cards])]
 
     def winning_play(self, plays):
         """ 
@@ -113,25 +130,8 @@ class BaseRules:
         """
         if len(plays) == 0:
             return None
-        
-        trump_plays = [play for play in plays if play[1] in self.trumps]
-        
-        # If trumps were played, the winner will be one of them
-        if len(trump_plays) > 0:
-            winner = trump_plays[0]
-            for i in range(1, len(trump_plays)):
-                trump_play = trump_plays[i]
-                winner = trump_play if trump_play[1] > winner[1] else winner
-        
-        # If trumps were not played...
-        else:
-            winner = plays[0]
-            for i in range(1, len(plays)):
-                play = plays[i]
-                if play[1] > winner[1] and play[1].suit == winner[1].suit:
-                    winner = play
-                
-        return winner
+        return plays[self.winning_index([card_index(play[1])
+                                         for play in plays])]
 
     def valid(self, card, hand, plays):
         """ 
@@ -146,22 +146,10 @@ class BaseRules:
         if len(plays) == 0:
             return True
 
-        # Do we have to play trumps?
-        if plays[0][1] in self.trumps:
-            
-            # If we do have trumps, then the play is valid
-            # if it the given card is indeed a trump
-            if self.count_trumps(hand) != 0:
-                return card in self.trumps
-            
-            # Otherwise, we don't have trumps => any card
-            # on our hand is valid 
-            return True;
-        
-        # Do we have to play a suit?
-        # The play is valid if either:
-        # (1) We play a card of the starting suit
-        # (2) (1) is false but we don't have any more cards
-        #     of the starting suit
-        return ((card.suit == plays[0][1].suit and card.rank != Rank.jack) or
-                self.count_suit(plays[0][1].suit, hand) == 0)
+        # Otherwise the card has to follow the first card (see
+        # bitcards.FOLLOW_MASKS), unless we have no card that
+        # does
+        follow = FOLLOW_MASKS[self.game_type][card_index(plays[0][1])]
+        if follow & (1 << card_index(card)):
+            return True
+        return not hand_mask(hand) & follow
@@ -0,0 +1,206 @@
+import sys
+import math
+import time
+
+import numpy as np
+
+from card import *
+from bitcards import *
+
+# Deals the cards a player hasn't seen among the places they can
+# be in (the other players' hands and the skat), uniformly at
+# random among all deals that agree with what the player knows.
+#
+# Rejection sampling (deal at random, throw away deals that break
+# a void) gets very slow late in the game, when most random deals
+# break one. Instead, cards are grouped into classes by the set
+# of places that may hold them (e.g. "only the skat or player 2"
+# for a suit player 3 is out of). For every way of splitting the
+# classes up among the places, the number of deals is a product
+# of multinomial coefficients. So the split is drawn first, with
+# a probability proportional to its number of deals, and then the
+# cards of every class are shuffled into their places. Every
+# consistent deal comes out with the same probability.
+
+# Key of the skat among the places cards are dealt to
+SKAT = 0
+
+def multinomial(counts):
+    """
+    Returns the number of ways of splitting sum(counts) cards
+    into groups of the given sizes.
+    """
+    ways = 1
+    n = 0
+    for count in counts:
+        n += count
+        ways *= math.comb(n, count)
+    return ways
+
+def _compositions(n, limits):
+    """
+    Yields every way of writing n as a sum of len(limits)
+    numbers, each at most its limit.
+    """
+    if len(limits) == 1:
+        if n <= limits[0]:
+            yield (n,)
+        return
+    for first in range(0, min(n, limits[0]) + 1):
+        for rest in _compositions(n - first, limits[1:]):
+            yield (first,) + rest
+
+class DealSampler:
+    """
+    Uniform sampler of the deals of a set of cards among
+    several places with given sizes, where every place may
+    only hold some of the cards.
+    """
+
+    def __init__(self, unknown, sizes, allowed):
+        """
+        Prepares the sampler. 'unknown' is the mask of the
+        cards to deal, 'sizes' a dictionary mapping every place
+        (player IDs, or SKAT) to its number of cards, and
+        'allowed' a dictionary mapping places to the mask of the
+        cards they may hold (places that are missing may hold
+        any card).
+        """
+        if sum(sizes.values()) != popcount(unknown):
+            raise ValueError("Sizes don't add up to the number of unknown cards")
+        self.places = sorted(sizes)
+        self.sizes = [sizes[place] for place in self.places]
+        masks = [allowed.get(place, FULL_DECK) for place in self.places]
+
+        # Group the cards by the places that may hold them
+        classes = {}
+        for card in mask_indices(unknown):
+            holders = tuple(i for i, mask in enumerate(masks) if mask & (1 << card))
+            classes.setdefault(holders, []).append(card)
+        self.classes = sorted(classes.items())
+
+        # Every split of the classes among the places, with its
+        # number of deals
+        self.splits = []
+        self.weights = []
+        self.split(0, list(self.sizes), [], 1)
+        self.count = sum(self.weights)
+        if self.count:
+            self.probabilities = np.array([weight / self.count
+                                           for weight in self.weights])
+            # parts[i][s] is the split of class i in split s
+            self.parts = [np.array([split[i] for split in self.splits],
+                                   dtype = np.int64)
+                          for i in range(0, len(self.classes))]
+
+    def split(self, i, remaining, counts, weight):
+        """
+        Adds every split of classes i and up among the places
+        with the given number of free slots. 'counts' and
+        'weight' are the split of the classes before i and its
+        number of deals.
+        """
+        if i == len(self.classes):
+            if not any(remaining):
+                self.splits.append(counts)
+                self.weights.append(weight)
+            return
+        holders, cards = self.classes[i]
+        if not holders:
+            return
+        limits = [remaining[place] for place in holders]
+        for parts in _compositions(len(cards), limits):
+            for place, part in zip(holders, parts):
+                remaining[place] -= part
+            self.split(i + 1, remaining, counts + [parts],
+                       weight * multinomial(parts))
+            for place, part in zip(holders, parts):
+                remaining[place] += part
+
+    def sample_batch(self, n, rng = None):
+        """
+        Returns n random deals as an array with one row per
+        deal and one column per place (see self.places), holding
+        the mask of the cards dealt there. 'rng' is a NumPy
+        random generator.
+        """
+        if not self.count:
+            raise ValueError("No deal is consistent with the constraints")
+        rng = rng if rng is not None else np.random.default_rng()
+        deals = np.zeros((n, len(self.places)), dtype = np.uint64)
+        chosen = rng.choice(len(self.splits), size = n, p = self.probabilities)
+        for i, (holders, cards) in enumerate(self.classes):
+            # Shuffle the cards of the class, then cut the
+            # shuffled cards into the parts of each place
+            parts = self.parts[i][chosen]
+            bits = np.left_shift(np.uint64(1), np.array(cards, dtype = np.uint64))
+            order = np.argsort(rng.random((n, len(cards))), axis = 1)
+            shuffled = bits[order]
+            position = np.arange(len(cards))
+            ends = np.cumsum(parts, axis = 1)
+            starts = ends - parts
+            for j, place in enumerate(holders):
+                dealt = ((position >= starts[:, j:j + 1]) &
+                         (position < ends[:, j:j + 1]))
+                deals[:, place] |= np.bitwise_or.reduce(
+                    np.where(dealt, shuffled, np.uint64(0)), axis = 1)
+        return deals
+
+    def sample(self, rng = None):
+        """
+        Returns one random deal as a dictionary mapping every
+        place to the mask of the cards dealt there.
+        """
+        deal = self.sample_batch(1, rng)[0]
+        return dict(zip(self.places, (int(mask) for mask in deal)))
+
+def void_sampler(hand, seen, sizes, voids, game_type):
+    """
+    Returns a DealSampler for the cards a player hasn't seen.
+    'hand' is the mask of the player's hand, 'seen' the mask of
+    all other cards they know the place of (played cards, or
+    the skat if they picked it up), 'sizes' a dictionary mapping
+    the other players' IDs to their number of cards, and
+    'voids' a dictionary mapping player IDs to the groups they
+    are out of in a game of the given type, like
+    GameState.voids. The cards that are left over go to the
+    skat.
+    """
+    unknown = FULL_DECK & ~hand & ~seen
+    sizes = dict(sizes)
+    sizes[SKAT] = popcount(unknown) - sum(sizes.values())
+    allowed = {}
+    for pid in sizes:
+        if pid == SKAT:
+            continue
+        allowed[pid] = FULL_DECK
+        for group, void in enumerate(voids.get(pid, [0] * GROUPS)):
+            if void:
+                allowed[pid] &= ~GROUP_MASKS[game_type][group]
+    return DealSampler(unknown, sizes, allowed)
+
+def main(argv):
+    """
+    Times the sampler on a late-game situation: 12 unknown
+    cards, two players with 5 cards each who are out of two
+    suits each, and the skat.
+
+    Usage: python(3) sampler.py [number of deals]
+    """
+    n = int(argv[1]) if len(argv) > 1 else 10000
+    rng = np.random.default_rng(0)
+    deck = list(range(0, 32))
+    rng.shuffle(deck)
+    hand = sum(1 << card for card in deck[0:5])
+    seen = sum(1 << card for card in deck[17:32])
+    sampler = void_sampler(hand, seen, {2: 5, 3: 5},
+                           {2: [1, 0, 1, 0], 3: [0, 1, 0, 1]}, Suit.clubs)
+    print("%d consistent deals in %d splits" % (sampler.count, len(sampler.splits)))
+    start = time.time()
+    deals = sampler.sample_batch(n, rng)
+    elapsed = time.time() - start
+    print("Sampled %d deals in %.3f s (%.0f deals/s)" % (n, elapsed, n / elapsed))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,248 @@
+import sys
+import time
+import random
+import multiprocessing
+
+from card import *
+from rules import *
+from player import *
+from globals import *
+from game_log import *
+from bidding import *
+from skat_server import *
+
+# Number of games handed to a worker process at a time
+SHARD_SIZE = 50
+
+def play_game(deck, declarer_id, suit_algo = None, rank_algo = None,
+              verbose = False, rng = None, binary = False, game = None):
+    """
+    Plays a full game of Skat between three bots, using the
+    given shuffled deck. The bots bid for the game (see
+    skat_server.decide_declarer), unless 'declarer_id' is set,
+    in which case that player declares the game. The game is
+    of the type with the given code (see bitcards.GAME_CODES)
+    if 'game' is set. The bots make their random choices with
+    'rng' (see BotPlayer).
+
+    Returns the game record in the log file format (see
+    skat_server.open_log_file), or as a binary game log record
+    if 'binary' is set (see game_log.py), and the declarer's
+    result (see bidding.settle). Returns None if every bot
+    passed.
+    """
+    # Deal hands
+    hands = [sorted(deck[0:10]), sorted(deck[10:20]), sorted(deck[20:30])]
+    skat = deck[30:32]
+    players = {}
+    for i in range(0, 3):
+        players[i + 1] = BotPlayer(i + 1, hands[i], "Bot" + str(i + 1),
+                                   suit_algo = suit_algo,
+                                   rank_algo = rank_algo,
+                                   verbose = verbose,
+                                   rng = rng)
+    record = [player_line(player) for player in players.values()]
+
+    # Who's playing?
+    if declarer_id:
+        declarer, bid = players[declarer_id], 0
+    else:
+        declarer, bid = decide_declarer(players, ())
+        if not declarer:
+            return None
+        declarer_id = declarer.pid
+
+    # What are we playing?
+    if game:
+        declarer.hide_cards(skat, GAME_CODES.index(game))
+        rules = declarer.get_rules()
+    else:
+        rules = decide_game(declarer, skat)
+    record.append(rules_line(declarer, rules))
+
+    # Play 10 rounds
+    pid = 1
+    rounds = []
+    for r in range(0, 10):
+        plays, pid = play_round(players, rules, pid, log = verbose)
+        rounds.append(plays)
+
+    dealt = [sorted(deck[0:10]), sorted(deck[10:20]), sorted(deck[20:30])]
+    settlement = settle(rules, dealt[declarer_id - 1] + skat,
+                        declarer.cards_won, bid)
+    if binary:
+        return encode_game(dealt, declarer_id, rules.game_type, skat,
+                           rounds), settlement
+    record.extend(round_line(plays) for plays in rounds)
+    return "".join(record), settlement
+
+def game_rng(seed, game):
+    """
+    Returns the random number generator for the given game.
+    Every game gets its own generator derived from the master
+    seed, so the result of a run doesn't depend on how the
+    games are split between worker processes.
+    """
+    return random.Random("%d:%d" % (seed, game))
+
+def play_games(shard):
+    """
+    Plays the games with numbers in [start, stop) given by
+    'shard', which is a tuple of (start, stop, seed, suit_algo,
+    rank_algo, verbose, binary, game_code). 'game_code' is the
+    'game' argument of play_game. The bots bid for every game,
+    and the cards are dealt again until one of them plays. If
+    'game_code' is set, there is no bidding, and the declarer
+    rotates between players from game to game instead.
+
+    Returns the concatenated game records (binary if 'binary'
+    is set), the number of games won by the declarer, the
+    declarer's total score and the number of deals every bot
+    passed on.
+    """
+    start, stop, seed, suit_algo, rank_algo, verbose, binary, game_code = shard
+    records = []
+    n_won = 0
+    score = 0
+    n_passed = 0
+    for game in range(start, stop):
+        rng = game_rng(seed, game)
+        declarer_id = game % 3 + 1 if game_code else None
+        result = None
+        while not result:
+            deck = Card.shuffle_deck(Card.get_deck(), rng)
+            result = play_game(deck, declarer_id, suit_algo, rank_algo,
+                               verbose = verbose, rng = rng,
+                               binary = binary, game = game_code)
+            if not result:
+                n_passed += 1
+        record, settlement = result
+        records.append(record)
+        if settlement.won:
+            n_won += 1
+        score += settlement.score
+    if binary:
+        return b"".join(records), n_won, score, n_passed
+    return "".join(records), n_won, score, n_passed
+
+def simulate(n_games, out_file, seed, suit_algo = None, rank_algo = None,
+             processes = 1, verbose = False, game = None):
+    """
+    Plays 'n_games' all-bot games, sharded across the given
+    number of worker processes, and streams their records to
+    the given file in game order. If 'out_file' is a
+    GameLogWriter, the records are binary (see game_log.py).
+    If 'game' is set, every game is of the type with that code
+    instead of the one the declarer picks. The output is
+    reproducible given the master seed. Returns the number of
+    games won by the declarer, their total score and the
+    number of deals every bot passed on.
+    """
+    binary = isinstance(out_file, GameLogWriter)
+    shards = [(start, min(start + SHARD_SIZE, n_games), seed,
+               suit_algo, rank_algo, verbose, binary, game)
+              for start in range(0, n_games, SHARD_SIZE)]
+
+    if processes == 1:
+        return write_shards(map(play_games, shards), out_file)
+
+    # Leaving the block terminates the workers, also when a
+    # worker fails or the user interrupts the run
+    with multiprocessing.Pool(processes) as pool:
+        return write_shards(pool.imap(play_games, shards), out_file)
+
+def write_shards(results, out_file):
+    """
+    Writes the records of the shards returned by play_games to
+    the given file in order, and adds up their results. Returns
+    the number of games won by the declarer, their total score
+    and the number of deals every bot passed on.
+    """
+    n_won = 0
+    score = 0
+    n_passed = 0
+    for records, shard_won, shard_score, shard_passed in results:
+        out_file.write(records)
+        n_won += shard_won
+        score += shard_score
+        n_passed += shard_passed
+    return n_won, score, n_passed
+
+def main(argv):
+    """
+    Plays a batch of headless all-bot games. The records of
+    all games are written back to back in the log file format
+    to a single output file.
+
+    Arguments are:
+    'n [number]' - Number of games to play (default 100)
+    'o [file]' - Output file (default simulation.txt)
+    'g' - Write a binary game log (see game_log.py) instead
+          of text
+    's [seed]' - Master random seed (default: chosen at random)
+    'p [number]' - Number of worker processes (default: one
+                   per core)
+    'sa [algorithm]' - Suit prediction algorithm for bots
+    'ra [algorithm]' - Rank prediction algorithm for bots
+    'gt [game]' - Play every game as the given game type
+                  (c, s, h, d, g for Grand or n for Null)
+                  without bidding, with the declarer rotating
+                  between the bots
+    'v' - Print what the bots are doing
+    """
+    n_games = 100
+    if '-n' in argv:
+        index = argv.index('-n')
+        n_games = int(argv[index + 1])
+    out_path = "simulation.txt"
+    if '-o' in argv:
+        index = argv.index('-o')
+        out_path = argv[index + 1]
+    if '-s' in argv:
+        index = argv.index('-s')
+        seed = int(argv[index + 1])
+    else:
+        seed = random.randrange(2 ** 32)
+    processes = multiprocessing.cpu_count()
+    if '-p' in argv:
+        index = argv.index('-p')
+        processes = max(1, int(argv[index + 1]))
+    suit_algo, rank_algo = parse_algos(argv)
+    verbose = '-v' in argv
+    game = None
+    if '-gt' in argv:
+        index = argv.index('-gt')
+        game = argv[index + 1]
+        if game not in GAME_CODES:
+            print("Game type must be one of c, s, h, d, g or n")
+            return 1
+
+    start = time.time()
+    if '-g' in argv:
+        out_file = GameLogWriter(out_path)
+    else:
+        out_file = open(out_path, "w")
+    n_won, score, n_passed = simulate(n_games, out_file, seed, suit_algo,
+                                      rank_algo, processes, verbose, game)
+    out_file.close()
+    elapsed = time.time() - start
+
+    print("Seed %d, %d worker process(es)" % (seed, processes))
+    print("Played %d games in %.2f s (%.1f games/s)" %
+          (n_games, elapsed, n_games / max(elapsed, 1e-9)))
+    print("Declarer won %d of %d games (average score %.1f), %d deals passed in" %
+          (n_won, n_games, score / max(n_games, 1), n_passed))
+    return 0
+
+if __name__ == "__main__":
+    # Only start Matlab if one of the bot algorithms needs it
+    algos = parse_algos(sys.argv)
+    matlab = any(uses_matlab(algo) for algo in algos)
+    try:
+        if matlab:
+            mlab.start()
+        status = main(sys.argv)
+    finally:
+        if matlab:
+            mlab.stop()
+    sys.exit(status)
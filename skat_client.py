@@ -1,14 +1,10 @@
 import sys
-import socket
-import pickle
 import codecs
-import collections
 
 from card import *
 from rules import *
 from networking import *
-
-Play = collections.namedtuple('Play', ['pid', 'card'])
+from protocol import *
 
 def hide(cards, hand, skat, server_socket):
     """
@@ -31,7 +27,7 @@ def hide(cards, hand, skat, server_socket):
     hand.sort()
     
     # Send hidden cards to server
-    send_msg(server_socket, pickle.dumps(cards))
+    send_hand(server_socket, cards)
     
     return True
     
@@ -43,7 +39,7 @@ def choose_game(hand, server_socket):
     server.
     """
     # Receive skat
-    skat = pickle.loads(recv_msg(server_socket))
+    skat = recv_hand(server_socket)
     print("\nThe skat was [%s]" % Card.hand_to_str(skat))
         
     # Hide cards
@@ -53,12 +49,14 @@ def choose_game(hand, server_socket):
         cards = input("What do you want to hide?\n")
     print("\nYour hand is now:\n" + Card.hand_to_str(hand))
     
-    # What's trumps?
-    trumps = input("\nWhich suit should be trumps? (c, s, h, d)\n")
-    while (trumps.strip() not in ["c", "s", "h", "d"]):
-        print("Must be c, s, h, or d!")
-        trumps = input("Which suit should be trumps? (c, s, h, d)\n")
-    send_str(server_socket, trumps)
+    # What's trumps? Grand and Null are chosen instead of
+    # a trump suit.
+    prompt = "Which suit should be trumps? (c, s, h, d, or g for Grand, n for Null)\n"
+    trumps = input("\n" + prompt)
+    while (trumps.strip() not in ["c", "s", "h", "d", "g", "n"]):
+        print("Must be c, s, h, d, g or n!")
+        trumps = input(prompt)
+    send_text(server_socket, trumps.strip())
 
 def play_card(hand, plays, rules, server_socket):
     """
@@ -80,7 +78,7 @@ def play_card(hand, plays, rules, server_socket):
     hand.remove(card)
     
     # Send the played card to the server
-    send_msg(server_socket, pickle.dumps(card))
+    send_card(server_socket, card)
 
 def main(argv):
     if len(argv) != 3:
@@ -90,32 +88,41 @@ def main(argv):
     # Connect to server
     host = argv[1]
     port = int(argv[2])
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.connect((host, port))
+    server_socket = connect(host, port)
     username = input("\nUsername: ").strip();
     while not username.isalnum() or len(username) > 15:
         username = input("\nUsername must be <15 alphanumeric characters: ").strip()
-    send_str(server_socket, username)
+    send_text(server_socket, username)
     print("Connecting to server...")
     
     # Receive hand
-    hand = pickle.loads(recv_msg(server_socket))
+    hand = recv_hand(server_socket)
     print("\nReceived hand:\n" + Card.hand_to_str(hand))
     
-    # Playing?
-    playing = input("\nAre you playing? (y/n/sb/rb)\n")
-    send_str(server_socket, playing)
-    if playing == "sb" or playing == "rb":
+    # Bid until the server announces who is playing
+    announce = recv_text(server_socket)
+    while announce.startswith("Bid "):
+        bet = input("\n" + announce + "\n").strip()
+        while bet not in ["y", "n", "sb", "rb"]:
+            print("Must be y, n, sb or rb!")
+            bet = input(announce + "\n").strip()
+        send_text(server_socket, bet)
+        if bet == "sb" or bet == "rb":
+            server_socket.close()
+            return 0
+        announce = recv_text(server_socket)
+    print(announce)
+    if announce == "Nobody is playing":
+        server_socket.close()
         return 0
-    print(recv_str(server_socket))
     
     # If playing...
-    if playing == "y":
+    if announce.startswith("You are playing"):
         choose_game(hand, server_socket)
     
     # Receive game announcement and rules
-    print(recv_str(server_socket))
-    rules = pickle.loads(recv_msg(server_socket))
+    print(recv_text(server_socket))
+    rules = recv_rules(server_socket)
     
     # Play 10 rounds
     for i in range(0, 10):
@@ -123,24 +130,25 @@ def main(argv):
         # 3 people play per round
         for i in range(0, 3):
             # Receive message about who's going to play
-            announce = recv_str(server_socket)
+            announce = recv_text(server_socket)
             print("\n" + announce)
         
             # Are we up?
             if announce == "Your turn":
-                plays = pickle.loads(recv_msg(server_socket))
+                plays = recv_plays(server_socket)
                 play_card(hand, plays, rules, server_socket)
         
             # Receive message about play
-            print(recv_str(server_socket), end = "")
-            print(str(pickle.loads(recv_msg(server_socket))))
+            print(recv_text(server_socket), end = "")
+            print(str(recv_card(server_socket)))
         
         # Receive message about who won the round
-        print("\n" + recv_str(server_socket))
+        print("\n" + recv_text(server_socket))
         
-    # Receive message about game results
-    for i in range(0, 3):
-        print("\n" + recv_str(server_socket))
+    # Receive message about game results and the declarer's
+    # score
+    for i in range(0, 4):
+        print("\n" + recv_text(server_socket))
     
     # Close socket
     server_socket.close()
@@ -1,30 +1,34 @@
 import os
 import sys
-import pickle
 import socket
 import datetime
 import traceback
 
+import instrument
+
 from card import *
 from rules import *
 from player import *
 from globals import *
+from game_log import *
+from predictor import *
 from networking import *
+from protocol import *
+from bidding import *
 
-def accept_players(server_socket, hands, player_args):
-    """
-    Accepts three players for this game of Skat. Deals out
-    their hands. Returns a dictionary that maps player IDs
-    to Player objects.
+# Seconds a client gets to take in the messages of an event
+# before they are replaced by a bot
+SEND_TIMEOUT = 10.0
+
+def parse_algos(player_args):
     """
-    # Count bots
-    if '-b' in player_args:
-        index = player_args.index('-b');
-        num_bots = max(2, int(player_args[index + 1]))
-    else:
-        num_bots = 0
+    Returns the suit and rank prediction algorithms given
+    with the '-sa' and '-ra' flags, or None for each flag
+    that is missing.
 
-    # See if bot algorithm has been provided
+    An algorithm is either the path of a Matlab script or
+    a NumPy spec like "numpy:softmax" (see predictor.py).
+    """
     suit_algo = None
     rank_algo = None
     if '-sa' in player_args:
@@ -33,13 +37,58 @@ def accept_players(server_socket, hands, player_args):
     if '-ra' in player_args:
         index = player_args.index('-ra');
         rank_algo = player_args[index + 1]
+    return suit_algo, rank_algo
+
+def parse_pimc(player_args):
+    """
+    Returns the time budget per move in seconds given with the
+    '-pimc' flag, or None if bots shouldn't search (see
+    PIMCPlayer).
+    """
+    if '-pimc' in player_args:
+        index = player_args.index('-pimc')
+        return float(player_args[index + 1])
+    return None
+
+def smart_bot(pid, hand, name, player_args, verbose = True):
+    """
+    Creates a bot that plays with the prediction algorithms
+    given in the arguments, or searches within the time budget
+    given with '-pimc'.
+    """
+    suit_algo, rank_algo = parse_algos(player_args)
+    budget = parse_pimc(player_args)
+    if budget is not None:
+        return PIMCPlayer(pid, hand, name, suit_algo = suit_algo,
+                          rank_algo = rank_algo, verbose = verbose,
+                          budget = budget)
+    return BotPlayer(pid, hand, name, suit_algo = suit_algo,
+                     rank_algo = rank_algo, verbose = verbose)
+
+def count_bots(player_args):
+    """
+    Returns the number of bots given with the '-b' flag.
+    """
+    if '-b' in player_args:
+        index = player_args.index('-b');
+        return max(2, int(player_args[index + 1]))
+    return 0
+
+def accept_players(server_socket, hands, player_args):
+    """
+    Accepts three players for this game of Skat. Deals out
+    their hands. Returns a dictionary that maps player IDs
+    to Player objects.
+    """
+    # Count bots
+    num_bots = count_bots(player_args)
 
     # Accept human players connecting from the Skat client
     # program
     players = {}
     for i in range(0, 3 - num_bots):
         # Create player
-        conn, addr = server_socket.accept()
+        conn = accept(server_socket)
         player = HumanPlayer(i + 1, hands[i], conn)
         players[i + 1] = player
         
@@ -48,17 +97,17 @@ def accept_players(server_socket, hands, player_args):
     
     # Add bot players
     for i in range(3 - num_bots, 3):
-        players[i + 1] = BotPlayer(i + 1, hands[i], "Bot", 
-                                   suit_algo = suit_algo,
-                                   rank_algo = rank_algo)
+        players[i + 1] = smart_bot(i + 1, hands[i], "Bot", player_args)
     return players
     
 def decide_declarer(players, player_args):
     """
-    Determine who will declare the game. Right now this has
-    to be decided verbally and each player will have to send
-    their response through the client program. The declarer
-    is simply whoever responds "y" (yes).
+    Determine who will declare the game by holding the auction
+    (see bidding.Auction). Every player is asked in turn
+    whether they would play for a bid, and answers "y" (yes)
+    or "n" (no) through the client program, or with the bot
+    bidder if they are a bot. Returns the declarer and the
+    winning bid, or None and 0 if everyone passed.
 
     If a human player responds with "sb" through the client,
     they will be replaced by a smart bot which uses the card
@@ -67,31 +116,80 @@ def decide_declarer(players, player_args):
     If a human player responds with "rb" through the client,
     they will be replaced by a random bot which picks a
     random legal card to play.
+
+    Either bot answers the question instead, and bids for the
+    player from then on.
     """
-    # See if bot algorithm has been provided
-    suit_algo = None
-    rank_algo = None
-    if '-sa' in player_args:
-        index = player_args.index('-sa');
-        suit_algo = player_args[index + 1]
-    if '-ra' in player_args:
-        index = player_args.index('-ra');
-        rank_algo = player_args[index + 1]
-    
-    declarer = None
-    for player in players.values():
-        response = player.get_bet()
-        if response == "y":
-            declarer = player
-        elif response == "sb": # Smart bot
-            players[player.pid] = BotPlayer(player.pid, player.hand,
-                                            "SmartBot" + str(player.pid), 
-                                            suit_algo = suit_algo,
-                                            rank_algo = rank_algo)
+    auction = Auction()
+    question = auction.question()
+    while question:
+        pid, bid = question
+        player = players[pid]
+        response = player.get_bet(bid)
+        if response == "sb": # Smart bot
+            players[pid] = smart_bot(pid, player.hand, "SmartBot" + str(pid),
+                                     player_args)
+            response = players[pid].get_bet(bid)
         elif response == "rb": # Random bot
-            players[player.pid] = BotPlayer(player.pid, player.hand,
-                                            "DumbBot" + str(player.pid))
-    return declarer
+            players[pid] = BotPlayer(pid, player.hand, "DumbBot" + str(pid))
+            response = players[pid].get_bet(bid)
+        auction.answer(response == "y")
+        question = auction.question()
+    if auction.declarer_id is None:
+        return None, 0
+    return players[auction.declarer_id], auction.bid
+
+def declarer_text(player, declarer, bid):
+    """
+    Returns the announcement of the declarer and their bid for
+    the given player, who is told if they are the declarer
+    themselves.
+    """
+    if player == declarer:
+        return "You are playing for " + str(bid) + "!"
+    return declarer.name + " is playing for " + str(bid) + "!"
+
+def send_timeout(player_args):
+    """
+    Returns the send timeout given with the '-t' flag.
+    """
+    if '-t' in player_args:
+        index = player_args.index('-t')
+        return float(player_args[index + 1])
+    return SEND_TIMEOUT
+
+def human_conns(players):
+    """
+    Returns the connections of the human players.
+    """
+    return [player.conn for player in players.values()
+            if isinstance(player, HumanPlayer)]
+
+def replace_with_bot(players, pid, rules, history, player_args):
+    """
+    Replaces a human player who dropped out with a bot that
+    takes over their hand, name and cards won. The bot is
+    shown the rounds played so far.
+    """
+    human = players[pid]
+    bot = smart_bot(pid, human.hand, human.name, player_args)
+    bot.cards_won = human.cards_won
+    for plays in history:
+        bot.see_round(plays, rules)
+    players[pid] = bot
+    human.conn.abort()
+    print(human.name + " dropped out and was replaced by a bot")
+
+def flush_players(players, rules, history, player_args):
+    """
+    Sends the queued messages of an event to every human
+    player at once. Players who can't keep up within the
+    send timeout are replaced by bots.
+    """
+    slow = flush_all(human_conns(players), send_timeout(player_args))
+    for player in list(players.values()):
+        if isinstance(player, HumanPlayer) and player.conn in slow:
+            replace_with_bot(players, player.pid, rules, history, player_args)
 
 def decide_game(declarer, skat):
     """
@@ -103,10 +201,11 @@ def decide_game(declarer, skat):
     declarer.hide_cards(skat)
     return declarer.get_rules()
 
-def open_log_file(file_args):
+def open_log_file(file_args, suffix = ""):
     """
     Opens a log file according to the given file arguments.
-    Returns the opened file.
+    Returns the opened file. The suffix is appended to
+    date-based file names.
 
     Arguments are:
     'd' - Use "debug.txt" in the project root directory
@@ -138,15 +237,119 @@ def open_log_file(file_args):
         if not os.path.exists(log_folder):
             os.makedirs(log_folder)
         time = datetime.datetime.now().strftime("%y-%m-%d-%H-%M")
-        file = open(log_folder + "/" + time + ".txt", "a")
+        file = open(log_folder + "/" + time + suffix + ".txt", "a")
 
     # Write a new file in the default log directory
     else:
         time = datetime.datetime.now().strftime("%y-%m-%d-%H-%M")
-        file = open("log/" + time + ".txt", "a")
+        file = open("log/" + time + suffix + ".txt", "a")
 
     return file
 
+def player_line(player):
+    """
+    Returns the log file line listing a player and their hand.
+    See open_log_file for the log file format.
+    """
+    return "(%d, %s, %s)\n" % (player.pid, player.name,
+                               Card.hand_to_repr(player.hand))
+
+def rules_line(declarer, rules):
+    """
+    Returns the log file line listing the declarer, the rules
+    and the declarer's hand post-skat.
+    """
+    return "(%d, %s, %s)\n" % (declarer.pid, str(rules),
+                               Card.hand_to_repr(declarer.hand))
+
+def result_line(player, rules):
+    """
+    Returns the announcement of what a player won in the game:
+    their points, or in a Null, where points don't count, their
+    tricks.
+    """
+    if rules.game_type == NULL:
+        tricks = len(player.cards_won) // 3
+        return player.name + " won " + str(tricks) + " tricks"
+    points = rules.count_points(player.cards_won)
+    return player.name + " won " + str(points) + " points"
+
+def settlement_line(declarer, rules, settlement):
+    """
+    Returns the announcement of the declarer's result: whether
+    they won, the value of the game and their score (see
+    bidding.settle).
+    """
+    outcome = " won " if settlement.won else " lost "
+    return (declarer.name + outcome + str(rules) + " worth " +
+            str(settlement.value) + " (score " + str(settlement.score) + ")")
+
+def round_line(plays):
+    """
+    Returns the log file line listing the plays of a round.
+    """
+    return "[" + ", ".join("(%d, %s)" % (play.pid, repr(play.card))
+                           for play in plays) + "]\n"
+
+def play_round(players, rules, pid, log = True, history = (), player_args = ()):
+    """
+    Plays one round of Skat, starting with the player with
+    the given ID. Human players are kept up to date over the
+    network, and replaced by bots if they drop out ('history'
+    holds the rounds played so far, for the bots to catch up
+    on). Returns the plays made in the round and the ID of the
+    winner, who starts the next round.
+    """
+    # List of plays so far. It should be in the format
+    # [(pid, card), (pid, card), (pid, card)]
+    plays = []
+    for i in range(0, 3):
+        
+        # Tell everyone else who we're waiting for, along with
+        # the previous play, in one write per client
+        for player in players.values():
+            if player != players[pid] and isinstance(player, HumanPlayer):
+                announce = "Waiting for " + players[pid].name + " to play..."
+                send_text(player.conn, announce)
+        flush_players(players, rules, history, player_args)
+
+        # Make play
+        try:
+            card = players[pid].get_play(plays, rules)
+        except IOError:
+            replace_with_bot(players, pid, rules, history, player_args)
+            card = players[pid].get_play(plays, rules)
+                
+        # Receive play
+        plays.append(Play(pid = pid, card = card))
+        
+        # Broadcast state of round
+        conns = human_conns(players)
+        broadcast_text(conns, players[pid].name + " played ", log = log)
+        broadcast_msg(conns, encode_card(card))
+        if log:
+            print(str(card) + "\n")
+        
+        # Choose next player
+        pid = (pid + 1) if (pid + 1) < 4 else 1
+
+    # Who won the round?
+    winning_play = rules.winning_play(plays)
+    winner = players[winning_play.pid]
+    announce = winner.name + " won the round!\n"
+    broadcast_text(human_conns(players), announce, log = log)
+    flush_players(players, rules, history, player_args)
+    
+    # Next person to start is the winner of this round
+    winner.cards_won.extend([play.card for play in plays])
+    
+    # Update cards seen
+    for player in players.values():
+        if isinstance(player, BotPlayer):
+            player.see_round(plays, rules)
+
+    return plays, winner.pid
+
 def main(argv):
     """
     Main function...
@@ -154,6 +357,16 @@ def main(argv):
     Arguments are:
     Folder arguments - see open_log_file
     'b [number]' - Play with a given number of bots
+    'sa [algorithm]' - Suit prediction algorithm for bots
+    'ra [algorithm]' - Rank prediction algorithm for bots
+    'pimc [seconds]' - Bots search for their plays (see
+                       PIMCPlayer), taking at most the given
+                       time per move
+    'g [file]' - Also append the game to a binary game log
+                 (see game_log.py)
+    't [seconds]' - Time a client gets to take in the messages
+                    of an event before being replaced by a bot
+                    (default 10)
     """
 
     # Open log file
@@ -163,6 +376,10 @@ def main(argv):
     deck = Card.shuffle_deck(Card.get_deck())
     hands = [sorted(deck[0:10]), sorted(deck[10:20]), sorted(deck[20:30])]
     skat = deck[30:32]
+
+    # Players change their hands as they play, so keep a copy
+    # of the hands as dealt for the binary game log
+    dealt = [list(hand) for hand in hands]
     
     # Wait for incoming connections from three players
     print("Waiting for players to connect...")
@@ -172,99 +389,86 @@ def main(argv):
     players = accept_players(server_socket, hands, argv)
     
     # Who's playing?
-    declarer = decide_declarer(players, argv)
+    declarer, bid = decide_declarer(players, argv)
     if not declarer:
+        broadcast_text(human_conns(players), "Nobody is playing", log = True)
+        for conn in human_conns(players):
+            conn.close()
         file.close()
         server_socket.close()
-        mlab.stop()
         return 1
     for player in players.values():
-        file.write("(%d, %s, %s)\n" % 
-                    (player.pid, player.name, Card.hand_to_repr(player.hand)))
-    conns = [player.conn for player in players.values() if isinstance(player, HumanPlayer)]
-    broadcast_str(conns, declarer.name + " is playing!", log = True)
+        file.write(player_line(player))
+        if isinstance(player, HumanPlayer):
+            send_text(player.conn, declarer_text(player, declarer, bid))
+    print(declarer.name + " is playing for " + str(bid) + "!")
+    flush_players(players, None, [], argv)
+    declarer = players[declarer.pid]
     
     # What are we playing?
     rules = decide_game(declarer, skat)
     announce = "\n" + declarer.name + " is playing " + str(rules) + "\n"
-    broadcast_str(conns, announce, log = True)
-    broadcast_msg(conns, pickle.dumps(rules))
+    conns = human_conns(players)
+    broadcast_text(conns, announce, log = True)
+    broadcast_msg(conns, encode_rules(rules))
 
     # Log the game parameters
-    file.write("(%d, %s, %s)\n" % 
-                (declarer.pid, str(rules), Card.hand_to_repr(declarer.hand)))
+    file.write(rules_line(declarer, rules))
         
     # Play 10 rounds
     pid = 1
+    rounds = []
     for r in range(0, 10):
-        
-        # List of plays so far. It should be in the format
-        # [(pid, card), (pid, card), (pid, card)]
-        plays = []
-        for i in range(0, 3):
-            
-            # Make play
-            for player in players.values():
-                if player == players[pid]:
-                    card = player.get_play(plays, rules)
-                elif isinstance(player, HumanPlayer):
-                    announce = "Waiting for " + players[pid].name + " to play..."
-                    send_str(player.conn, announce)
-                    
-            # Receive play
-            plays.append(Play(pid = pid, card = card))
-            
-            # Broadcast state of round
-            broadcast_str(conns, players[pid].name + " played ", log = True)
-            broadcast_msg(conns, pickle.dumps(card))
-            print(str(card) + "\n")
-            
-            # Choose next player
-            pid = (pid + 1) if (pid + 1) < 4 else 1
-
-        # Who won the round?
-        winning_play = rules.winning_play(plays)
-        winner = players[winning_play.pid]
-        announce = winner.name + " won the round!\n"
-        broadcast_str(conns, announce, log = True)
-        
-        # Next person to start is the winner of this round
-        winner.cards_won.extend([play.card for play in plays])
-        pid = winner.pid
-        
-        # Update cards seen
-        for player in players.values():
-	        if isinstance(player, BotPlayer):
-		        player.cards_seen.extend([play.card for play in plays])
+        plays, pid = play_round(players, rules, pid, history = rounds,
+                                player_args = argv)
+        rounds.append(plays)
         
         # Log round
-        file.write("[")
-        for i in range(0, len(plays)):
-            play = plays[i]
-            file.write("(%d, %s)" % (play.pid, repr(play.card)))
-            if i != len(plays) - 1:
-                file.write(", ")
-        file.write("]\n")
-        file.flush()
-
-    # Print points won
+        with instrument.span("log.write"):
+            file.write(round_line(plays))
+            file.flush()
+
+    # Append the game to the binary game log
+    if '-g' in argv:
+        index = argv.index('-g')
+        with instrument.span("log.write"):
+            writer = GameLogWriter(argv[index + 1])
+            writer.write_game(dealt, declarer.pid, rules.game_type, skat, rounds)
+            writer.close()
+
+    # Print what everyone won, and the declarer's score
+    conns = human_conns(players)
     for player in players.values():
-        points = rules.count_points(player.cards_won)
-        announce = player.name + " won " + str(points) + " points"
-        broadcast_str(conns, announce, log = True)
+        broadcast_text(conns, result_line(player, rules), log = True)
+    settlement = settle(rules, dealt[declarer.pid - 1] + skat,
+                        declarer.cards_won, bid)
+    broadcast_text(conns, settlement_line(declarer, rules, settlement), log = True)
+    flush_players(players, rules, rounds, argv)
 
     # Finish
+    for conn in human_conns(players):
+        conn.close()
     file.close()
     server_socket.close()
-    mlab.stop()
 
     return 0
 
 if __name__ == "__main__":
+    # Print timings on exit or SIGUSR1
+    instrument.install()
+
+    # Only start Matlab if one of the bot algorithms needs it
+    algos = parse_algos(sys.argv)
+    matlab = any(uses_matlab(algo) for algo in algos)
     try:
-        mlab.start()
-        sys.exit(main(sys.argv))
+        if matlab:
+            mlab.start()
+        status = main(sys.argv)
     except Exception:
-        # Always stop the Matlab server, especially if we crash
         traceback.print_exc(file = sys.stdout)
-        mlab.stop()
+        status = 1
+    finally:
+        # Always stop the Matlab server, especially if we crash
+        if matlab:
+            mlab.stop()
+    sys.exit(status)
@@ -0,0 +1,623 @@
+import os
+import sys
+import time
+
+from card import *
+from rules import *
+from bitcards import *
+
+# Double-dummy solver for the card play of a game: given all
+# hands, it finds the number of card points the declarer wins
+# when both sides play perfectly.
+#
+# Players are numbered by player ID (1-3) everywhere in the
+# interface, and hands are masks (see bitcards.py). Internally,
+# seats 0-2 stand for players 1-3.
+#
+# In a Null, card points don't matter: the declarer wins by not
+# taking a single trick. There, every card scores 1 for the
+# declarer if the defenders take it, so the "points" of the
+# declarer are the number of cards in tricks they didn't take,
+# and they win if they get all of them.
+
+# SCORES[game_type][card] is what a card scores for the declarer
+SCORES = tuple(POINTS if game_type != NULL else (1,) * 32
+               for game_type in range(0, GAME_TYPES))
+
+def count_scores(game_type, mask):
+    """
+    Returns the sum of the scores of the cards in the given
+    mask.
+    """
+    if game_type == NULL:
+        return popcount(mask)
+    return count_points(mask)
+
+def _group_order(card, game_type):
+    """
+    Returns the cards of the group of the given card (the
+    trumps, or the plain cards of its suit) from weakest to
+    strongest.
+    """
+    keys = TRICK_KEYS[game_type]
+    return tuple(sorted(mask_indices(FOLLOW_MASKS[game_type][card]),
+                        key = lambda other: keys[other][other]))
+
+def _lower_equals(card, game_type):
+    """
+    Returns the cards of the same group that rank directly
+    below the given card, closest first, as long as they
+    score the same.
+    """
+    scores = SCORES[game_type]
+    order = _group_order(card, game_type)
+    lower = []
+    for other in reversed(order[:order.index(card)]):
+        if scores[other] != scores[card]:
+            break
+        lower.append(other)
+    return tuple(lower)
+
+# LOWER_EQUALS[game_type][card] is _lower_equals(card,
+# game_type). If a player holds one of these cards, and no other
+# player holds a card in between, playing either card makes no
+# difference.
+LOWER_EQUALS = tuple(tuple(_lower_equals(card, game_type)
+                           for card in range(0, 32))
+                     for game_type in range(0, GAME_TYPES))
+
+def _group_orders(game_type):
+    """
+    Returns the groups of cards that follow each other (the
+    trumps first, then the plain cards of every suit) as masks
+    of the cards in them, and the cards in every group from
+    strongest to weakest.
+    """
+    trumps = TRUMP_MASKS[game_type]
+    groups = []
+    for group in [trumps] + [PLAIN_MASKS[game_type][suit] & ~trumps
+                              for suit in range(0, 4)]:
+        if group:
+            first = mask_indices(group)[0]
+            groups.append((group, tuple(reversed(_group_order(first, game_type)))))
+    return tuple(groups)
+
+# GROUP_ORDERS[game_type] is _group_orders(game_type)
+GROUP_ORDERS = tuple(_group_orders(game_type) for game_type in range(0, GAME_TYPES))
+
+# The transposition table is emptied when it grows beyond this
+# many positions
+TABLE_SIZE = 1000000
+
+# The sevens, eights and nines of every suit, and the jacks. They
+# are worth the same points as the others in their group. In a
+# Null, the jacks are ordinary cards of their suits, so only the
+# sevens, eights and nines are renumbered.
+LOW_CARDS = JACKS | sum(0b111 << (8 * suit) for suit in range(0, 4))
+NULL_LOW_CARDS = LOW_CARDS & ~JACKS
+
+def _pack(present, bits):
+    """
+    Moves the bits of 'bits' (a subset of 'present') down to
+    the lowest positions, keeping their order among the bits
+    of 'present'.
+    """
+    packed = 0
+    position = 0
+    for i in range(0, 4):
+        if present & (1 << i):
+            if bits & (1 << i):
+                packed |= 1 << position
+            position += 1
+    return packed
+
+# PACK[present][bits] is _pack(present, bits) for 4-bit values
+PACK = tuple(tuple(_pack(present, bits) for bits in range(0, 16))
+             for present in range(0, 16))
+
+# Jack masks from 4-bit values with one bit per suit
+SPREAD_JACKS = tuple(sum(1 << (8 * suit + Rank.jack) for suit in range(0, 4)
+                         if bits & (1 << suit))
+                     for bits in range(0, 16))
+
+def gather_jacks(mask):
+    """
+    Returns the jacks in the given mask as a 4-bit value with
+    one bit per suit.
+    """
+    return (((mask >> 7) & 0x01010101) * 0x204081 >> 21) & 15
+
+def _renumber(present, bits0, bits1, spread):
+    """
+    Renumbers the cards of one kind held by three players (see
+    _pack), given the cards still in play and those of the
+    first two players (the third holds the rest). Returns the
+    renumbered cards, spread out to their places in a mask by
+    'spread', with the first player's in bits 0-31, the
+    second's in bits 32-63 and the third's in bits 64-95.
+    """
+    if (bits0 | bits1) & ~present or bits0 & bits1:
+        return 0
+    bits2 = present & ~bits0 & ~bits1
+    pack = PACK[present]
+    return (spread[pack[bits0]] | spread[pack[bits1]] << 32 |
+            spread[pack[bits2]] << 64)
+
+# LOW_KEYS[present | bits0 << 3 | bits1 << 6] and
+# JACK_KEYS[present | bits0 << 4 | bits1 << 8] are what the
+# sevens, eights and nines of a suit, and the jacks, add to a
+# transposition table key (see Solver.key)
+LOW_KEYS = tuple(_renumber(i & 7, (i >> 3) & 7, i >> 6, range(0, 8))
+                 for i in range(0, 1 << 9))
+JACK_KEYS = tuple(_renumber(i & 15, (i >> 4) & 15, i >> 8, SPREAD_JACKS)
+                  for i in range(0, 1 << 12))
+
+class SearchTimeout(Exception):
+    """
+    Raised when a search runs past the solver's deadline.
+    """
+    pass
+
+class Solver:
+    """
+    Alpha-beta search over the remaining tricks of a game of a
+    given type (see bitcards.py) with a given declarer.
+
+    The search answers yes/no questions of the form "can the
+    declarer win at least t more points?", which prune much
+    better than searching for the exact value directly, and
+    closes in on the exact value with a few of them (MTD(f)).
+    Positions at the start of a trick are kept in a
+    transposition table, keyed by the hands and the player to
+    lead, with the bounds on their value proven so far,
+    starting from the points each side is sure to win (see
+    sure_points). The table is kept between calls, which
+    makes solving closely related positions (like the
+    alternatives for one play) much cheaper.
+    """
+
+    def __init__(self, game_type, declarer_id, deadline = None):
+        """
+        Creates a solver for a game of the given type (or trump
+        suit) and declarer. If a 'deadline' (as returned by
+        time.monotonic()) is given, searches that are still running
+        at that time raise SearchTimeout.
+        """
+        self.deadline = deadline
+        self.game_type = game_type
+        self.null = game_type == NULL
+        self.declarer = declarer_id - 1
+        self.keys = TRICK_KEYS[game_type]
+        self.follow = FOLLOW_MASKS[game_type]
+        self.lower_equals = LOWER_EQUALS[game_type]
+        self.points = SCORES[game_type]
+        # Order of the cards to lead: by rank, then by points
+        self.strength = tuple(self.keys[card][card] * 16 + self.points[card]
+                              for card in range(0, 32))
+        self.low_cards = NULL_LOW_CARDS if self.null else LOW_CARDS
+        self.groups = GROUP_ORDERS[game_type]
+        self.table = {}
+        self.nodes = 0
+
+    def clear(self):
+        """
+        Empties the transposition table.
+        """
+        self.table.clear()
+
+    def solve(self, hands, leader_id, trick = (), guess = None):
+        """
+        Returns the card points that the declarer and the
+        defenders win from here on with perfect play, as a
+        tuple (declarer points, defender points). In a Null,
+        these are the scores described at the top of this file. 'hands' are
+        the masks of the cards still held by players 1-3,
+        'leader_id' is the player who started the current
+        trick, and 'trick' the indices of the cards played in
+        it so far. Points won in earlier tricks and the skat
+        are not counted. A 'guess' of the declarer's points,
+        like the value of a similar position, speeds up the
+        search if it's close.
+        """
+        hands = list(hands)
+        trick = tuple(trick)
+        total = count_scores(self.game_type, hands[0] | hands[1] | hands[2])
+        total += sum(self.points[card] for card in trick)
+
+        # MTD(f): narrow down the value with tests around the
+        # guess, taking bigger steps away from it while the
+        # tests keep failing on the same side, and halving the
+        # interval once the value is bracketed
+        lower = 0
+        upper = total
+        if not trick:
+            lower, upper = self.table.get(self.key(hands, leader_id - 1),
+                                          (lower, upper))
+        target = guess
+        step = 1
+        raised = lowered = guess is None
+        if guess is None:
+            target = (lower + upper + 1) // 2
+        while lower < upper:
+            target = max(lower + 1, min(target, upper))
+            value = self.search(hands, leader_id - 1, trick, target)
+            if value >= target:
+                lower = value
+                raised = True
+                target = lower + step
+            else:
+                upper = value
+                lowered = True
+                target = upper - step + 1
+            step *= 2
+            if raised and lowered:
+                target = (lower + upper + 1) // 2
+        return lower, total - lower
+
+    def card_values(self, hands, leader_id, trick = ()):
+        """
+        Returns a dictionary mapping each card that the player
+        to move may play to the card points the declarer wins
+        from here on (as in solve) if that card is played.
+        """
+        hands = list(hands)
+        seat = (leader_id - 1 + len(trick)) % 3
+        lead = trick[0] if trick else None
+        values = {}
+        guess = None
+        for card in mask_indices(valid_mask(hands[seat], lead, self.game_type)):
+            hands[seat] ^= 1 << card
+            guess = self.solve(hands, leader_id, tuple(trick) + (card,), guess)[0]
+            values[card] = guess
+            hands[seat] ^= 1 << card
+        return values
+
+    def best_cards(self, hands, leader_id, trick = ()):
+        """
+        Returns the list of cards that are optimal for the
+        player to move, with the declarer's points (as in
+        solve) after playing them.
+        """
+        values = self.card_values(hands, leader_id, trick)
+        seat = (leader_id - 1 + len(trick)) % 3
+        if seat == self.declarer:
+            best = max(values.values())
+        else:
+            best = min(values.values())
+        return [card for card in sorted(values) if values[card] == best], best
+
+    def moves(self, hands, seat, leader, trick):
+        """
+        Returns the cards worth trying for the player in the
+        given seat, best guesses first. Of several cards that
+        are worth the same (see LOWER_EQUALS), only the lowest
+        is kept.
+        """
+        hand = hands[seat]
+        # Cards in the current trick still separate the cards
+        # around them
+        others = hands[(seat + 1) % 3] | hands[(seat + 2) % 3]
+        for card in trick:
+            others |= 1 << card
+        if trick:
+            candidates = hand & self.follow[trick[0]]
+            if not candidates:
+                candidates = hand
+        else:
+            candidates = hand
+
+        cards = []
+        while candidates:
+            low = candidates & -candidates
+            card = low.bit_length() - 1
+            candidates ^= low
+            for other in self.lower_equals[card]:
+                if hand & (1 << other):
+                    break
+                if others & (1 << other):
+                    cards.append(card)
+                    break
+            else:
+                cards.append(card)
+        if len(cards) < 2:
+            return cards
+
+        # The declarer leads strong cards and the defenders weak
+        # ones. When following, give points to a partner who is
+        # winning the trick, and otherwise try to take the trick
+        # (with as many points as possible) before throwing off
+        # cheap cards. In a Null, everybody tries low cards
+        # first.
+        points = self.points
+        if not trick:
+            cards.sort(key = self.strength.__getitem__,
+                       reverse = seat == self.declarer and not self.null)
+            return cards
+        keys = self.keys[trick[0]]
+        if self.null:
+            cards.sort(key = keys.__getitem__)
+            return cards
+        best = 0
+        for i in range(1, len(trick)):
+            if keys[trick[i]] > keys[trick[best]]:
+                best = i
+        winner = (leader + best) % 3
+        if (winner == self.declarer) == (seat == self.declarer):
+            cards.sort(key = points.__getitem__, reverse = True)
+            return cards
+        top = keys[trick[best]]
+        cards.sort(key = points.__getitem__)
+        winners = [card for card in reversed(cards) if keys[card] > top]
+        if not winners:
+            return cards
+        return winners + [card for card in cards if keys[card] <= top]
+
+    def search(self, hands, leader, trick, target):
+        """
+        Tests whether the declarer can win at least 'target'
+        points from here on, given the hands by seat, the seat
+        that led the current trick and the cards played in it.
+        Returns a bound on the points: a value of at least
+        'target' is a lower bound, and a smaller one an upper
+        bound.
+        """
+        if len(trick) == 3:
+            return self.finish_trick(hands, leader, trick, target)
+        if not trick:
+            return self.search_trick(hands, leader, target)
+        return self.play(hands, leader, trick, target)
+
+    def play(self, hands, leader, trick, target):
+        """
+        Same as search, for a trick with fewer than three
+        cards. Tries every card for the player to move.
+        """
+        self.nodes += 1
+        if (self.deadline and not self.nodes % 1024 and
+                time.monotonic() > self.deadline):
+            raise SearchTimeout()
+        seat = (leader + len(trick)) % 3
+        hand = hands[seat]
+        if seat == self.declarer:
+            best = -1
+            for card in self.moves(hands, seat, leader, trick):
+                hands[seat] = hand ^ (1 << card)
+                if len(trick) == 2:
+                    value = self.finish_trick(hands, leader, trick + (card,), target)
+                else:
+                    value = self.play(hands, leader, trick + (card,), target)
+                if value > best:
+                    best = value
+                    if best >= target:
+                        # The declarer found a way to get the points
+                        break
+        else:
+            best = 121
+            for card in self.moves(hands, seat, leader, trick):
+                hands[seat] = hand ^ (1 << card)
+                if len(trick) == 2:
+                    value = self.finish_trick(hands, leader, trick + (card,), target)
+                else:
+                    value = self.play(hands, leader, trick + (card,), target)
+                if value < best:
+                    best = value
+                    if best < target:
+                        # The defenders found a way to stop them
+                        break
+        hands[seat] = hand
+        return best
+
+    def finish_trick(self, hands, leader, trick, target):
+        """
+        Same as search, for a complete trick.
+        """
+        keys = self.keys[trick[0]]
+        best = 0
+        if keys[trick[1]] > keys[trick[0]]:
+            best = 1
+        if keys[trick[2]] > keys[trick[best]]:
+            best = 2
+        winner = (leader + best) % 3
+        if (winner == self.declarer) != self.null:
+            points = (self.points[trick[0]] + self.points[trick[1]] +
+                      self.points[trick[2]])
+            return points + self.search_trick(hands, winner, target - points)
+        return self.search_trick(hands, winner, target)
+
+    def search_trick(self, hands, leader, target):
+        """
+        Same as search, at the start of a trick. Uses and
+        updates the bounds in the transposition table.
+        """
+        hand = hands[leader]
+        if not hand & (hand - 1):
+            # Last trick
+            if not hand:
+                return 0
+            cards = [hand.bit_length() - 1,
+                     hands[(leader + 1) % 3].bit_length() - 1,
+                     hands[(leader + 2) % 3].bit_length() - 1]
+            winner = (leader + trick_winner(cards, self.game_type)) % 3
+            if (winner == self.declarer) != self.null:
+                return (self.points[cards[0]] + self.points[cards[1]] +
+                        self.points[cards[2]])
+            return 0
+
+        key = self.key(hands, leader)
+        entry = self.table.get(key)
+        if entry is None:
+            lower = 0
+            upper = count_scores(self.game_type, hands[0] | hands[1] | hands[2])
+            if not self.null:
+                lower, defenders = self.sure_points(hands, leader)
+                upper -= defenders
+        else:
+            lower, upper = entry
+        if lower >= target:
+            return lower
+        if upper < target:
+            return upper
+
+        value = self.play(hands, leader, (), target)
+        if value >= target:
+            lower = value
+        else:
+            upper = value
+        if len(self.table) >= TABLE_SIZE:
+            self.table.clear()
+        self.table[key] = (lower, upper)
+        return value
+
+    def sure_points(self, hands, leader):
+        """
+        Returns the points that the declarer and the defenders
+        are sure to win from here on, as a tuple (declarer
+        points, defender points). The side holding the top
+        trumps wins those whenever they are played. And once
+        the others have no trumps left, the player to lead can
+        cash the top cards of the plain suits, keeping the lead.
+        """
+        live = hands[0] | hands[1] | hands[2]
+        hand = hands[leader]
+        points = self.points
+        sure = [0, 0]
+        trumps, order = self.groups[0]
+        if live & trumps:
+            # Side 0 is the declarer, side 1 the defenders
+            declarer = hands[self.declarer]
+            for card in order:
+                if live & (1 << card):
+                    side = 0 if declarer & (1 << card) else 1
+                    break
+            side_cards = declarer if side == 0 else live & ~declarer
+            for card in order:
+                bit = 1 << card
+                if side_cards & bit:
+                    sure[side] += points[card]
+                elif live & bit:
+                    break
+        if live & ~hand & trumps:
+            return sure
+        side = 0 if leader == self.declarer else 1
+        for group, order in self.groups[1:]:
+            if not hand & group:
+                continue
+            for card in order:
+                bit = 1 << card
+                if hand & bit:
+                    sure[side] += points[card]
+                elif live & bit:
+                    break
+        return sure
+
+    def key(self, hands, leader):
+        """
+        Returns the transposition table key of a position at
+        the start of a trick. Which of the remaining sevens,
+        eights and nines of a suit (or jacks) a player holds
+        doesn't matter, only their order, so they are renumbered
+        from the lowest (see _pack). This way, many positions
+        that only differ in cards that were already played share
+        an entry. The key packs the renumbered hands and the
+        leader into one number, which is quicker to hash than a
+        tuple.
+        """
+        h0, h1, h2 = hands
+        remaining = h0 | h1 | h2
+        high = ~self.low_cards
+        key = ((h0 & high) | (h1 & high) << 32 | (h2 & high) << 64 |
+               leader << 96 |
+               LOW_KEYS[(remaining & 7) | (h0 & 7) << 3 | (h1 & 7) << 6] |
+               LOW_KEYS[(remaining >> 8 & 7) | (h0 >> 8 & 7) << 3 |
+                        (h1 >> 8 & 7) << 6] << 8 |
+               LOW_KEYS[(remaining >> 16 & 7) | (h0 >> 16 & 7) << 3 |
+                        (h1 >> 16 & 7) << 6] << 16 |
+               LOW_KEYS[(remaining >> 24 & 7) | (h0 >> 24 & 7) << 3 |
+                        (h1 >> 24 & 7) << 6] << 24)
+        if self.null:
+            return key
+        return key | JACK_KEYS[gather_jacks(remaining) | gather_jacks(h0) << 4 |
+                               gather_jacks(h1) << 8]
+
+def deal_masks(players):
+    """
+    Returns the hand masks of players 1-3, given a dictionary
+    mapping player IDs to players.
+    """
+    return [hand_mask(players[pid].hand) for pid in range(1, 4)]
+
+def solve_game(players, rules, leader_id = 1):
+    """
+    Solves a game from the first trick. Returns the card
+    points of the declarer (including the skat, except in a
+    Null) and the defenders with perfect play by both sides.
+    """
+    solver = Solver(rules.game_type, rules.declarer_id)
+    declarer, defenders = solver.solve(deal_masks(players), leader_id)
+    skat = rules.count_points(players[rules.declarer_id].cards_won)
+    return declarer + skat, defenders
+
+def label_game(players, rules, rounds):
+    """
+    Replays a logged game and returns, for every play, a tuple
+    (play, optimal cards, declarer's points with perfect play
+    from there on). The optimal cards are indices (see
+    bitcards.py).
+    """
+    solver = Solver(rules.game_type, rules.declarer_id)
+    hands = deal_masks(players)
+    labels = []
+    for plays in rounds:
+        trick = []
+        for play in plays:
+            cards, value = solver.best_cards(hands, plays[0].pid, trick)
+            labels.append((play, cards, value))
+            card = card_index(play.card)
+            hands[play.pid - 1] &= ~(1 << card)
+            trick.append(card)
+    return labels
+
+def main(argv):
+    """
+    Solves every game in a log folder with all hands known.
+    Prints how many points the declarer would have won with
+    perfect play by both sides, next to the points they did
+    win, and how often the plays in the logs were optimal.
+
+    Usage: python(3) solver.py [log folder]
+    """
+    from feature_extractor import read_game
+
+    log_folder = argv[1] if len(argv) > 1 else "log"
+    n_games = 0
+    n_plays = 0
+    n_optimal = 0
+    start = time.time()
+    for name in sorted(os.listdir(log_folder)):
+        try:
+            with open(os.path.join(log_folder, name), "r") as log_file:
+                players, rules, rounds = read_game(log_file)
+        except Exception:
+            continue
+        declarer = players[rules.declarer_id]
+        skat = rules.count_points(declarer.cards_won)
+        points = SCORES[rules.game_type]
+        won = skat
+        for plays in rounds:
+            taken = rules.winning_play(plays).pid == rules.declarer_id
+            if taken != (rules.game_type == NULL):
+                won += sum(points[card_index(play.card)] for play in plays)
+        labels = label_game(players, rules, rounds)
+        optimal = sum(1 for play, cards, value in labels
+                      if card_index(play.card) in cards)
+        print("%-40s declarer %3d, perfect play %3d, optimal plays %2d/%d" %
+              (name, won, labels[0][2] + skat, optimal, len(labels)))
+        n_games += 1
+        n_plays += len(labels)
+        n_optimal += optimal
+    print("Solved %d games in %.2f s, %d of %d plays were optimal" %
+          (n_games, time.time() - start, n_optimal, n_plays))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
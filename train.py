@@ -0,0 +1,136 @@
+import os
+import sys
+import time
+
+import numpy as np
+
+from scipy.io import loadmat, savemat
+from scipy.optimize import minimize
+
+from predictor import *
+from feature_store import *
+
+# Number of classes for each target
+N_CLASSES = {"suit": 4, "rank": 11}
+
+# Default strength of the Gaussian prior on the parameters,
+# matching the shipped softmax_parameters.mat
+DEFAULT_C = {"suit": 1.6, "rank": 0.1}
+
+def load_features(path):
+    """
+    Loads a feature file written by feature_extractor.py, either
+    comma-separated text or binary (.bin, see feature_store.py).
+    Returns the feature matrix, with the first (label) column
+    replaced by the intercept, and the vector of labels.
+    """
+    if path.endswith(".bin"):
+        data = np.array(open_store(path), dtype = float)
+    else:
+        data = np.loadtxt(path, delimiter = ",", ndmin = 2)
+    y = data[:, 0].astype(int)
+    X = data
+    X[:, 0] = 1
+    return X, y
+
+def train_softmax(X, y, k, C, max_iter = 1000):
+    """
+    Fits softmax regression with a Gaussian prior of strength C
+    (the same model as TrainSoftmaxNewton.m) using L-BFGS.
+    Labels in y start from 0. Returns the (n x k) parameter
+    matrix, whose last column is fixed at zero like in the
+    Matlab trainers.
+    """
+    m, n = X.shape
+    Y = np.zeros((m, k))
+    Y[np.arange(m), y] = 1
+
+    def unpack(params):
+        theta = np.zeros((n, k))
+        theta[:, :k - 1] = params.reshape(n, k - 1)
+        return theta
+
+    def objective(params):
+        # Negative regularized log likelihood and its gradient
+        scores = X.dot(unpack(params))
+        scores -= scores.max(axis = 1, keepdims = True)
+        log_norm = np.log(np.exp(scores).sum(axis = 1))
+        p = np.exp(scores - log_norm[:, None])
+        likelihood = (scores * Y).sum() - log_norm.sum()
+        likelihood -= C * params.dot(params)
+        grad = X.T.dot(Y - p)[:, :k - 1].ravel() - 2 * C * params
+        return -likelihood, -grad
+
+    result = minimize(objective, np.zeros(n * (k - 1)), jac = True,
+                      method = "L-BFGS-B", options = {"maxiter": max_iter})
+    return unpack(result.x)
+
+def accuracy(X, y, theta):
+    """
+    Returns the fraction of examples whose most likely class
+    is the label.
+    """
+    return np.mean(np.argmax(X.dot(theta), axis = 1) == y)
+
+def save_parameters(path, target, theta, C):
+    """
+    Writes the parameters for the given target to a .mat file
+    in the layout of softmax_parameters.mat, keeping the
+    parameters of the other target if the file already exists.
+    Both PredictSuitSoftmax.m/PredictRankSoftmax.m and the
+    NumPy predictor ("numpy:softmax:[path]") can load it.
+    """
+    params = {}
+    if os.path.exists(path):
+        params = dict((key, value) for key, value in loadmat(path).items()
+                      if not key.startswith("__"))
+    params["theta_" + target] = theta
+    params["C_" + target] = float(C)
+    params["n_" + target] = theta.shape[0]
+    savemat(path, params)
+
+def main(argv):
+    """
+    Trains a softmax model for suit or rank prediction.
+
+    Usage: python(3) train.py [suit|rank] [options]
+
+    Options are:
+    'i [file]' - Feature file (default feature/[target]/combined.txt)
+    'o [file]' - Parameter file to write (default
+                 softmax_parameters.mat)
+    'c [number]' - Strength of the prior (default 1.6 for suit,
+                   0.1 for rank)
+    """
+    if len(argv) < 2 or argv[1] not in N_CLASSES:
+        print("Usage: python(3) train.py [suit|rank] [-i features] "
+              "[-o parameters] [-c prior]")
+        return 1
+    target = argv[1]
+    in_path = "feature/" + target + "/combined.txt"
+    if '-i' in argv:
+        index = argv.index('-i')
+        in_path = argv[index + 1]
+    out_path = "softmax_parameters.mat"
+    if '-o' in argv:
+        index = argv.index('-o')
+        out_path = argv[index + 1]
+    C = DEFAULT_C[target]
+    if '-c' in argv:
+        index = argv.index('-c')
+        C = float(argv[index + 1])
+
+    start = time.time()
+    X, y = load_features(in_path)
+    theta = train_softmax(X, y, N_CLASSES[target], C)
+    elapsed = time.time() - start
+    save_parameters(out_path, target, theta, C)
+
+    print("Trained %s model on %d examples in %.2f s" %
+          (target, X.shape[0], elapsed))
+    print("Training accuracy: %.3f" % accuracy(X, y, theta))
+    print("Wrote parameters to " + out_path)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))